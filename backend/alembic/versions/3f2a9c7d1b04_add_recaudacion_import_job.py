@@ -0,0 +1,48 @@
+"""add recaudacion_import_job
+
+Revision ID: 3f2a9c7d1b04
+Revises: d5cd8454fbf3
+Create Date: 2026-10-19 09:12:40.118532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c7d1b04'
+down_revision = 'd5cd8454fbf3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('recaudacion_import_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('recaudacion_id', sa.Integer(), nullable=False),
+    sa.Column('fichero_id', sa.Integer(), nullable=True),
+    sa.Column('usuario_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('progress', sa.Integer(), nullable=True),
+    sa.Column('total_rows', sa.Integer(), nullable=True),
+    sa.Column('updated_rows', sa.Integer(), nullable=True),
+    sa.Column('result', sa.JSON(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['recaudacion_id'], ['recaudacion.id'], ),
+    sa.ForeignKeyConstraint(['fichero_id'], ['recaudacion_fichero.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['usuario_id'], ['usuario.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_recaudacion_import_job_id'), 'recaudacion_import_job', ['id'], unique=False)
+    op.create_index(op.f('ix_recaudacion_import_job_recaudacion_id'), 'recaudacion_import_job', ['recaudacion_id'], unique=False)
+    op.create_index(op.f('ix_recaudacion_import_job_status'), 'recaudacion_import_job', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_recaudacion_import_job_status'), table_name='recaudacion_import_job')
+    op.drop_index(op.f('ix_recaudacion_import_job_recaudacion_id'), table_name='recaudacion_import_job')
+    op.drop_index(op.f('ix_recaudacion_import_job_id'), table_name='recaudacion_import_job')
+    op.drop_table('recaudacion_import_job')
@@ -0,0 +1,46 @@
+"""add content hash and recaudacion_importacion
+
+Revision ID: 8b41e6f0c2d7
+Revises: 3f2a9c7d1b04
+Create Date: 2026-10-19 11:02:17.490213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41e6f0c2d7'
+down_revision = '3f2a9c7d1b04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('recaudacion_fichero', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_recaudacion_fichero_content_hash'), 'recaudacion_fichero', ['content_hash'], unique=False)
+    op.create_table('recaudacion_importacion',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('recaudacion_id', sa.Integer(), nullable=False),
+    sa.Column('fichero_id', sa.Integer(), nullable=True),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('is_normalized', sa.Boolean(), nullable=True),
+    sa.Column('rows', sa.JSON(), nullable=True),
+    sa.Column('result', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['recaudacion_id'], ['recaudacion.id'], ),
+    sa.ForeignKeyConstraint(['fichero_id'], ['recaudacion_fichero.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_recaudacion_importacion_id'), 'recaudacion_importacion', ['id'], unique=False)
+    op.create_index(op.f('ix_recaudacion_importacion_recaudacion_id'), 'recaudacion_importacion', ['recaudacion_id'], unique=False)
+    op.create_index(op.f('ix_recaudacion_importacion_content_hash'), 'recaudacion_importacion', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_recaudacion_importacion_content_hash'), table_name='recaudacion_importacion')
+    op.drop_index(op.f('ix_recaudacion_importacion_recaudacion_id'), table_name='recaudacion_importacion')
+    op.drop_index(op.f('ix_recaudacion_importacion_id'), table_name='recaudacion_importacion')
+    op.drop_table('recaudacion_importacion')
+    op.drop_index(op.f('ix_recaudacion_fichero_content_hash'), table_name='recaudacion_fichero')
+    op.drop_column('recaudacion_fichero', 'content_hash')
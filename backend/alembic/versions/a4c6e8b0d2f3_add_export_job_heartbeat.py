@@ -0,0 +1,26 @@
+"""add worker_id and heartbeat_at to recaudacion_export_job
+
+Revision ID: a4c6e8b0d2f3
+Revises: f5b2d8e4a6c1
+Create Date: 2026-10-19 21:05:14.370219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c6e8b0d2f3'
+down_revision = 'f5b2d8e4a6c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('recaudacion_export_job', sa.Column('worker_id', sa.String(), nullable=True))
+    op.add_column('recaudacion_export_job', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('recaudacion_export_job', 'heartbeat_at')
+    op.drop_column('recaudacion_export_job', 'worker_id')
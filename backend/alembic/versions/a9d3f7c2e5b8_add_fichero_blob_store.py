@@ -0,0 +1,36 @@
+"""add fichero_blob store
+
+Revision ID: a9d3f7c2e5b8
+Revises: f2c8e4a6b9d1
+Create Date: 2026-10-19 17:48:05.772614
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d3f7c2e5b8'
+down_revision = 'f2c8e4a6b9d1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('fichero_blob',
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('file_size', sa.BigInteger(), nullable=True),
+    sa.Column('ref_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('content_hash')
+    )
+    op.add_column('recaudacion_fichero', sa.Column('blob_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_recaudacion_fichero_blob_hash'), 'recaudacion_fichero', ['blob_hash'], unique=False)
+    op.create_foreign_key('recaudacion_fichero_blob_hash_fkey', 'recaudacion_fichero', 'fichero_blob', ['blob_hash'], ['content_hash'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('recaudacion_fichero_blob_hash_fkey', 'recaudacion_fichero', type_='foreignkey')
+    op.drop_index(op.f('ix_recaudacion_fichero_blob_hash'), table_name='recaudacion_fichero')
+    op.drop_column('recaudacion_fichero', 'blob_hash')
+    op.drop_table('fichero_blob')
@@ -0,0 +1,24 @@
+"""add usuario auth_version
+
+Revision ID: b6e1c8d4f7a2
+Revises: a9d3f7c2e5b8
+Create Date: 2026-10-19 18:31:16.094433
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1c8d4f7a2'
+down_revision = 'a9d3f7c2e5b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('usuario', sa.Column('auth_version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('usuario', 'auth_version')
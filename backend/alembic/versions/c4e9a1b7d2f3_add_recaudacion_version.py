@@ -0,0 +1,24 @@
+"""add recaudacion content version
+
+Revision ID: c4e9a1b7d2f3
+Revises: 8b41e6f0c2d7
+Create Date: 2026-10-19 13:41:05.118302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e9a1b7d2f3'
+down_revision = '8b41e6f0c2d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('recaudacion', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('recaudacion', 'version')
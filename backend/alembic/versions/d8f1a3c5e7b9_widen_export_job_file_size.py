@@ -0,0 +1,25 @@
+"""widen recaudacion_export_job file_size to bigint
+
+Revision ID: d8f1a3c5e7b9
+Revises: b6e1c8d4f7a2
+Create Date: 2026-10-19 18:40:12.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8f1a3c5e7b9'
+down_revision = 'b6e1c8d4f7a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Artifacts over 2 GB overflowed Integer
+    op.alter_column('recaudacion_export_job', 'file_size', existing_type=sa.Integer(), type_=sa.BigInteger(), existing_nullable=True)
+
+
+def downgrade() -> None:
+    op.alter_column('recaudacion_export_job', 'file_size', existing_type=sa.BigInteger(), type_=sa.Integer(), existing_nullable=True)
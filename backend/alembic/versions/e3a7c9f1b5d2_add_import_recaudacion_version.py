@@ -0,0 +1,25 @@
+"""add recaudacion_version to recaudacion_importacion
+
+Revision ID: e3a7c9f1b5d2
+Revises: d8f1a3c5e7b9
+Create Date: 2026-10-19 19:12:45.608321
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a7c9f1b5d2'
+down_revision = 'd8f1a3c5e7b9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing imports get NULL: the next re-import of their content is applied again
+    op.add_column('recaudacion_importacion', sa.Column('recaudacion_version', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('recaudacion_importacion', 'recaudacion_version')
@@ -0,0 +1,50 @@
+"""add recaudacion_export_job
+
+Revision ID: e7b3d5a9c1f8
+Revises: c4e9a1b7d2f3
+Create Date: 2026-10-19 16:12:48.203557
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3d5a9c1f8'
+down_revision = 'c4e9a1b7d2f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('recaudacion_export_job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=True),
+    sa.Column('kind', sa.String(), nullable=False),
+    sa.Column('params', sa.JSON(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('progress', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('file_path', sa.String(), nullable=True),
+    sa.Column('filename', sa.String(), nullable=True),
+    sa.Column('content_type', sa.String(), nullable=True),
+    sa.Column('file_size', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['usuario_id'], ['usuario.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_recaudacion_export_job_id'), 'recaudacion_export_job', ['id'], unique=False)
+    op.create_index(op.f('ix_recaudacion_export_job_usuario_id'), 'recaudacion_export_job', ['usuario_id'], unique=False)
+    op.create_index(op.f('ix_recaudacion_export_job_status'), 'recaudacion_export_job', ['status'], unique=False)
+    op.create_index(op.f('ix_recaudacion_export_job_expires_at'), 'recaudacion_export_job', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_recaudacion_export_job_expires_at'), table_name='recaudacion_export_job')
+    op.drop_index(op.f('ix_recaudacion_export_job_status'), table_name='recaudacion_export_job')
+    op.drop_index(op.f('ix_recaudacion_export_job_usuario_id'), table_name='recaudacion_export_job')
+    op.drop_index(op.f('ix_recaudacion_export_job_id'), table_name='recaudacion_export_job')
+    op.drop_table('recaudacion_export_job')
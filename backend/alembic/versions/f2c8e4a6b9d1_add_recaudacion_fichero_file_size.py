@@ -0,0 +1,24 @@
+"""add recaudacion_fichero file_size
+
+Revision ID: f2c8e4a6b9d1
+Revises: e7b3d5a9c1f8
+Create Date: 2026-10-19 17:02:31.518820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8e4a6b9d1'
+down_revision = 'e7b3d5a9c1f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('recaudacion_fichero', sa.Column('file_size', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('recaudacion_fichero', 'file_size')
@@ -0,0 +1,26 @@
+"""add worker_id and heartbeat_at to recaudacion_import_job
+
+Revision ID: f5b2d8e4a6c1
+Revises: e3a7c9f1b5d2
+Create Date: 2026-10-19 19:47:31.882590
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5b2d8e4a6c1'
+down_revision = 'e3a7c9f1b5d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('recaudacion_import_job', sa.Column('worker_id', sa.String(), nullable=True))
+    op.add_column('recaudacion_import_job', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('recaudacion_import_job', 'heartbeat_at')
+    op.drop_column('recaudacion_import_job', 'worker_id')
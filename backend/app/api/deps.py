@@ -1,5 +1,5 @@
 from typing import Generator, Optional
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from pydantic import ValidationError
@@ -8,9 +8,12 @@ from sqlalchemy.future import select
 
 from app.core.config import settings
 from app.core import security
-from app.db.session import get_db
-from sqlalchemy.orm import joinedload
-from app.models.user import Usuario, UsuarioSalon
+from app.core.principal_cache import Principal, principal_cache, PERMISSION_BITS
+from app.core.salon_scope import SalonScope
+from app.core.slow_queries import note_user
+from app.db.session import get_db, AsyncSessionLocal, ReadSessionLocal
+from sqlalchemy.orm import joinedload, selectinload
+from app.models.user import Usuario
 from app.schemas.token import TokenPayload
 
 # OAuth2 scheme
@@ -18,10 +21,7 @@ reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
 )
 
-async def get_current_user(
-    db: AsyncSession = Depends(get_db),
-    token: str = Depends(reusable_oauth2)
-) -> Usuario:
+def _decode_token(token: str) -> TokenPayload:
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
@@ -32,26 +32,164 @@ async def get_current_user(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    
-    # Eagerly load assigned salons and their salon details
+    note_user(token_data.sub) # Slow-query log records
+    return token_data
+
+# Read-your-writes: clients send this header for a few seconds after their own
+# mutations, so read endpoints do not answer from a replica that is still behind
+READ_PRIMARY_HEADER = "X-Read-Primary"
+
+def read_session_factory(request: Request):
+    if request.headers.get(READ_PRIMARY_HEADER):
+        return AsyncSessionLocal
+    return ReadSessionLocal
+
+async def get_read_db(request: Request):
+    """
+    Session for read-only endpoints (stats, listings, exports): the read replica when
+    READ_DATABASE_URL is set, the primary otherwise or with the X-Read-Primary header.
+    """
+    async with read_session_factory(request)() as session:
+        yield session
+
+async def get_current_user(
+    db: AsyncSession = Depends(get_db),
+    token: str = Depends(reusable_oauth2)
+) -> Principal:
+    token_data = _decode_token(token)
+    user_id = int(token_data.sub)
+
+    # Cached snapshot for this user / auth version (skips the DB entirely)
+    principal = principal_cache.get(user_id, token_data.av)
+    if principal is None:
+        principal = await load_principal(db, user_id)
+        principal_cache.put(token_data.av, principal)
+
+    if not principal.activo:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return principal
+
+async def load_principal(db: AsyncSession, user_id: int) -> Principal:
+    # Eagerly load assigned salon permissions and roles (admin flag)
     result = await db.execute(
         select(Usuario)
         .options(
-            joinedload(Usuario.salones_asignados).joinedload(UsuarioSalon.salon)
+            joinedload(Usuario.salones_asignados),
+            selectinload(Usuario.roles)
         )
-        .where(Usuario.id == int(token_data.sub))
+        .where(Usuario.id == user_id)
     )
     user = result.scalars().unique().first()
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    if not user.activo:
+    return Principal.from_user(user)
+
+async def get_query_token_principal(db: AsyncSession, token: Optional[str]) -> Principal:
+    """
+    Principal for a token passed as ?token= (links the browser opens itself, e.g. file
+    content). Always loaded from the database: inactive users and tokens issued before the
+    user's current auth_version are rejected.
+    """
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    token_data = _decode_token(token)
+    principal = await load_principal(db, int(token_data.sub))
+    if not principal.activo:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return user
+    if token_data.av != principal.auth_version:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Permissions changed, renew the token",
+            headers={"X-Token-Renew": "true"},
+        )
+    return principal
 
 async def get_current_active_user(
-    current_user: Usuario = Depends(get_current_user),
-) -> Usuario:
+    current_user: Principal = Depends(get_current_user),
+) -> Principal:
     if not current_user.activo:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+async def get_current_admin_user(
+    current_user: Principal = Depends(get_current_active_user),
+) -> Principal:
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin only")
+    return current_user
+
+async def get_token_principal(
+    db: AsyncSession = Depends(get_db),
+    token: str = Depends(reusable_oauth2)
+) -> Principal:
+    """
+    Authorize from a permission token (TOKEN_PERMISSIONS) alone: salons and flags come
+    from its claims, only the user's current auth_version is checked (cached, one small
+    query per TTL). A stale version answers 401 so the client renews the token through
+    /login/renew-token. Tokens without permission claims go through get_current_user.
+    """
+    token_data = _decode_token(token)
+    if token_data.perms is None or token_data.av is None:
+        return await get_current_user(db, token)
+
+    user_id = int(token_data.sub)
+    current_version = principal_cache.get_version(user_id)
+    if current_version is None:
+        row = (await db.execute(
+            select(Usuario.auth_version, Usuario.activo).where(Usuario.id == user_id)
+        )).first()
+        if not row:
+            raise HTTPException(status_code=404, detail="User not found")
+        if not row.activo:
+            raise HTTPException(status_code=400, detail="Inactive user")
+        current_version = row.auth_version
+        principal_cache.put_version(user_id, current_version)
+
+    if token_data.av != current_version:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Permissions changed, renew the token",
+            headers={"X-Token-Renew": "true"},
+        )
+    return Principal.from_token(token_data)
+
+def require_salon_permission(permission: str):
+    """
+    Dependency factory: the salon_id path or query parameter must be granted `permission`
+    (a UsuarioSalon flag) to the token's principal. Returns the principal.
+    """
+    if permission not in PERMISSION_BITS:
+        raise ValueError(f"Unknown permission: {permission}")
+
+    async def check_salon_permission(
+        request: Request,
+        principal: Principal = Depends(get_token_principal),
+    ) -> Principal:
+        salon_id = request.path_params.get("salon_id") or request.query_params.get("salon_id")
+        if salon_id is None:
+            raise HTTPException(status_code=400, detail="salon_id is required")
+        try:
+            salon_id = int(salon_id)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="salon_id must be an integer")
+        if not principal.has_permission(salon_id, permission):
+            raise HTTPException(status_code=403, detail=f"Not allowed ({permission}) for this salon")
+        return principal
+
+    return check_salon_permission
+
+def salon_scope(permission: str):
+    """
+    Dependency factory: the salons the principal may read for `permission`, as a
+    SalonScope to filter queries with (unrestricted for admins).
+    """
+    if permission not in PERMISSION_BITS:
+        raise ValueError(f"Unknown permission: {permission}")
+
+    async def get_salon_scope(
+        principal: Principal = Depends(get_token_principal),
+    ) -> SalonScope:
+        return SalonScope(principal.allowed_salons(permission))
+
+    return get_salon_scope
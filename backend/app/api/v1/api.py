@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.v1.endpoints import login, users, salones, machines, recaudaciones, stats, roles
+from app.api.v1.endpoints import login, users, salones, machines, recaudaciones, stats, roles, exports, system
 
 api_router = APIRouter()
 api_router.include_router(login.router, tags=["login"])
@@ -9,3 +9,5 @@ api_router.include_router(machines.router, prefix="/maquinas", tags=["maquinas"]
 api_router.include_router(recaudaciones.router, prefix="/recaudaciones", tags=["recaudaciones"])
 api_router.include_router(stats.router, prefix="/stats", tags=["stats"])
 api_router.include_router(roles.router, prefix="/roles", tags=["roles"])
+api_router.include_router(exports.router, prefix="/exports", tags=["exports"])
+api_router.include_router(system.router, prefix="/system", tags=["system"])
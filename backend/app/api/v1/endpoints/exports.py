@@ -0,0 +1,175 @@
+from typing import Any, List, Optional
+from datetime import date, datetime
+import asyncio
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api import deps
+from app.crud.crud_recaudacion import recaudacion_facts_query
+from app.core.snapshot import write_snapshot, load_manifest
+from app.core.export_stream import stream_facts
+from app.core.export_jobs import export_queue
+from app.core.principal_cache import Principal
+from app.core.salon_scope import SalonScope
+from app.db.session import AsyncSessionLocal, get_db
+from app.models.recaudacion import RecaudacionExportJob
+from app.models.user import Usuario
+from app.schemas.recaudacion import RecaudacionExportJob as RecaudacionExportJobSchema, RecaudacionExportJobCreate
+
+router = APIRouter()
+
+@router.get("/recaudacion-maquina")
+async def export_recaudacion_maquina_facts(
+    request: Request,
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    salon_ids: Optional[List[int]] = Query(None),
+    scope: SalonScope = Depends(deps.salon_scope("ver_recaudaciones")),
+) -> Any:
+    """
+    Raw RecaudacionMaquina facts (with salon, machine, puesto and recaudacion dates) as
+    CSV or NDJSON, of the salons the user can see recaudaciones of. Read through a
+    server-side cursor and streamed in chunks, so memory stays flat regardless of the
+    number of rows.
+    """
+    stmt = recaudacion_facts_query(
+        fecha_desde=fecha_desde, fecha_hasta=fecha_hasta, scope=scope.restrict(salon_ids)
+    )
+
+    if fmt == "csv":
+        media_type = "text/csv"
+        filename = "recaudacion_maquina.csv"
+    else:
+        media_type = "application/x-ndjson"
+        filename = "recaudacion_maquina.ndjson"
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Access-Control-Expose-Headers': 'Content-Disposition'
+    }
+    chunks = stream_facts(stmt, fmt, session_factory=deps.read_session_factory(request))
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+# One snapshot run at a time per process
+_snapshot_lock = asyncio.Lock()
+
+
+@router.post("/snapshot")
+async def create_snapshot(
+    incremental: bool = Query(False),
+    current_user: Principal = Depends(deps.get_current_admin_user),
+) -> Any:
+    """
+    Write the Parquet snapshot of the revenue facts (partitioned by year and salon).
+    With incremental=true only partitions with recaudaciones changed since the last
+    snapshot are rewritten. Admin only.
+    """
+    if _snapshot_lock.locked():
+        raise HTTPException(409, "A snapshot is already running")
+    async with _snapshot_lock:
+        async with AsyncSessionLocal() as db:
+            return await write_snapshot(db, incremental=incremental)
+
+
+@router.get("/snapshot")
+async def read_snapshot_status(
+    current_user: Usuario = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Last snapshot: creation time, mode and number of recaudaciones included.
+    """
+    manifest = await asyncio.to_thread(load_manifest)
+    if not manifest:
+        raise HTTPException(404, "No snapshot yet")
+    return {
+        "created_at": manifest["created_at"],
+        "mode": manifest["mode"],
+        "recaudaciones": len(manifest["recaudaciones"]),
+    }
+
+
+@router.post("/jobs", response_model=RecaudacionExportJobSchema)
+async def create_export_job(
+    job_in: RecaudacionExportJobCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: Usuario = Depends(deps.get_current_active_user),
+    scope: SalonScope = Depends(deps.salon_scope("ver_recaudaciones")),
+) -> Any:
+    """
+    Queue a bulk export and return the job; poll /jobs/{id} and fetch /jobs/{id}/download
+    once it is done. kind=xlsx builds the multi-recaudacion workbook (salon_ids, fecha_desde
+    and fecha_hasta required), csv/ndjson the raw detail facts.
+    The job runs without the user: salon_ids is narrowed here to the salons the user can
+    see recaudaciones of (all of them when not given).
+    """
+    if job_in.kind == "xlsx" and not (job_in.salon_ids and job_in.fecha_desde and job_in.fecha_hasta):
+        raise HTTPException(400, "xlsx exports need salon_ids, fecha_desde and fecha_hasta")
+    if job_in.fecha_desde and job_in.fecha_hasta and job_in.fecha_desde > job_in.fecha_hasta:
+        raise HTTPException(400, "fecha_desde must be before fecha_hasta")
+    scope = scope.restrict(job_in.salon_ids)
+    if not scope.unrestricted:
+        if not scope.salon_ids:
+            raise HTTPException(403, "Not allowed (ver_recaudaciones) for the requested salons")
+        job_in.salon_ids = sorted(scope.salon_ids)
+
+    job = RecaudacionExportJob(
+        usuario_id=current_user.id,
+        kind=job_in.kind,
+        params=job_in.model_dump(mode="json", exclude={"kind"}),
+        status="pending",
+        progress=0,
+        created_at=datetime.now()
+    )
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+
+    export_queue.enqueue(job.id)
+    return job
+
+
+async def _get_own_job(db: AsyncSession, job_id: int, user: Usuario) -> RecaudacionExportJob:
+    job = await db.get(RecaudacionExportJob, job_id)
+    if not job or job.usuario_id != user.id:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=RecaudacionExportJobSchema)
+async def read_export_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: Usuario = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Get status and progress of a background export job.
+    """
+    return await _get_own_job(db, job_id, current_user)
+
+
+@router.get("/jobs/{job_id}/download")
+async def download_export_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: Usuario = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Download the artifact of a finished export job (until it expires).
+    """
+    job = await _get_own_job(db, job_id, current_user)
+    if job.status == "expired" or (job.expires_at and job.expires_at <= datetime.now()):
+        raise HTTPException(410, "Export expired, create a new job")
+    if job.status != "done":
+        raise HTTPException(409, f"Export not ready (status: {job.status})")
+    if not job.file_path or not os.path.exists(job.file_path):
+        raise HTTPException(404, "Export file not found")
+
+    return FileResponse(
+        path=job.file_path,
+        filename=job.filename,
+        media_type=job.content_type,
+        headers={'Access-Control-Expose-Headers': 'Content-Disposition'}
+    )
@@ -24,32 +24,56 @@ async def login_access_token(
     result = await db.execute(select(Usuario).where(Usuario.username == form_data.username))
     user = result.scalars().first()
     
-    if not user or not security.verify_password(form_data.password, user.hash_password):
+    # Verified in the password hashing pool, off the event loop
+    valid, new_hash = False, None
+    if user:
+        try:
+            valid, new_hash = await security.verify_and_update_password_async(form_data.password, user.hash_password)
+        except security.PasswordHashBusy as e:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"})
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect email or password"
         )
     if not user.activo:
         raise HTTPException(status_code=400, detail="Inactive user")
+
+    # Transparent upgrade of deprecated (bcrypt) hashes
+    if new_hash:
+        user.hash_password = new_hash
+        db.add(user)
+        await db.commit()
         
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     return {
-        "access_token": security.create_access_token(
-            user.id, expires_delta=access_token_expires
-        ),
+        "access_token": await _issue_token(db, user.id),
         "token_type": "bearer",
     }
 
 @router.post("/login/renew-token", response_model=Token)
 async def renew_token(
+    db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(deps.get_current_active_user),
 ) -> Any:
     """
     Renew access token for the current user.
+    Also the way to pick up changed permissions (401 with X-Token-Renew from permission tokens).
     """
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     return {
-        "access_token": security.create_access_token(
-            current_user.id, expires_delta=access_token_expires
-        ),
+        "access_token": await _issue_token(db, current_user.id),
         "token_type": "bearer",
     }
+
+async def _issue_token(db: AsyncSession, user_id: int) -> str:
+    # Fresh from the DB (not the principal cache): the token carries the current auth version
+    principal = await deps.load_principal(db, user_id)
+    if not principal.activo:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    deps.principal_cache.put(principal.auth_version, principal)
+
+    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    return security.create_access_token(
+        principal.id,
+        expires_delta=access_token_expires,
+        auth_version=principal.auth_version,
+        claims=principal.token_claims() if settings.TOKEN_PERMISSIONS else None
+    )
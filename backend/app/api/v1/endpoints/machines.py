@@ -1,6 +1,8 @@
 from typing import Any, List, Optional
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.api import deps
+from app.core.salon_scope import SalonScope
 from app.db.session import get_db
 from app.crud.crud_machine import maquina, tipo_maquina, grupo_maquina, puesto
 from app.schemas.machine import (
@@ -98,12 +100,13 @@ async def read_machines(
     skip: int = 0,
     limit: int = 100,
     salon_id: Optional[int] = None,
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(deps.get_read_db),
+    scope: SalonScope = Depends(deps.salon_scope("puede_ver")),
 ) -> Any:
     """
-    Retrieve machines.
+    Retrieve machines (of the salons the user can see).
     """
-    machines = await maquina.get_multi(db, skip=skip, limit=limit, salon_id=salon_id)
+    machines = await maquina.get_multi(db, skip=skip, limit=limit, salon_id=salon_id, scope=scope)
     return machines
 
 @router.post("/", response_model=MaquinaSchema)
@@ -1,31 +1,41 @@
 from typing import Any, List, Optional
-from datetime import datetime
+from collections import defaultdict
+from datetime import date, datetime
+import asyncio
+import hashlib
 import shutil
+import time
 import os
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, status, Form, Response
-from fastapi.responses import FileResponse
-from jose import jwt, JWTError
-from pydantic import ValidationError
-from app.core.config import settings
-from app.schemas.token import TokenPayload
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, status, Form, Response, Request
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, joinedload, selectinload
 from sqlalchemy.future import select
+from sqlalchemy import func
 from app.db.session import get_db
-from app.crud.crud_recaudacion import recaudacion, recaudacion_maquina
+from app.crud.crud_recaudacion import (
+    recaudacion, recaudacion_maquina, recalculate_estimated_taxes, recalculate_tasa_diferencia
+)
 from app.schemas.recaudacion import (
     Recaudacion as RecaudacionSchema, RecaudacionSummary, RecaudacionCreate, RecaudacionUpdate,
     RecaudacionMaquina as RecaudacionMaquinaSchema, RecaudacionMaquinaUpdate,
-    RecaudacionFichero as RecaudacionFicheroSchema
+    RecaudacionFichero as RecaudacionFicheroSchema, RecaudacionImportJob as RecaudacionImportJobSchema
 )
-from app.models.recaudacion import RecaudacionFichero, Recaudacion, RecaudacionMaquina
+from app.models.recaudacion import RecaudacionFichero, Recaudacion, RecaudacionMaquina, RecaudacionImportJob
+from app.core import metrics
+from app.core.import_jobs import import_queue
+from app.core.excel_import import sniff_workbook
+from app.core.excel_export import build_recaudacion_workbook
+from app.core.export_stream import export_sheets_data, range_workbook_data, stream_combined_workbook
+from app.core.export_cache import export_cache
+from app.core.file_storage import UploadTooLarge, save_upload, read_upload, read_bytes, hash_file, blob_store
+from app.core.storage_gc import legacy_dir
+from app.core.salon_scope import SalonScope
 from app.api import deps
 from app.models.user import Usuario
 from app.models.user import Usuario
 from app.models.machine import MaquinaExcelMap, Puesto, Maquina
 from app.models.salon import Salon
-import pandas as pd
-from io import BytesIO
 import json
 from sqlalchemy.dialects.postgresql import insert
 
@@ -35,7 +45,7 @@ router = APIRouter()
 async def get_last_recaudacion_date(
     salon_id: int,
     db: AsyncSession = Depends(get_db),
-    current_user: Usuario = Depends(deps.get_current_active_user),
+    current_user: Usuario = Depends(deps.require_salon_permission("ver_recaudaciones")),
 ) -> Any:
     """
     Get the end date of the last Recaudacion for a Salon.
@@ -52,14 +62,13 @@ async def read_recaudaciones(
     skip: int = 0,
     limit: int = 100,
     salon_id: Optional[int] = None,
-    db: AsyncSession = Depends(get_db),
-    current_user: Usuario = Depends(deps.get_current_active_user),
+    db: AsyncSession = Depends(deps.get_read_db),
+    scope: SalonScope = Depends(deps.salon_scope("ver_recaudaciones")),
 ) -> Any:
     """
-    Retrieve recaudaciones.
+    Retrieve recaudaciones (only of salons the user can see recaudaciones of).
     """
-    recaudaciones = await recaudacion.get_multi(db, skip=skip, limit=limit, salon_id=salon_id)
-    recaudaciones = await recaudacion.get_multi(db, skip=skip, limit=limit, salon_id=salon_id)
+    recaudaciones = await recaudacion.get_multi(db, skip=skip, limit=limit, salon_id=salon_id, scope=scope)
     return recaudaciones
 
 from pydantic import BaseModel
@@ -79,124 +88,144 @@ async def parse_recaudacion_metadata(
     """
     Parse Excel file to extract metadata for form pre-filling.
     """
-    contents = await file.read()
+    contents = await _read_upload(file)
     try:
-        df = pd.read_excel(BytesIO(contents), header=None)
-    except Exception as e:
-         return {"is_normalized": False, "error": f"Error parsing excel: {str(e)}"}
+        meta = await asyncio.to_thread(sniff_workbook, contents)
+    except ValueError as e:
+         return {"is_normalized": False, "error": str(e)}
 
-    # Check for Normalization (Version 1.0 in D3)
-    is_normalized = False
-    try:
-        if df.shape[0] > 3 and df.shape[1] > 4:
-            val = df.iloc[2, 3] # D3
-            if pd.notna(val) and isinstance(val, str) and "VERSION" in val.upper():
-                is_normalized = True
-    except:
-        pass
-    
-    if not is_normalized:
+    if not meta["is_normalized"]:
         return {"is_normalized": False}
 
-    # Extract Data if Normalized
-    # A1: "SALON: {Name}" (Row 0, Col 0)
-    # E1: End Date (Row 0, Col 4) -> Current Recaudacion Date -> Form End Date
-    # E2: Start Date (Row 1, Col 4) -> Previous Recaudacion Date -> Form Start Date
-    
-    res = {"is_normalized": True}
-    
-    # Salon
-    try:
-        # Export format might be "SALON: Nombre" in A1 OR "SALON" in A1 and Name in B1
-        cell_val = df.iloc[0, 0] # A1
-        print(f"DEBUG: Parsing metadata. A1 value: '{cell_val}'")
-        
-        salon_name = None
-        
-        if pd.notna(cell_val) and isinstance(cell_val, str):
-            clean_a1 = cell_val.strip().upper()
-            if clean_a1 == "SALON" or clean_a1 == "SALON:":
-                # Name is in B1
-                val_b1 = df.iloc[0, 1]
-                print(f"DEBUG: A1 is label. Checking B1: '{val_b1}'")
-                if pd.notna(val_b1) and isinstance(val_b1, str):
-                    salon_name = val_b1.strip()
-            elif "SALON:" in clean_a1:
-                 # Name is in A1
-                 salon_name = cell_val.replace("SALON:", "").replace("Salon:", "").strip()
-            else:
-                 # Assuming A1 is the name directly? Or B1?
-                 # Let's try B1 just in case
-                 pass
-        
-        if not salon_name:
-             # Fallback: Try B1 directly if A1 failed to provide a name
-             val_b1 = df.iloc[0, 1]
-             if pd.notna(val_b1) and isinstance(val_b1, str):
-                 salon_name = val_b1.strip()
-
-        if salon_name:
-            print(f"DEBUG: Final extracted salon name: '{salon_name}'")
-            
-            # Find Salon by Name (Try exact first, then contained?)
-            stmt = select(Salon).where(Salon.nombre.ilike(salon_name))
-            salon = (await db.execute(stmt)).scalars().first()
-            
-            if not salon:
-                print(f"DEBUG: Exact match failed for '{salon_name}'. Trying containment.")
-                stmt = select(Salon).where(Salon.activo == True)
-                all_salons = (await db.execute(stmt)).scalars().all()
-                for s in all_salons:
-                    # Robust fuzzy match
-                    # Check if DB name is in CSV name OR CSV name is in DB Name
-                    if s.nombre.lower() in salon_name.lower() or salon_name.lower() in s.nombre.lower():
-                        salon = s
-                        print(f"DEBUG: Fuzzy match found: '{s.nombre}'")
-                        break
-            
-            if salon:
-                res["salon_id"] = salon.id
-                print(f"DEBUG: Matched Salon ID: {salon.id}")
-            else:
-                 print(f"DEBUG: No salon matched for '{salon_name}'")
-        else:
-            print("DEBUG: Could not extract any salon name string.")
-    except Exception as e:
-        print(f"Error parsing salon: {e}")
-
-    # Dates
-    def parse_date(val):
-        if isinstance(val, datetime):
-            return val
-        if isinstance(val, str):
-            try:
-                return datetime.fromisoformat(val)
-            except:
-                pass
-        return None
+    # Fecha Inicio = Start of period (E2), Fecha Fin = End of period (E1)
+    res = {"is_normalized": True, "fecha_inicio": meta["fecha_inicio"], "fecha_fin": meta["fecha_fin"]}
 
-    try:
-        # E1 (Row 0, Col 4) is DATE OF THIS RECAUDACION (End Date)
-        # E2 (Row 1, Col 4) is DATE OF PREVIOUS (Start Date)
-        
-        val_e1 = df.iloc[0, 4] # E1
-        val_e2 = df.iloc[1, 4] # E2
-        
-        # Current Form Logic:
-        # Fecha Inicio = Start of period (E2)
-        # Fecha Fin = End of period (E1)
-        
-        if pd.notna(val_e2):
-             res["fecha_inicio"] = val_e2
-             
-        if pd.notna(val_e1):
-             res["fecha_fin"] = val_e1
-            
-    except Exception as e:
-        print(f"Error parsing dates: {e}")
+    if meta["salon_name"]:
+        all_salons = (await db.execute(select(Salon))).scalars().all()
+        salon = _match_salon(meta["salon_name"], all_salons)
+        if salon:
+            res["salon_id"] = salon.id
 
     return res
 
+def _match_salon(salon_name: str, salons: List[Salon]) -> Optional[Salon]:
+    # Exact (case-insensitive) match first
+    for s in salons:
+        if s.nombre and s.nombre.lower() == salon_name.lower():
+            return s
+    # Robust fuzzy match on active salons:
+    # Check if DB name is in Excel name OR Excel name is in DB Name
+    for s in salons:
+        if s.activo and s.nombre and (s.nombre.lower() in salon_name.lower() or salon_name.lower() in s.nombre.lower()):
+            return s
+    return None
+
+@router.post("/batch-import")
+async def batch_import_recaudaciones(
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: Usuario = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Import many normalized (v1.0) workbooks at once, e.g. one per salon at month end.
+    Salon and dates are detected from A1/B1/E1/E2; the matching recaudacion is located
+    (same salon and end date) or created, the file is stored and its rows imported.
+    Each file is committed on its own; one that fails leaves nothing behind (its stored
+    file and the recaudacion created for it are deleted).
+    """
+    # 1. Read uploads and parse all workbooks in parallel (process pool)
+    uploads = [(f.filename, f.content_type, await _read_upload(f)) for f in files]
+    parsed_list = await asyncio.gather(
+        *(import_queue.parse_batch(contents) for _, _, contents in uploads),
+        return_exceptions=True
+    )
+
+    all_salons = (await db.execute(select(Salon))).scalars().all()
+
+    results = []
+    by_salon = defaultdict(list)
+    for (filename, content_type, contents), parsed in zip(uploads, parsed_list):
+        entry = {"filename": filename, "status": "error", "salon_id": None, "recaudacion_id": None, "created": False, "duplicate": False, "updated": 0, "unmatched": [], "diff": None, "error": None}
+        results.append(entry)
+
+        if isinstance(parsed, Exception):
+            entry["error"] = str(parsed)
+            continue
+        meta = parsed["metadata"]
+        if not meta["is_normalized"]:
+            entry["error"] = "Not a normalized (v1.0) workbook"
+            continue
+        if not meta["fecha_inicio"] or not meta["fecha_fin"]:
+            entry["error"] = "Could not read dates from E1/E2"
+            continue
+        salon = _match_salon(meta["salon_name"], all_salons) if meta["salon_name"] else None
+        if not salon:
+            entry["error"] = f"No salon matched for '{meta['salon_name']}'"
+            continue
+
+        entry["salon_id"] = salon.id
+        by_salon[salon.id].append((entry, content_type, contents, parsed))
+
+    # 2. Apply per salon, in chronological order
+    for salon_id, items in by_salon.items():
+        items.sort(key=lambda item: item[3]["metadata"]["fecha_fin"])
+        for entry, content_type, contents, parsed in items:
+            meta = parsed["metadata"]
+            stored_file_id = None
+            try:
+                stmt = select(Recaudacion).where(
+                    Recaudacion.salon_id == salon_id,
+                    func.date(Recaudacion.fecha_fin) == meta["fecha_fin"].date()
+                )
+                rec = (await db.execute(stmt)).scalars().first()
+                if not rec:
+                    rec = await recaudacion.create_with_initial_details(db, obj_in=RecaudacionCreate(
+                        salon_id=salon_id,
+                        fecha_inicio=meta["fecha_inicio"],
+                        fecha_fin=meta["fecha_fin"],
+                        fecha_cierre=meta["fecha_fin"].date(),
+                        origen="importacion",
+                        referencia_fichero=entry["filename"]
+                    ))
+                    entry["created"] = True
+                entry["recaudacion_id"] = rec.id
+
+                if rec.bloqueada:
+                    raise ValueError("Recaudacion is locked")
+
+                content_hash = hashlib.sha256(contents).hexdigest()
+                previous = await recaudacion.get_current_import(db, recaudacion_id=rec.id, content_hash=content_hash)
+                if previous:
+                    result = previous.result or {}
+                    entry["duplicate"] = True
+                else:
+                    db_file = await _find_fichero_by_hash(db, rec.id, content_hash)
+                    if not db_file:
+                        db_file = await _store_recaudacion_file(db, rec.id, entry["filename"], content_type, contents, content_hash)
+                        stored_file_id = db_file.id
+                    result = await recaudacion.apply_import(db, rec=rec, parsed=parsed)
+                    await recaudacion.record_import(
+                        db, recaudacion_id=rec.id, fichero_id=db_file.id, content_hash=content_hash, parsed=parsed, result=result
+                    )
+
+                entry["status"] = "ok"
+                entry["updated"] = result.get("updated", 0)
+                entry["unmatched"] = result.get("unmatched", [])
+                entry["diff"] = result.get("diff")
+            except Exception as e:
+                await db.rollback()
+                entry["error"] = str(e)
+                await _discard_batch_item(db, entry, stored_file_id)
+
+    return {
+        "files": len(results),
+        "ok": sum(1 for r in results if r["status"] == "ok"),
+        "errors": sum(1 for r in results if r["status"] == "error"),
+        "created": sum(1 for r in results if r["created"]),
+        "duplicates": sum(1 for r in results if r["duplicate"]),
+        "results": results
+    }
+
 @router.post("/", response_model=RecaudacionSchema)
 async def create_recaudacion(
     recaudacion_in: RecaudacionCreate,
@@ -209,11 +238,40 @@ async def create_recaudacion(
     recaudacion_obj = await recaudacion.create_with_initial_details(db, obj_in=recaudacion_in)
     return recaudacion_obj
 
+@router.get("/export-range")
+async def export_recaudaciones_range(
+    salon_ids: List[int] = Query(...),
+    fecha_desde: date = Query(...),
+    fecha_hasta: date = Query(...),
+    db: AsyncSession = Depends(deps.get_read_db),
+    scope: SalonScope = Depends(deps.salon_scope("ver_recaudaciones")),
+) -> Any:
+    """
+    One workbook for the recaudaciones of the given salons closed (fecha_fin) within the
+    date range: a summary sheet plus one v1.0 sheet each. Sheets are rendered in worker
+    processes and the file is streamed while it is being assembled.
+    Salons the user cannot see recaudaciones of are left out.
+    """
+    sheets, summary = await range_workbook_data(db, salon_ids, fecha_desde, fecha_hasta, scope=scope)
+    if not sheets:
+        raise HTTPException(404, "No recaudaciones in range")
+
+    filename = f"Recaudaciones_{fecha_desde.strftime('%Y%m%d')}_{fecha_hasta.strftime('%Y%m%d')}.xlsx"
+    headers = {
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Access-Control-Expose-Headers': 'Content-Disposition'
+    }
+    return StreamingResponse(
+        stream_combined_workbook(sheets, summary),
+        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        headers=headers
+    )
+
 @router.get("/{id}", response_model=RecaudacionSchema)
 async def read_recaudacion(
     id: int,
     db: AsyncSession = Depends(get_db),
-    current_user: Usuario = Depends(deps.get_current_active_user),
+    scope: SalonScope = Depends(deps.salon_scope("ver_recaudaciones")),
 ) -> Any:
     """
     Get recaudacion by ID.
@@ -221,6 +279,7 @@ async def read_recaudacion(
     recaudacion_obj = await recaudacion.get(db, id=id)
     if not recaudacion_obj:
         raise HTTPException(status_code=404, detail="Recaudacion not found")
+    _check_scope(scope, recaudacion_obj.salon_id)
     return recaudacion_obj
 
 @router.put("/{id}", response_model=RecaudacionSchema)
@@ -252,86 +311,6 @@ async def update_recaudacion(
          
     return recaudacion_updated
 
-async def recalculate_estimated_taxes(db: AsyncSession, recaudacion_id: int):
-    # Fetch Recaudacion with details and machine info
-    stmt = select(Recaudacion).options(
-        selectinload(Recaudacion.detalles).options(
-            selectinload(RecaudacionMaquina.maquina).selectinload(Maquina.tipo_maquina),
-            selectinload(RecaudacionMaquina.puesto)
-        )
-    ).where(Recaudacion.id == recaudacion_id)
-    rec = (await db.execute(stmt)).scalars().first()
-    
-    if not rec or not rec.detalles:
-        return
-
-    # Calculate Days
-    if not rec.fecha_inicio or not rec.fecha_fin:
-        return
-        
-    days_diff = (rec.fecha_fin - rec.fecha_inicio).days
-    if days_diff < 0: days_diff = 0
-    
-    for d in rec.detalles:
-        # Re-evaluate weekly rate logic (Duplicate from CRUD, ideally refactor to helper)
-        tasa_base = 0
-        
-        # Determine Weekly Rate
-        weekly_rate = 0
-        if d.puesto and d.puesto.tasa_semanal:
-            weekly_rate = d.puesto.tasa_semanal
-        elif d.maquina:
-             if d.maquina.tasa_semanal_override:
-                 weekly_rate = d.maquina.tasa_semanal_override
-             elif d.maquina.tipo_maquina and d.maquina.tipo_maquina.tasa_semanal_orientativa:
-                 weekly_rate = d.maquina.tipo_maquina.tasa_semanal_orientativa
-        
-        # Calculate
-        if float(weekly_rate) > 0 and days_diff > 0:
-             daily_rate = float(weekly_rate) / 7.0
-             tasa_base = daily_rate * days_diff
-        
-        d.tasa_estimada = tasa_base
-        # tasa_final will be updated by recalculate_tasa_diferencia next
-        db.add(d)
-        
-    await db.commit()
-
-async def recalculate_tasa_diferencia(db: AsyncSession, recaudacion_id: int):
-    # 1. Get Recaudacion + Details
-    # Need to load details to iterate
-    stmt = select(Recaudacion).options(selectinload(Recaudacion.detalles)).where(Recaudacion.id == recaudacion_id)
-    rec = (await db.execute(stmt)).scalars().first()
-    if not rec or not rec.detalles:
-        return
-
-    # 2. Totals
-    total_real = float(rec.total_tasas or 0)
-    total_calculada = sum(float(d.tasa_estimada or 0) for d in rec.detalles)
-    
-    diff = total_real - total_calculada
-    
-    # 3. Distribute
-    # If total_calculada is 0, we can't distribute roughly. Avoid division by zero.
-    # If 0, maybe assign 0 to difference?
-    
-    for d in rec.detalles:
-        t_calc = float(d.tasa_estimada or 0)
-        
-        if total_calculada != 0:
-            weight = t_calc / total_calculada
-            d.tasa_diferencia = round(diff * weight, 4)
-        else:
-            d.tasa_diferencia = 0
-            
-        # Update Final
-        # Tasa Final = Calculada + Diferencia + Ajuste
-        d.tasa_final = float(d.tasa_estimada or 0) + float(d.tasa_diferencia or 0) + float(d.ajuste or 0)
-        
-        db.add(d)
-        
-    await db.commit()
-
 # --- Detail Endpoints ---
 
 @router.put("/details/{detail_id}", response_model=RecaudacionMaquinaSchema)
@@ -393,21 +372,80 @@ async def delete_recaudacion(
     recaudacion_obj = await recaudacion.get(db, id=id)
     if not recaudacion_obj:
         raise HTTPException(status_code=404, detail="Recaudacion not found")
+    stmt = select(RecaudacionFichero.blob_hash).where(RecaudacionFichero.recaudacion_id == id, RecaudacionFichero.blob_hash.isnot(None))
+    blob_hashes = (await db.execute(stmt)).scalars().all()
+
+    # Ficheros are deleted with it (cascade), releasing their blob references
     recaudacion_deleted = await recaudacion.remove(db, id=id)
+    await blob_store.collect(db, blob_hashes)
+    # Files stored before the blob store live in a per-recaudacion directory
+    await asyncio.to_thread(shutil.rmtree, legacy_dir(id), True)
+    await asyncio.to_thread(export_cache.discard, id)
     return recaudacion_deleted
 
 # --- File Handling ---
 
-UPLOAD_DIR = "/opt/CasinosSM/backend/uploads/recaudaciones"
+async def _read_upload(file: UploadFile) -> bytes:
+    try:
+        return await read_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+async def _discard_batch_item(db: AsyncSession, entry: dict, stored_file_id: Optional[int]):
+    # Undo what a failed batch-import file committed: the recaudacion created for it
+    # (its ficheros go with it) or the file stored for it
+    # Collections loaded before the failure may predate the stored file (rollback() only
+    # expires them if a transaction was open): reload for the delete cascade
+    db.expire_all()
+    try:
+        blob_hashes = []
+        if entry["created"]:
+            blob_hashes = (await db.execute(
+                select(RecaudacionFichero.blob_hash)
+                .where(RecaudacionFichero.recaudacion_id == entry["recaudacion_id"], RecaudacionFichero.blob_hash.isnot(None))
+            )).scalars().all()
+            await recaudacion.remove(db, id=entry["recaudacion_id"])
+            entry["created"] = False
+            entry["recaudacion_id"] = None
+        elif stored_file_id is not None:
+            db_file = await db.get(RecaudacionFichero, stored_file_id)
+            blob_hashes = [db_file.blob_hash]
+            await db.delete(db_file)
+            await db.commit()
+        # Drop blobs this left unreferenced
+        await blob_store.collect(db, blob_hashes)
+    except Exception as e:
+        await db.rollback()
+        entry["error"] += f" (cleanup failed: {e})"
 
-import random
-import string
-def generate_unique_filename(filename: str) -> str:
-    code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
-    if "." in filename:
-        parts = filename.rsplit(".", 1)
-        return f"{parts[0]}.{code}.{parts[1]}"
-    return f"{filename}.{code}"
+async def _find_fichero_by_hash(db: AsyncSession, recaudacion_id: int, content_hash: str) -> Optional[RecaudacionFichero]:
+    stmt = select(RecaudacionFichero).where(
+        RecaudacionFichero.recaudacion_id == recaudacion_id,
+        RecaudacionFichero.content_hash == content_hash
+    )
+    return (await db.execute(stmt)).scalars().first()
+
+async def _store_recaudacion_file(
+    db: AsyncSession, recaudacion_id: int, filename: str, content_type: Optional[str], contents: bytes,
+    content_hash: Optional[str] = None
+) -> RecaudacionFichero:
+    content_hash = content_hash or hashlib.sha256(contents).hexdigest()
+    db_file = RecaudacionFichero(
+        recaudacion_id=recaudacion_id,
+        file_path=blob_store.path_for(content_hash),
+        filename=filename, # Keep Original Name
+        content_type=content_type,
+        content_hash=content_hash,
+        file_size=len(contents),
+        blob_hash=content_hash,
+        created_at=datetime.now()
+    )
+    db.add(db_file)
+    # Reference first, then the blob (written only if this content is new)
+    await db.flush()
+    await asyncio.to_thread(blob_store.place_bytes, contents, content_hash)
+    await db.commit()
+    return db_file
 
 @router.post("/{id}/files", response_model=RecaudacionFicheroSchema)
 async def upload_recaudacion_file(
@@ -421,27 +459,32 @@ async def upload_recaudacion_file(
     if not rec:
         raise HTTPException(status_code=404, detail="Recaudacion not found")
         
-    # Ensure directory exists
-    rec_dir = os.path.join(settings.UPLOAD_DIR, "recaudaciones", str(id))
-    os.makedirs(rec_dir, exist_ok=True)
-    
-    # Unique Filename
-    unique_name = generate_unique_filename(file.filename)
-    file_path = os.path.join(rec_dir, unique_name)
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Stream to a staging file in chunks (hashed on the way, size-limited)
+    staging_path = blob_store.staging_path()
+    try:
+        file_size, content_hash = await save_upload(file, staging_path)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
         
-    # Create DB Entry
-    db_file = RecaudacionFichero(
-        recaudacion_id=id,
-        file_path=file_path,
-        filename=file.filename, # Keep Original Name
-        content_type=file.content_type,
-        created_at=datetime.now()
-    )
-    db.add(db_file)
-    await db.commit()
+    # Create DB Entry (takes a blob reference), then move the content into the blob store
+    try:
+        db_file = RecaudacionFichero(
+            recaudacion_id=id,
+            file_path=blob_store.path_for(content_hash),
+            filename=file.filename, # Keep Original Name
+            content_type=file.content_type,
+            content_hash=content_hash,
+            file_size=file_size,
+            blob_hash=content_hash,
+            created_at=datetime.now()
+        )
+        db.add(db_file)
+        await db.flush()
+        await asyncio.to_thread(blob_store.place, staging_path, content_hash)
+        await db.commit()
+    finally:
+        if os.path.exists(staging_path):
+            await asyncio.to_thread(os.remove, staging_path)
     await db.refresh(db_file)
     return db_file
     
@@ -461,41 +504,79 @@ async def delete_recaudacion_file(
     if not db_file:
          raise HTTPException(status_code=404, detail="File not found")
          
-    # Delete from Disk
-    if os.path.exists(db_file.file_path):
-        os.remove(db_file.file_path)
+    blob_hash = db_file.blob_hash
+    if not blob_hash and os.path.exists(db_file.file_path):
+        # Files stored before the blob store are not shared: delete from disk
+        await asyncio.to_thread(os.remove, db_file.file_path)
         
     await db.delete(db_file)
     await db.commit()
+    if blob_hash:
+        # Drop the blob if this was its last reference
+        await blob_store.collect(db, [blob_hash])
     return {"status": "success"}
 
+# Content behind a file id never changes: let the browser keep it
+FILE_CACHE_CONTROL = "private, max-age=86400, immutable"
+
 @router.get("/files/{file_id}/content")
 async def get_file_content(
     file_id: int,
+    request: Request,
     db: AsyncSession = Depends(get_db),
     token: Optional[str] = Query(None),
 ) -> Any:
-    # Validate Token from Query Param
-    if not token:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        TokenPayload(**payload)
-    except (JWTError, ValidationError):
-        raise HTTPException(status_code=403, detail="Could not validate credentials")
+    """
+    Serve a stored file inline. The strong ETag is the content hash (a fichero's content
+    never changes): If-None-Match answers 304 without touching the file, and Range /
+    If-Range requests get partial content (206) from FileResponse.
+    The ?token= user needs ver_recaudaciones on the recaudacion's salon.
+    """
+    principal = await deps.get_query_token_principal(db, token)
 
-    stmt = select(RecaudacionFichero).where(RecaudacionFichero.id == file_id)
-    result = await db.execute(stmt)
-    db_file = result.scalars().first()
+    stmt = (
+        select(RecaudacionFichero, Recaudacion.salon_id)
+        .join(Recaudacion, Recaudacion.id == RecaudacionFichero.recaudacion_id)
+        .where(RecaudacionFichero.id == file_id)
+    )
+    row = (await db.execute(stmt)).first()
     
-    if not db_file or not os.path.exists(db_file.file_path):
+    if not row:
+        raise HTTPException(status_code=404, detail="File not found")
+    db_file, salon_id = row
+    # Before any caching answer (304)
+    if not principal.has_permission(salon_id, "ver_recaudaciones"):
+        raise HTTPException(status_code=403, detail="Not allowed (ver_recaudaciones) for this salon")
+
+    if not db_file.content_hash:
+        # Files stored before hashing was introduced: hash once and keep it
+        try:
+            db_file.content_hash = await asyncio.to_thread(hash_file, db_file.file_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found")
+        db.add(db_file)
+        await db.commit()
+
+    etag = f'"{db_file.content_hash}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": FILE_CACHE_CONTROL,
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        stat_result = await asyncio.to_thread(os.stat, db_file.file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found")
         
     return FileResponse(
         db_file.file_path, 
         media_type=db_file.content_type or "application/octet-stream",
         filename=db_file.filename,
-        content_disposition_type="inline"
+        content_disposition_type="inline",
+        stat_result=stat_result,
+        headers=headers
     )
 
 @router.post("/{id}/analyze-excel")
@@ -508,34 +589,14 @@ async def analyze_recaudacion_excel(
     rec = await recaudacion.get(db=db, id=id)
     if not rec: raise HTTPException(404, "Recaudacion not found")
     
-    # 1. Parse Excel Names
-    contents = await file.read()
+    # 1. Sniff layout and candidate names (name column only)
+    contents = await _read_upload(file)
     try:
-        df = pd.read_excel(BytesIO(contents), header=None)
-    except Exception as e:
-         raise HTTPException(400, f"Error parsing excel: {e}")
-
-    excel_names = set()
-    # Basic heuristic: Check first 20 columns, first 50 rows
-    for col in range(min(20, df.shape[1])):
-        for row in range(min(100, df.shape[0])):
-            val = df.iloc[row, col]
-            if pd.notna(val) and isinstance(val, str) and len(val) > 2:
-                 # Filter out short strings or likely non-names
-                 excel_names.add(val.strip().upper())
-
-    # Check for Normalization (Version 1.0)
-    is_normalized = False
-    try:
-        # Check D3 (Row 2, Col 3) for "VERSION"
-        if df.shape[0] > 3 and df.shape[1] > 4:
-            val = df.iloc[2, 3]
-            if pd.notna(val) and isinstance(val, str) and "VERSION" in val.upper():
-                is_normalized = True
-    except:
-        pass
-                 
-    return await _process_analysis_result(excel_names, rec.salon_id, db, is_normalized)
+        sniff = await asyncio.to_thread(sniff_workbook, contents, True)
+    except ValueError as e:
+         raise HTTPException(400, str(e))
+
+    return await _process_analysis_result(set(sniff["names"]), rec.salon_id, db, sniff["is_normalized"])
 
 async def _process_analysis_result(excel_names: set, salon_id: int, db: AsyncSession, is_normalized: bool = False):
     # 2. Get Existing Mappings
@@ -586,35 +647,57 @@ async def analyze_recaudacion_file(
     if not db_file or not os.path.exists(db_file.file_path):
         raise HTTPException(404, "File not found")
         
-    # 2. Read & Parse
+    # 2. Read & Sniff
     try:
-        with open(db_file.file_path, "rb") as f:
-            contents = f.read()
-        df = pd.read_excel(BytesIO(contents), header=None)
-    except Exception as e:
-         raise HTTPException(400, f"Error parsing excel: {e}")
-
-    excel_names = set()
-    for col in range(min(20, df.shape[1])):
-        for row in range(min(100, df.shape[0])):
-            val = df.iloc[row, col]
-            if pd.notna(val) and isinstance(val, str) and len(val) > 2:
-                 excel_names.add(val.strip().upper())
-
-                 excel_names.add(val.strip().upper())
-
-    # Check for Normalization (Version 1.0)
-    is_normalized = False
+        contents = await asyncio.to_thread(read_bytes, db_file.file_path)
+        sniff = await asyncio.to_thread(sniff_workbook, contents, True)
+    except ValueError as e:
+         raise HTTPException(400, str(e))
+
+    return await _process_analysis_result(set(sniff["names"]), rec.salon_id, db, sniff["is_normalized"])
+
+
+def _parse_mappings_str(mappings_str: str) -> dict:
+    # {"EXCEL NAME": puesto_id} -> {name: (puesto_id, is_ignored)}
+    # pid can be None, Int, or -1 (Ignore)
+    result = {}
+    for name, pid in json.loads(mappings_str).items():
+        is_ignored = False
+        puesto_id = None
+        
+        if pid == -1:
+            is_ignored = True
+        elif pid:
+            puesto_id = int(pid)
+        result[name.strip().upper()] = (puesto_id, is_ignored)
+    return result
+
+async def _update_excel_mappings(db: AsyncSession, salon_id: int, mappings_str: str):
     try:
-        if df.shape[0] > 3 and df.shape[1] > 4:
-            val = df.iloc[2, 3]
-            if pd.notna(val) and isinstance(val, str) and "VERSION" in val.upper():
-                is_normalized = True
-    except:
-        pass
-
-    return await _process_analysis_result(excel_names, rec.salon_id, db, is_normalized)
-
+        for name, (puesto_id, is_ignored) in _parse_mappings_str(mappings_str).items():
+            # Check exist
+            stmt = select(MaquinaExcelMap).where(
+                MaquinaExcelMap.salon_id == salon_id, 
+                MaquinaExcelMap.excel_nombre == name
+            )
+            existing = (await db.execute(stmt)).scalars().first()
+            if existing:
+                existing.puesto_id = puesto_id
+                existing.maquina_id = None
+                existing.is_ignored = is_ignored
+                db.add(existing)
+            else:
+                new_map = MaquinaExcelMap(
+                    salon_id=salon_id,
+                    excel_nombre=name,
+                    puesto_id=puesto_id,
+                    maquina_id=None,
+                    is_ignored=is_ignored
+                )
+                db.add(new_map)
+        await db.commit()
+    except Exception as e:
+        print(f"Error updating mappings: {e}")
 
 @router.post("/{id}/import-excel")
 async def import_recaudacion_excel(
@@ -622,13 +705,19 @@ async def import_recaudacion_excel(
     mappings_str: Optional[str] = Form(None),
     file: Optional[UploadFile] = File(None),
     file_id: Optional[int] = Form(None),
+    background: bool = Query(False),
+    force: bool = Query(False),
+    dry_run: bool = Query(False),
     db: AsyncSession = Depends(get_db),
     current_user: Usuario = Depends(deps.get_current_active_user),
 ) -> Any:
-    import sys
-    print(f"DEBUG: import_recaudacion_excel called. id={id}, file_id={file_id}, file={file}, mappings_str={mappings_str}")
-    sys.stdout.flush()
-    
+    """
+    Import an Excel file into the recaudacion details.
+    With background=true the file is stored and a job is queued; poll /import-jobs/{job_id}.
+    Re-importing identical content returns the previous result unless force=true.
+    With dry_run=true nothing is written (mappings, file, details): the proposed changes
+    and the resulting tasa_diferencia distribution are returned instead.
+    """
     # 1. Verify Recaudacion
     rec = await recaudacion.get(db=db, id=id)
     if not rec:
@@ -636,687 +725,178 @@ async def import_recaudacion_excel(
         
     # Check Inputs
     if not file and not file_id:
-         print(f"DEBUG: Missing inputs. file={file}, file_id={file_id}")
-         sys.stdout.flush()
          raise HTTPException(status_code=400, detail=f"Must provide either file or file_id. Received file={file}, file_id={file_id}")
 
+    # 1.2 Dry run: parse and compare in memory, mappings only applied to this preview
+    if dry_run:
+        if file_id:
+            stmt = select(RecaudacionFichero).where(RecaudacionFichero.id == file_id, RecaudacionFichero.recaudacion_id == id)
+            db_file = (await db.execute(stmt)).scalars().first()
+            if not db_file or not os.path.exists(db_file.file_path):
+                 raise HTTPException(404, "File not found")
+            contents = await asyncio.to_thread(read_bytes, db_file.file_path)
+        else:
+            contents = await _read_upload(file)
+
+        try:
+            overrides = _parse_mappings_str(mappings_str) if mappings_str else None
+        except (ValueError, TypeError, AttributeError):
+            raise HTTPException(400, "Invalid mappings")
+        try:
+            parsed = await import_queue.parse(contents)
+        except ValueError as e:
+             raise HTTPException(400, str(e))
+
+        preview = await recaudacion.preview_import(db, rec=rec, parsed=parsed, mapping_overrides=overrides)
+        return {"status": "dry_run", **preview}
+
     # 1.5 Update Mappings if provided
     if mappings_str:
-        try:
-            new_mappings = json.loads(mappings_str)
-            for name, pid in new_mappings.items():
-                name = name.strip().upper()
-                # pid can be None, Int, or -1 (Ignore)
-                
-                is_ignored = False
-                puesto_id = None
-                
-                if pid == -1:
-                    is_ignored = True
-                elif pid:
-                    puesto_id = int(pid)
-                
-                # Check exist
-                stmt = select(MaquinaExcelMap).where(
-                    MaquinaExcelMap.salon_id == rec.salon_id, 
-                    MaquinaExcelMap.excel_nombre == name
-                )
-                existing = (await db.execute(stmt)).scalars().first()
-                if existing:
-                    existing.puesto_id = puesto_id
-                    existing.maquina_id = None
-                    existing.is_ignored = is_ignored
-                    db.add(existing)
-                else:
-                    new_map = MaquinaExcelMap(
-                        salon_id=rec.salon_id,
-                        excel_nombre=name,
-                        puesto_id=puesto_id,
-                        maquina_id=None,
-                        is_ignored=is_ignored
-                    )
-                    db.add(new_map)
-            await db.commit()
-        except Exception as e:
-            print(f"Error updating mappings: {e}")
+        await _update_excel_mappings(db, rec.salon_id, mappings_str)
             
-    # 2. Get File Content & Save if new
+    # 2. Get File Content & Hash
     contents = b""
-    filename = ""
+    db_file = None
     
     if file_id:
         stmt = select(RecaudacionFichero).where(RecaudacionFichero.id == file_id, RecaudacionFichero.recaudacion_id == id)
         db_file = (await db.execute(stmt)).scalars().first()
         if not db_file or not os.path.exists(db_file.file_path):
              raise HTTPException(404, "File not found")
-        with open(db_file.file_path, "rb") as f:
-            contents = f.read()
-        filename = db_file.filename
+        content_hash = db_file.content_hash
+        if not content_hash or not background:
+            contents = await asyncio.to_thread(read_bytes, db_file.file_path)
+        if not content_hash:
+            # Files stored before hashing was introduced
+            content_hash = hashlib.sha256(contents).hexdigest()
+            db_file.content_hash = content_hash
+            db.add(db_file)
+            await db.commit()
     else:
         # New Upload
-        contents = await file.read()
-        filename = file.filename
-        
-        # Save File
-        rec_dir = os.path.join(settings.UPLOAD_DIR, "recaudaciones", str(id))
-        os.makedirs(rec_dir, exist_ok=True)
-        unique_name = generate_unique_filename(filename)
-        file_path = os.path.join(rec_dir, unique_name)
-        
-        with open(file_path, "wb") as f:
-            f.write(contents)
-            
-        new_file = RecaudacionFichero(
+        contents = await _read_upload(file)
+        content_hash = hashlib.sha256(contents).hexdigest()
+
+    # 3. Idempotency: same content as the latest import, recaudacion unchanged since -> return its result
+    # (unless mappings were changed in this call or force=true)
+    if not mappings_str and not force:
+        previous = await recaudacion.get_current_import(db, recaudacion_id=id, content_hash=content_hash)
+        if previous:
+            return {"status": "ok", "duplicate": True, "import_id": previous.id, "mappings_updated": False, **(previous.result or {})}
+
+    if not db_file:
+        # Reuse an identical stored file instead of writing it again
+        db_file = await _find_fichero_by_hash(db, id, content_hash)
+        if not db_file:
+            db_file = await _store_recaudacion_file(db, id, file.filename, file.content_type, contents, content_hash)
+
+    # 4. Queue as background job
+    if background:
+        job = RecaudacionImportJob(
             recaudacion_id=id,
-            file_path=file_path,
-            filename=filename,
-            content_type=file.content_type,
+            fichero_id=db_file.id,
+            usuario_id=current_user.id,
+            status="pending",
+            progress=0,
             created_at=datetime.now()
         )
-        db.add(new_file)
+        db.add(job)
         await db.commit()
+        import_queue.enqueue(job.id)
+        return {"status": "queued", "job_id": job.id, "mappings_updated": True if mappings_str else False}
 
-    # 3. Process Excel
+    # 5. Process Excel (parsed in the worker process pool, applied in one transaction)
     try:
-        df = pd.read_excel(BytesIO(contents), header=None)
-    except Exception as e:
-         raise HTTPException(400, f"Error parsing excel: {e}")
+        parsed = await import_queue.parse(contents)
+    except ValueError as e:
+         raise HTTPException(400, str(e))
 
-    # Detect Normalization
-    is_normalized = False
-    try:
-        if df.shape[0] > 3 and df.shape[1] > 4:
-            val = df.iloc[2, 3]
-            if pd.notna(val) and isinstance(val, str) and "VERSION" in val.upper():
-                is_normalized = True
-    except:
-        pass
-
-    updated_count = 0
-    
-    # 4. Prepare Maps for Import
-    # Fetch Mappings
-    stmt_map = select(MaquinaExcelMap).where(MaquinaExcelMap.salon_id == rec.salon_id)
-    name_map = {m.excel_nombre.upper(): m for m in (await db.execute(stmt_map)).scalars().all()}
-    
-    # Fetch Details for this Recaudacion to update them
-    # We assume details already satisfy uniqueness by puesto/maquina for this recaudacion
-    stmt_details = select(RecaudacionMaquina).options(
-        joinedload(RecaudacionMaquina.maquina),
-        joinedload(RecaudacionMaquina.puesto)
-    ).where(RecaudacionMaquina.recaudacion_id == id)
-    current_details = (await db.execute(stmt_details)).scalars().all()
+    result = await recaudacion.apply_import(db, rec=rec, parsed=parsed)
+    importacion = await recaudacion.record_import(
+        db, recaudacion_id=id, fichero_id=db_file.id, content_hash=content_hash, parsed=parsed, result=result
+    )
     
-    details_by_puesto = {d.puesto_id: d for d in current_details if d.puesto_id}
-    details_by_maquina = {d.maquina_id: d for d in current_details if d.maquina_id}
-    # Fallback map for normalized imports (Direct Name Match)
-    details_by_name = {}
-    for d in current_details:
-        if d.maquina and d.maquina.nombre:
-            key_name = d.maquina.nombre.strip()
-            # If multi-post (has Puesto), append suffixes compatible with Export Logic
-            if d.puesto:
-                p_desc = d.puesto.descripcion
-                p_numero = d.puesto.numero_puesto
-                puesto_str = f" - {p_desc}" if p_desc else (f" - PUESTO {p_numero}" if p_numero else "")
-                key_name = f"{key_name}{puesto_str}"
-            
-            details_by_name[key_name.upper()] = d
+    return {"status": "ok", "duplicate": False, "import_id": importacion.id, "mappings_updated": True if mappings_str else False, **result}
 
-    # 5. Iterate Rows
-    for r_idx, row in df.iterrows():
-        
-        detail = None
-        
-        if is_normalized:
-            # Normalized Format:
-            # Start at Row 12 (Index 12)
-            if r_idx < 12: continue
-            
-            # Col 0: Name, Col 1: Retirada, Col 2: Cajon, Col 3: Manual, Col 4: Ajuste
-            if len(row) < 5: continue
-            
-            raw_name = row[0]
-            if pd.isna(raw_name) or not isinstance(raw_name, str): continue
-            
-            # For normalized, we expect exact name matches usually, OR we use the map if they were mapped?
-            # The prompt says: "use the same mapping system ... if normalized make automatic import taking into account version".
-            # Automatic import implies we trust the names or rely on the mapping system?
-            # If it's normalized (exported by us), the names should match exactly with `d["MAQUINA"]` which is `f"{m_nombre}{puesto_str}"`.
-            # HOWEVER, `name_map` is keyed by `excel_nombre`. If we use the map, we are safe.
-            # analyze_excel adds names to the map.
-            
-            clean_name = raw_name.strip().upper()
-            
-            if clean_name in name_map:
-                print(f"DEBUG: Found in name_map: '{clean_name}'")
-                mapping = name_map[clean_name]
-                if mapping.puesto_id:
-                     detail = details_by_puesto.get(mapping.puesto_id)
-                elif mapping.maquina_id:
-                     detail = details_by_maquina.get(mapping.maquina_id)
-            else:
-                 # Helper: Try direct match with machine name
-                 # This covers the case where the normalized file uses valid system names but they haven't been "Mapped" in MaquinaExcelMap yet.
-                 print(f"DEBUG: Not in map. Checking details_by_name for: '{clean_name}'")
-                 if clean_name in details_by_name:
-                     print(f"DEBUG: Found exact match in details_by_name for '{clean_name}'")
-                     detail = details_by_name[clean_name]
-                 else:
-                     # Fallback 2: Check containment?
-                     # Normalized export might include Puesto number "Name - P1"
-                     for k, d in details_by_name.items():
-                         if k in clean_name or clean_name in k:
-                              print(f"DEBUG: Fuzzy match in details_by_name: '{clean_name}' ~= '{k}'")
-                              detail = d
-                              break
-                     if not detail:
-                          print(f"DEBUG: Failed to match '{clean_name}'")
-
-            if detail:
-                def get_val(idx):
-                    v = row[idx] if idx < len(row) else 0
-                    return float(v) if pd.notna(v) and isinstance(v, (int, float)) else 0
-                
-                detail.retirada_efectivo = get_val(1)
-                detail.cajon = get_val(2)
-                detail.pago_manual = get_val(3)
-                detail.ajuste = get_val(4)
-                
-                db.add(detail)
-                updated_count += 1
-                
-        else:
-            # Legacy Format
-            # Check Column 1 (Index 1) for Name
-            if len(row) < 2: continue
-            
-            raw_name = row[1]
-            if pd.isna(raw_name) or not isinstance(raw_name, str):
-                continue
-                
-            clean_name = raw_name.strip().upper()
-            
-            # Check Map
-            if clean_name in name_map:
-                mapping = name_map[clean_name]
-                
-                detail = None
-                if mapping.puesto_id:
-                    detail = details_by_puesto.get(mapping.puesto_id)
-                elif mapping.maquina_id:
-                    detail = details_by_maquina.get(mapping.maquina_id)
-                
-                if detail:
-                    # Extract Values. Col 5: Retirada, 6: Cajon, 7: Pago Manual
-                    def get_val(idx):
-                        v = row[idx] if idx < len(row) else 0
-                        return float(v) if pd.notna(v) and isinstance(v, (int, float)) else 0
-                    
-                    detail.retirada_efectivo = get_val(5)
-                    detail.cajon = get_val(6)
-                    detail.pago_manual = get_val(7)
-                    
-                    db.add(detail)
-                    updated_count += 1
-
-    # 6. Extract Totals (Impuestos, DPS)
-    # Based on analysis: IMPUESTOS at Col 3, Value at Col 5.
-    found_totals = False
-    
-    if not is_normalized:
-        for r_idx, row in df.iterrows():
-            if len(row) < 6: continue
-            
-            label_col = 3
-            val_col = 5
-            
-            label = row[label_col]
-            if pd.isna(label) or not isinstance(label, str):
-                continue
-                
-            label = label.upper()
-            
-            if "IMPUESTOS" in label:
-                val = row[val_col]
-                if pd.notna(val) and isinstance(val, (int, float)):
-                    rec.total_tasas = float(val)
-                    found_totals = True
-                    
-            if "DPS" in label:
-                val = row[val_col]
-                if pd.notna(val) and isinstance(val, (int, float)):
-                    rec.depositos = float(val)
-    else:
-        # Normalized files extraction (Rows 3-10 contain summary)
-        # Row 6 (Index 5): TOTAL TASAS (Col 1/B)
-        # Row 8 (Index 7): DEPOSITOS (Col 1/B)
-        # Row 9 (Index 8): OTROS CONCEPTOS (Col 1/B)
-        print("DEBUG: Extracting totals for normalized file")
-        
-        def get_val_at(r, c):
-             if r < df.shape[0] and c < df.shape[1]:
-                 val = df.iloc[r, c]
-                 if pd.notna(val) and isinstance(val, (int, float)):
-                     return float(val)
-             return 0.0
-
-        # Row indices are 0-based
-        rec.total_tasas = get_val_at(5, 1)    # Row 6
-        rec.depositos = get_val_at(7, 1)      # Row 8
-        rec.otros_conceptos = get_val_at(8, 1) # Row 9
-        
-        found_totals = True
-        print(f"DEBUG: Extracted Totals - Tasas: {rec.total_tasas}, Dep: {rec.depositos}, Otros: {rec.otros_conceptos}")
-                
-    if found_totals:
-        db.add(rec)
-        
-    await db.commit()
-    
-    # Recalculate Tasa Diferencia after import
-    await recalculate_tasa_diferencia(db, id)
-    
-    return {"status": "ok", "updated": updated_count, "mappings_updated": True if mappings_str else False}
 
+@router.get("/import-jobs/{job_id}", response_model=RecaudacionImportJobSchema)
+async def read_import_job(
+    job_id: int,
+    db: AsyncSession = Depends(get_db),
+    scope: SalonScope = Depends(deps.salon_scope("ver_recaudaciones")),
+) -> Any:
+    """
+    Get status, progress and result of a background import job.
+    """
+    row = (await db.execute(
+        select(RecaudacionImportJob, Recaudacion.salon_id)
+        .join(Recaudacion, Recaudacion.id == RecaudacionImportJob.recaudacion_id)
+        .where(RecaudacionImportJob.id == job_id)
+    )).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    job, salon_id = row
+    _check_scope(scope, salon_id)
+    return job
+
+
+def _check_scope(scope: SalonScope, salon_id: int):
+    if not scope.allows(salon_id):
+        raise HTTPException(status_code=403, detail="Not allowed (ver_recaudaciones) for this salon")
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
 
 @router.get("/{id}/export-excel")
 async def export_recaudacion_excel(
     id: int,
+    request: Request,
     db: AsyncSession = Depends(get_db),
-    current_user: Usuario = Depends(deps.get_current_active_user),
+    scope: SalonScope = Depends(deps.salon_scope("ver_recaudaciones")),
 ) -> Any:
+    """
+    Export the recaudacion as a protected v1.0 workbook.
+    Generated files are cached on disk per content version (ETag / If-None-Match supported).
+    """
     # 1. Fetch Recaudacion
     # Eagerly load 'salon' to avoid MissingGreenlet error during async access
     stmt = select(Recaudacion).options(selectinload(Recaudacion.salon)).where(Recaudacion.id == id)
     rec = (await db.execute(stmt)).scalars().first()
     if not rec:
         raise HTTPException(404, "Recaudacion not found")
-        
-    # 2. Fetch Previous Recaudacion for Header Info
-    # Get the most recent one before this one for the same salon
-    stmt_prev = select(Recaudacion).where(
-        Recaudacion.salon_id == rec.salon_id,
-        Recaudacion.fecha_inicio < rec.fecha_inicio
-    ).order_by(Recaudacion.fecha_inicio.desc()).limit(1)
-    
-    prev_rec = (await db.execute(stmt_prev)).scalars().first()
-    
-    prev_date_str = prev_rec.fecha_fin.strftime('%d/%m/%Y') if prev_rec and prev_rec.fecha_fin else "N/A"
-    days_diff = (rec.fecha_inicio - prev_rec.fecha_fin).days if prev_rec and prev_rec.fecha_fin and rec.fecha_inicio else 0
-    
-    # 3. Fetch Data
-    stmt_data = select(
-        RecaudacionMaquina, 
-        Maquina.nombre, 
-        Maquina.numero_serie,
-        Puesto.numero_puesto, 
-        Puesto.descripcion, 
-        Maquina.grupo_id
-    ).outerjoin(Maquina, RecaudacionMaquina.maquina_id == Maquina.id)\
-     .outerjoin(Puesto, RecaudacionMaquina.puesto_id == Puesto.id)\
-     .where(RecaudacionMaquina.recaudacion_id == id)\
-     .order_by(Maquina.nombre, Puesto.numero_puesto)
-     
-    results = (await db.execute(stmt_data)).all()
-    
-    # Sort: Multipuesto First, then Name, then Puesto
-    from collections import Counter
-    # Count occurrences by machine name
-    name_counts = Counter(r[1] for r in results) # index 1 is Maquina.nombre
-
-    # Sort key function
-    def sort_key(row):
-        m_name = row[1]
-        p_numero = row[3] # Puesto.numero_puesto
-        is_multi = name_counts[m_name] > 1
-        # Tuple comparison:
-        # 0. not is_multi (False < True, so reverse this logic or use not: multipuesto should come first (True/1))
-        # Let's say: 0 if Multi, 1 if Mono. 
-        type_rank = 0 if is_multi else 1
-        return (type_rank, m_name, p_numero or 0)
-        
-    results.sort(key=sort_key)
-    
-    data = []
-    for row in results:
-        det, m_nombre, m_serie, p_numero, p_desc, g_id = row
-        puesto_str = f" - {p_desc}" if p_desc else (f" - PUESTO {p_numero}" if p_numero else "")
-        maquina_display = f"{m_nombre}{puesto_str}"
-        
-        data.append({
-            "MAQUINA": maquina_display,
-            "RETIRADA": det.retirada_efectivo or 0,
-            "CAJON": det.cajon or 0,
-            "PAGO MANUAL": det.pago_manual or 0,
-            "AJUSTE": det.ajuste or 0,
-            "TASA_EST": det.tasa_estimada or 0,
-            "raw_name": m_nombre # For grouping
-        })
-        
-    # 4. Excel Generation
-    output = BytesIO()
-    import openpyxl
-    from openpyxl.styles import Font, PatternFill, Protection as CellProtection, Border, Side, Alignment
-    from openpyxl.formatting.rule import CellIsRule
-    from openpyxl.styles.differential import DifferentialStyle
-    from openpyxl.utils import get_column_letter
-
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Recaudación"
-    
-    # 4. Excel Generation
-    output = BytesIO()
-    import openpyxl
-    from openpyxl.styles import Font, PatternFill, Border, Side, Alignment, Protection as CellProtection
-    
-    # Sheet Name: DD - MMM - AAAA (Spanish)
-    months_es = {
-        1: "ene", 2: "feb", 3: "mar", 4: "abr", 5: "may", 6: "jun",
-        7: "jul", 8: "ago", 9: "sep", 10: "oct", 11: "nov", 12: "dic"
-    }
-    day_str = rec.fecha_fin.strftime('%d')
-    month_str = months_es[rec.fecha_fin.month]
-    year_str = rec.fecha_fin.strftime('%Y')
-    ws.title = f"{day_str} - {month_str} - {year_str}"
-    
-    # Enable Sheet Protection (default is locked for all cells)
-    ws.protection.sheet = True
-    
-    # Styles
-    bold_font = Font(bold=True)
-    red_static_font = Font(color="FF0000", bold=True)
-    # Darker Gray for editable cells (User requested "un poco más oscuro")
-    # Previous was EEEEEE. Let's try CCCCCC or DDDDDD.
-    gray_fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid") # LightGray
-    
-    # --- Header Info (Rows 1-2) ---
-    ws['A1'] = f"SALON: {rec.salon.nombre if rec.salon else ''}"
-    ws['A1'].font = bold_font
-    
-    ws['D1'] = "RECAUDACION"
-    ws['D1'].font = bold_font
-    
-    c = ws['E1']
-    c.value = rec.fecha_fin.strftime('%d/%m/%Y')
-    c.font = bold_font
-    c.protection = CellProtection(locked=False) # Editable
-    c.fill = gray_fill
-
-    ws['D2'] = "ULTIMA RECAUDACION"
-    ws['D2'].font = bold_font
-    
-    c = ws['E2']
-    c.value = prev_date_str
-    c.font = bold_font
-    c.protection = CellProtection(locked=False) # Editable
-    c.fill = gray_fill
-    
-    ws['F2'] = "DIAS"
-    ws['F2'].font = bold_font
-    
-    # G2 Formula: Days diff. Try to use formula if possible, or static value but template suggests formula.
-    # DATEDIF is tricky in Excel vs OpenPyol depending on locale. Simple subtraction is better: =E1-E2
-    ws['G2'] = f"=E1-E2"
-    ws['G2'].font = bold_font
-    
-    # --- Styling & Configuration ---
-    # Colors: User wants Inverted relative to Plantilla02 (where Editable was Gray).
-    # So: Editable -> White (FFFFFF), Locked -> Gray (D3D3D3).
-    gray_fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-    white_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
-    
-    bold_font = Font(bold=True)
-    header_font = Font(bold=True, size=12)
-    money_fmt = '#,##0.00'
-    
-    start_row = 13
-    end_row = start_row + len(data) - 1 if len(data) > 0 else start_row
-    t_row = end_row + 1 # Row for Totals
-    
-    # 1. Base Fill: Apply Gray to the entire active area (Structure = Gray)
-    # Range: A1 to H{t_row}.
-    for r in range(1, t_row + 1):
-        for c in range(1, 9): # A-H
-            ws.cell(row=r, column=c).fill = gray_fill
-
-    # --- Header (Rows 1-2) ---
-    # A1: SALON (Label) - Font 16
-    ws['A1'] = "SALON"
-    ws['A1'].font = Font(bold=True, size=16)
-    
-    # B1: Salon Name - Font 16
-    ws['B1'] = rec.salon.nombre if rec.salon else ""
-    ws['B1'].font = Font(bold=True, size=16)
-    
-    # D1: RECAUDACION - Font 16
-    ws['D1'] = "RECAUDACION"
-    ws['D1'].font = Font(bold=True, size=16)
-    
-    # E1: Current Date - Font 16, Editable (White)
-    c = ws['E1']
-    c.value = rec.fecha_fin
-    c.number_format = 'dd/mm/yyyy'
-    c.font = Font(bold=True, size=16)
-    c.protection = CellProtection(locked=False)
-    c.fill = white_fill
-
-    # D2: ULTIMA RECAUDACION (Size 12)
-    ws['D2'] = "ULTIMA RECAUDACION"
-    ws['D2'].font = header_font
-    
-    # E2: Start Date (Size 11/Default, Editable -> White)
-    c = ws['E2']
-    c.value = rec.fecha_inicio
-    c.number_format = 'dd/mm/yyyy'
-    c.font = Font(bold=True) # Default size seems to be 11
-    c.protection = CellProtection(locked=False)
-    c.fill = white_fill
-    
-    # F2: DIAS (Size 12)
-    ws['F2'] = "DIAS"
-    ws['F2'].font = header_font
-    
-    # G2: Formula (Size 12)
-    ws['G2'] = "=E1-E2"
-    ws['G2'].font = header_font
-
-    # D3: VERSION (Size 12)
-    ws['D3'] = "VERSION"
-    ws['D3'].font = header_font
-
-    # E3: Version Value (1.0)
-    c = ws['E3']
-    c.value = "1.0"
-    c.font = Font(bold=True)
-    c.alignment = Alignment(horizontal='center') # Center align like dates usually are? Or left? Let's keep default or consistent. Dates were center/right? E1/E2 didn't specify alignment, so default.
-    # Version should be static/read-only for machine process, so LOCKED (default is locked if sheet is protected).
-    # Since we aren't setting protection=False, it will be locked.
-    # And we want it Gray (default from base loop) or White? The plan said "Locked/Gray".
-    # Base loop sets A1:H{t_row} to Gray. So it will be Gray by default.
-    # No extra code needed for Gray+Locked.
-
-    # --- Summary Section (Rows 3-10) ---
-    # Specs from Plantilla02 Analysis
-    # B3: Total Recaudado = SUM(B_data)+SUM(C_data) (Retirada + Cajon)
-    # B4: Pagos Manuales = SUM(D_data)
-    # B5: Ajustes = SUM(E_data)
-    
-    summary_data = [
-        (3, "TOTAL RECAUDADO", f"=SUM(B{start_row}:B{end_row})+SUM(C{start_row}:C{end_row})", True, 14, "009900"),
-        (4, "PAGOS MANUALES", f"=SUM(D{start_row}:D{end_row})", True, 14, "FF0000"),
-        (5, "AJUSTES", f"=SUM(E{start_row}:E{end_row})", True, None, None),
-        (6, "TOTAL TASAS", rec.total_tasas or 0, False, None, "FF0000"), # Editable -> White
-        (7, "SUBTOTAL", "=B3-B4+B5-B6", True, None, None),
-        (8, "DEPÓSITOS", rec.depositos or 0, False, None, None), # Editable -> White
-        (9, "OTROS CONCEPTOS", rec.otros_conceptos or 0, False, None, None), # Editable -> White
-        (10, "TOTAL:", "=B7+B8+B9", True, 16, None) # "TOTAL:" with colon
-    ]
-
-    for row_idx, label, val, is_locked, size, color in summary_data:
-        # Label (Column A)
-        ws.cell(row=row_idx, column=1, value=label).font = Font(bold=True, size=size if size else 11)
-        
-        # Value (Column B)
-        c = ws.cell(row=row_idx, column=2, value=val)
-        c.number_format = money_fmt
-        
-        # Font format
-        f_size = size if size else 11
-        f_color = color if color else "000000"
-        c.font = Font(bold=True, size=f_size, color=f_color)
-        
-        # Locking & Color
-        if not is_locked:
-            c.protection = CellProtection(locked=False)
-            c.fill = white_fill
-        # Locked cells stay Gray from base loop
-
-    # Extra Summary Fields (Row 10)
-    # C10: LOCAL (50%)
-    c = ws['C10']
-    c.value = "LOCAL (50%)"
-    c.font = Font(bold=True, size=16)
-    
-    # D10: Formula
-    c = ws['D10']
-    c.value = "=B10*0.5"
-    c.number_format = money_fmt
-    c.font = Font(bold=True, size=16)
-    
-    # E10: UORSA (50%)
-    c = ws['E10']
-    c.value = "UORSA (50%)"
-    c.font = Font(bold=True, size=16)
-    
-    # F10: Formula
-    c = ws['F10']
-    c.value = "=B10*0.5"    
-    c.number_format = money_fmt
-    c.font = Font(bold=True, size=16)
-
-    # --- Table Header (Row 12) ---
-    headers_table = ["MÁQUINA", "RETIRADA EFECTIVO", "CAJÓN", "PAGO MANUAL", "AJUSTE", "TOTAL BRUTO", "TASA ESTIMADA", "TOTAL NETO"]
-    for i, h in enumerate(headers_table, 1):
-        c = ws.cell(row=12, column=i, value=h)
-        c.font = bold_font
-        c.border = Border(bottom=Side(style='thin'))
-        c.alignment = Alignment(horizontal='center')
-        # Fill is Gray from base loop
-        
-    ws.freeze_panes = "A13"
-    
-    ws.column_dimensions['A'].width = 31
-    from openpyxl.utils import get_column_letter
-    for col in range(2, 9):
-        ws.column_dimensions[get_column_letter(col)].width = 18
-
-    # --- Data (Row 13+) ---
-    # Tenuous Border Style (Hair or Thin Gray)
-    tenuous_side = Side(style='hair', color='888888')
-    thick_side = Side(style='double', color='000000')
-    
-    count = len(data)
-    for r_idx, d in enumerate(data, start=start_row):
-        # Determine Block Boundaries
-        idx = r_idx - start_row
-        current_name = d["raw_name"]
-        prev_name = data[idx-1]["raw_name"] if idx > 0 else None
-        next_name = data[idx+1]["raw_name"] if idx < count - 1 else None
-        
-        is_top = (current_name != prev_name)
-        is_bottom = (current_name != next_name)
-        
-        # Helper to get border for a cell
-        def get_border(col_idx):
-            top = thick_side if is_top else tenuous_side
-            bottom = thick_side if is_bottom else tenuous_side
-            left = tenuous_side
-            right = tenuous_side
-            return Border(top=top, bottom=bottom, left=left, right=right)
-
-        # A: Machine (Gray)
-        c = ws.cell(row=r_idx, column=1, value=d["MAQUINA"])
-        c.font = bold_font
-        c.border = get_border(1)
-        
-        # B, C, D, E: Editable -> White
-        for col_idx, key in [(2, "RETIRADA"), (3, "CAJON"), (4, "PAGO MANUAL"), (5, "AJUSTE")]:
-            c = ws.cell(row=r_idx, column=col_idx, value=d[key])
-            c.number_format = money_fmt
-            c.protection = CellProtection(locked=False)
-            c.fill = white_fill
-            c.border = get_border(col_idx)
-            
-            # D (Pago Manual) -> Static Red Text
-            if col_idx == 4:
-                c.font = red_static_font
-        
-        # F (Total Bruto): Formula matches Plantilla02 (=B+C-D+E)
-        c = ws.cell(row=r_idx, column=6, value=f"=B{r_idx}+C{r_idx}-D{r_idx}+E{r_idx}")
-        c.number_format = money_fmt
-        c.border = get_border(6)
-        
-        # G (Tasa Est): Static Red Value. Locked -> Gray
-        c = ws.cell(row=r_idx, column=7, value=d["TASA_EST"])
-        c.number_format = money_fmt
-        c.font = red_static_font
-        c.border = get_border(7)
-        # Gray fill default
-        
-        # H (Total Neto): Formula matches Plantilla02 (=F-G)
-        c = ws.cell(row=r_idx, column=8, value=f"=F{r_idx}-G{r_idx}")
-        c.number_format = money_fmt
-        c.border = get_border(8)
+    _check_scope(scope, rec.salon_id)
 
-    # --- Totals Row ---
-    ws.cell(row=t_row, column=1, value="TOTAL").font = Font(bold=True, size=11)
-    
-    cols = ['B', 'C', 'D', 'E', 'F', 'G', 'H']
-    for i, col in enumerate(cols, 2):
-        c = ws.cell(row=t_row, column=i)
-        c.value = f"=SUM({col}{start_row}:{col}{end_row})"
-        c.number_format = money_fmt
-        c.border = Border(top=Side(style='thin', color="000000")) 
-        
-        # Red static for D and G
-        if i == 4 or i == 7:
-            c.font = Font(bold=True, size=11, color="FF0000")
-        else:
-            c.font = Font(bold=True, size=11)
-            
-    # --- Conditional Formatting ---
-    # Standard Rule (Green > 0, Red < 0)
-    # Exclude D (4) and G (7).
-    # Ranges: B{s}:C{t}, E{s}:F{t}, H{s}:H{t}
-    
-    range_BC = f"B{start_row}:C{t_row}"
-    range_EF = f"E{start_row}:F{t_row}"
-    range_H  = f"H{start_row}:H{t_row}"
-    
-    # Summary Cells: B5, B7, B8, B9, B10, D10, F10
-    standard_cells = "B5 B7 B8 B9 B10 D10 F10"
-    
-    standard_ranges = f"{range_BC} {range_EF} {range_H} {standard_cells}"
-    
-    green_font = Font(color="009900", bold=True)
-    rule_green = CellIsRule(operator='greaterThan', formula=['0'], stopIfTrue=False, font=green_font)
-    ws.conditional_formatting.add(standard_ranges, rule_green)
-    
-    red_font = Font(color="FF0000", bold=True)
-    rule_red = CellIsRule(operator='lessThan', formula=['0'], stopIfTrue=False, font=red_font)
-    ws.conditional_formatting.add(standard_ranges, rule_red)
-    
-    wb.save(output)
-    output.seek(0)
-    
     # Filename: NOMBRE_SALON_AAAAMMDD_Recaudacion.xlsx
     salon_name = rec.salon.nombre.replace(" ", "_") if rec.salon and rec.salon.nombre else "Salon"
     date_str = rec.fecha_fin.strftime('%Y%m%d')
     filename = f"{salon_name}_{date_str}_Recaudacion.xlsx"
+    etag = export_cache.etag(rec.id, rec.version)
     headers = {
         'Content-Disposition': f'attachment; filename="{filename}"',
-        'Access-Control-Expose-Headers': 'Content-Disposition' # Ensure regex sees it
+        'Access-Control-Expose-Headers': 'Content-Disposition, ETag', # Ensure regex sees it
+        'ETag': etag,
+        'Cache-Control': 'private, no-cache', # Always revalidate against the version
     }
-    return Response(content=output.getvalue(), media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', headers=headers)
+    media_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+    # 2. Client copy still current
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': headers['Cache-Control']})
+
+    # 3. Cached on disk
+    path = await asyncio.to_thread(export_cache.get, rec.id, rec.version)
+    if path:
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    # 4. Fetch Data & build the workbook (write_only, off the event loop), then cache it
+    sheet = (await export_sheets_data(db, [rec]))[0]
+    start = time.perf_counter()
+    content = await asyncio.to_thread(build_recaudacion_workbook, sheet)
+    metrics.excel_export_duration.observe(time.perf_counter() - start, "recaudacion")
+    metrics.excel_export_rows.inc("recaudacion", amount=len(sheet["rows"]))
+    await asyncio.to_thread(export_cache.put, rec.id, rec.version, content)
+
+    return Response(content=content, media_type=media_type, headers=headers)
@@ -4,13 +4,14 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import crud, models
 from app.api import deps
+from app.core.profile_cache import profile_cache
 from app.schemas.salon import Salon, SalonCreate, SalonUpdate
 
 router = APIRouter()
 
 @router.get("/", response_model=List[Salon])
 async def read_salones(
-    db: AsyncSession = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_read_db),
     skip: int = 0,
     limit: int = 100,
     current_user: models.Usuario = Depends(deps.get_current_active_user),
@@ -33,6 +34,7 @@ async def create_salon(
     """
     # Here allows creation by any active user. Ideally check for generic 'admin' role permissions
     salon = await crud.salon.create(db=db, obj_in=salon_in)
+    profile_cache.bump_catalog() # Salons are embedded in /users/me
     return salon
 
 @router.put("/{salon_id}", response_model=Salon)
@@ -50,6 +52,7 @@ async def update_salon(
     if not salon:
         raise HTTPException(status_code=404, detail="Salon not found")
     salon = await crud.salon.update(db=db, db_obj=salon, obj_in=salon_in)
+    profile_cache.bump_catalog() # Salons are embedded in /users/me
     return salon
 
 @router.get("/{salon_id}", response_model=Salon)
@@ -81,4 +84,5 @@ async def delete_salon(
     if not salon:
         raise HTTPException(status_code=404, detail="Salon not found")
     salon = await crud.salon.remove(db=db, id=salon_id)
+    profile_cache.bump_catalog() # Salons are embedded in /users/me
     return salon
@@ -7,7 +7,7 @@ from sqlalchemy import func
 from sqlalchemy.orm import selectinload
 
 from app.api import deps
-from app.db.session import get_db
+from app.core.salon_scope import SalonScope
 from app.models.user import Usuario
 from app.models.salon import Salon
 from app.models.machine import Maquina
@@ -17,15 +17,17 @@ router = APIRouter()
 
 @router.get("/filters-metadata")
 async def get_filters_metadata(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(deps.get_read_db),
     years: Optional[List[int]] = Query(None),
     salon_ids: Optional[List[int]] = Query(None),
-    current_user: Usuario = Depends(deps.get_current_active_user),
+    scope: SalonScope = Depends(deps.salon_scope("ver_dashboard")),
 ) -> Any:
+    scope = scope.restrict(salon_ids)
     # Get Years
     q_years = select(func.extract('year', Recaudacion.fecha_fin)).where(Recaudacion.fecha_fin.isnot(None)).distinct().order_by(func.extract('year', Recaudacion.fecha_fin).desc())
     
     q_dates = select(Recaudacion.fecha_fin).where(Recaudacion.fecha_fin.isnot(None))
+    q_dates = scope.apply(q_dates, Recaudacion.salon_id)
     result_dates = await db.execute(q_dates)
     dates = result_dates.scalars().all()
     years_list = sorted(list(set(d.year for d in dates if d)), reverse=True)
@@ -36,8 +38,7 @@ async def get_filters_metadata(
     # 1. Base: Active machines
     q_machines = select(Maquina.id, Maquina.nombre, Maquina.salon_id).where(Maquina.activo == True)
     
-    if salon_ids:
-        q_machines = q_machines.where(Maquina.salon_id.in_(salon_ids))
+    q_machines = scope.apply(q_machines, Maquina.salon_id)
     
     # 2. If years selected, add machines that had revenue in those years
     if years:
@@ -48,8 +49,7 @@ async def get_filters_metadata(
             .where(func.extract('year', Recaudacion.fecha_fin).in_(years))
         )
         
-        if salon_ids:
-             subq_historical_q = subq_historical_q.where(Recaudacion.salon_id.in_(salon_ids))
+        subq_historical_q = scope.apply(subq_historical_q, Recaudacion.salon_id)
              
         subq_historical = subq_historical_q
              
@@ -76,7 +76,7 @@ async def get_filters_metadata(
         q_machines = select(Maquina.id, Maquina.nombre, Maquina.salon_id).where(
             (
                 (Maquina.activo == True) & 
-                (Maquina.salon_id.in_(salon_ids) if salon_ids else True)
+                scope.clause(Maquina.salon_id)
             ) 
             | 
             (Maquina.id.in_(subq_historical))
@@ -99,7 +99,7 @@ async def get_filters_metadata(
         "machines": machines
     }
 
-def apply_common_filters(query, model, salon_ids, years, months):
+def apply_common_filters(query, model, scope, years, months):
     # Model is typically Recaudacion or RecaudacionMaquina (joined with Recaudacion)
     # If model is RecaudacionMaquina, we assume it's joined with Recaudacion usually, or we join it.
     
@@ -109,8 +109,8 @@ def apply_common_filters(query, model, salon_ids, years, months):
     # Actually, the caller should handle the join if needed.
     # We will assume 'Recaudacion' class is the target for date/salon filters.
     
-    if salon_ids:
-        query = query.where(Recaudacion.salon_id.in_(salon_ids))
+    # Salons: the requested ones the user may see (scope already restricted)
+    query = scope.apply(query, Recaudacion.salon_id)
         
     # Date filters need expression on Recaudacion.fecha_fin
     # Complex if using SQL 'extract' for portable years/months.
@@ -132,31 +132,30 @@ def apply_common_filters(query, model, salon_ids, years, months):
 
 @router.get("/dashboard")
 async def get_dashboard_stats(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(deps.get_read_db),
     salon_ids: Optional[List[int]] = Query(None),
     years: Optional[List[int]] = Query(None),
     months: Optional[List[int]] = Query(None),
     machine_ids: Optional[List[int]] = Query(None),
-    current_user: Usuario = Depends(deps.get_current_active_user),
+    scope: SalonScope = Depends(deps.salon_scope("ver_dashboard")),
 ) -> Any:
     """
-    Get statistics for the dashboard.
+    Get statistics for the dashboard (salons the user can see the dashboard of).
     """
+    scope = scope.restrict(salon_ids)
     
     # 1. Salones Operativos & Usuarios: Ignore time filters? usually yes, "current state".
     # 2. Machines Active: Only apply salon/machine filters.
     
     query_salons = select(func.count(Salon.id)).where(Salon.activo == True)
-    if salon_ids:
-        query_salons = query_salons.where(Salon.id.in_(salon_ids))
+    query_salons = scope.apply(query_salons, Salon.id)
     count_salons = await db.scalar(query_salons) or 0
     
     query_users = select(func.count(Usuario.id)).where(Usuario.activo == True)
     count_users = await db.scalar(query_users) or 0
     
     query_machines = select(func.count(Maquina.id)).where(Maquina.activo == True)
-    if salon_ids:
-        query_machines = query_machines.where(Maquina.salon_id.in_(salon_ids))
+    query_machines = scope.apply(query_machines, Maquina.salon_id)
     if machine_ids:
         query_machines = query_machines.where(Maquina.id.in_(machine_ids))
     count_machines = await db.scalar(query_machines) or 0
@@ -185,7 +184,7 @@ async def get_dashboard_stats(
         )
         
         # Apply filters
-        q = apply_common_filters(q, RecaudacionMaquina, salon_ids, years, months)
+        q = apply_common_filters(q, RecaudacionMaquina, scope, years, months)
         q = q.where(RecaudacionMaquina.maquina_id.in_(machine_ids))
         
         result = await db.execute(q)
@@ -213,7 +212,7 @@ async def get_dashboard_stats(
         # Standard logic
         # Ensure salon is loaded
         q = select(Recaudacion).options(selectinload(Recaudacion.detalles), selectinload(Recaudacion.salon))
-        q = apply_common_filters(q, Recaudacion, salon_ids, years, months)
+        q = apply_common_filters(q, Recaudacion, scope, years, months)
         
         result = await db.execute(q)
         recaudaciones = result.scalars().all()
@@ -252,13 +251,14 @@ async def get_dashboard_stats(
 
 @router.get("/revenue-evolution")
 async def get_revenue_evolution(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(deps.get_read_db),
     salon_ids: Optional[List[int]] = Query(None),
     years: Optional[List[int]] = Query(None),
     months: Optional[List[int]] = Query(None),
     machine_ids: Optional[List[int]] = Query(None),
-    current_user: Usuario = Depends(deps.get_current_active_user),
+    scope: SalonScope = Depends(deps.salon_scope("ver_dashboard")),
 ) -> Any:
+    scope = scope.restrict(salon_ids)
     
     grouped_data = defaultdict(lambda: defaultdict(float))
     month_names = ["Ene", "Feb", "Mar", "Abr", "May", "Jun", "Jul", "Ago", "Sep", "Oct", "Nov", "Dic"]
@@ -266,7 +266,7 @@ async def get_revenue_evolution(
     if machine_ids:
         from app.models.recaudacion import RecaudacionMaquina
         q = select(RecaudacionMaquina).join(Recaudacion).options(selectinload(RecaudacionMaquina.recaudacion))
-        q = apply_common_filters(q, RecaudacionMaquina, salon_ids, years, months)
+        q = apply_common_filters(q, RecaudacionMaquina, scope, years, months)
         q = q.where(RecaudacionMaquina.maquina_id.in_(machine_ids))
         
         result = await db.execute(q)
@@ -288,7 +288,7 @@ async def get_revenue_evolution(
             
     else:
         q = select(Recaudacion).options(selectinload(Recaudacion.detalles))
-        q = apply_common_filters(q, Recaudacion, salon_ids, years, months)
+        q = apply_common_filters(q, Recaudacion, scope, years, months)
         q = q.order_by(Recaudacion.fecha_fin) # simple sort
         
         result = await db.execute(q)
@@ -316,20 +316,21 @@ async def get_revenue_evolution(
 
 @router.get("/revenue-by-salon")
 async def get_revenue_by_salon(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(deps.get_read_db),
     salon_ids: Optional[List[int]] = Query(None),
     years: Optional[List[int]] = Query(None),
     months: Optional[List[int]] = Query(None),
     machine_ids: Optional[List[int]] = Query(None),
-    current_user: Usuario = Depends(deps.get_current_active_user),
+    scope: SalonScope = Depends(deps.salon_scope("ver_dashboard")),
 ) -> Any:
+    scope = scope.restrict(salon_ids)
     
     data = defaultdict(float)
     
     if machine_ids:
         from app.models.recaudacion import RecaudacionMaquina
         q = select(RecaudacionMaquina).join(Recaudacion).options(selectinload(Recaudacion.salon))
-        q = apply_common_filters(q, RecaudacionMaquina, salon_ids, years, months)
+        q = apply_common_filters(q, RecaudacionMaquina, scope, years, months)
         q = q.where(RecaudacionMaquina.maquina_id.in_(machine_ids))
         
         result = await db.execute(q)
@@ -348,7 +349,7 @@ async def get_revenue_by_salon(
             data[salon_name] += val
     else:
         q = select(Recaudacion).options(selectinload(Recaudacion.salon))
-        q = apply_common_filters(q, Recaudacion, salon_ids, years, months)
+        q = apply_common_filters(q, Recaudacion, scope, years, months)
         
         result = await db.execute(q)
         recaudaciones = result.scalars().all()
@@ -364,22 +365,23 @@ async def get_revenue_by_salon(
 
 @router.get("/top-machines")
 async def get_top_machines(
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(deps.get_read_db),
     salon_ids: Optional[List[int]] = Query(None),
     years: Optional[List[int]] = Query(None),
     months: Optional[List[int]] = Query(None),
     machine_ids: Optional[List[int]] = Query(None),
-    current_user: Usuario = Depends(deps.get_current_active_user),
+    scope: SalonScope = Depends(deps.salon_scope("ver_dashboard")),
 ) -> Any:
     from app.models.recaudacion import RecaudacionMaquina
     from collections import defaultdict
+    scope = scope.restrict(salon_ids)
     
     q = select(RecaudacionMaquina).join(Recaudacion).options(
         selectinload(RecaudacionMaquina.maquina),
         selectinload(RecaudacionMaquina.recaudacion).selectinload(Recaudacion.salon)
     )
     
-    q = apply_common_filters(q, RecaudacionMaquina, salon_ids, years, months)
+    q = apply_common_filters(q, RecaudacionMaquina, scope, years, months)
     
     if machine_ids:
         q = q.where(RecaudacionMaquina.maquina_id.in_(machine_ids))
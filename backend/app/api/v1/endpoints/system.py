@@ -0,0 +1,40 @@
+import asyncio
+from typing import Any, Optional
+from fastapi import APIRouter, Depends, Query
+
+from app.api import deps
+from app.core.principal_cache import Principal
+from app.core.slow_queries import slow_query_log
+from app.db.session import engine, read_engine, pool_stats
+
+router = APIRouter()
+
+@router.get("/db-pool")
+async def read_db_pool_stats(
+    current_user: Principal = Depends(deps.get_current_admin_user),
+) -> Any:
+    """
+    Connection pool usage of the API worker answering (checked out connections,
+    overflow in use, checkout wait time and timeouts), plus the read replica pool.
+    """
+    stats = pool_stats()
+    if read_engine is not engine:
+        stats["read"] = pool_stats(read_engine)
+    return stats
+
+
+@router.get("/slow-queries")
+async def read_slow_queries(
+    limit: int = Query(100, ge=1, le=1000),
+    min_ms: Optional[float] = None,
+    route: Optional[str] = None,
+    user_id: Optional[int] = None,
+    current_user: Principal = Depends(deps.get_current_admin_user),
+) -> Any:
+    """
+    Slow-query log, most recent first: duration, route template, user, statement with
+    its parameter shapes and, for sampled SELECTs, the EXPLAIN (ANALYZE, BUFFERS) plan.
+    Records from every API worker of this host are merged (each writes its own file).
+    """
+    records = await asyncio.to_thread(slow_query_log.read, limit, min_ms, route, user_id)
+    return {"settings": slow_query_log.stats(), "records": records}
@@ -1,14 +1,16 @@
 from typing import Any, List
-from fastapi import APIRouter, Body, Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
+from fastapi import APIRouter, Body, Depends, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from app.api import deps
 from app.core import security
+from app.core.principal_cache import ADMIN_ROLES, principal_cache
+from app.core.profile_cache import profile_cache
 from app.db.session import get_db
 from app.models.user import Usuario, Rol, UsuarioSalon
-from app.schemas.user import User, UserCreate, UserUpdate
+from app.schemas.user import User, UserCreate, UserUpdate, UsuarioSalon as UsuarioSalonSchema
+from app.schemas.salon import Salon as SalonSchema
 
 router = APIRouter()
 
@@ -42,7 +44,7 @@ async def create_user(
             detail="The user with this username already exists in the system.",
         )
     
-    encoded_password = security.get_password_hash(user_in.password)
+    encoded_password = await security.get_password_hash_async(user_in.password)
     db_obj = Usuario(
         email=user_in.email,
         username=user_in.username,
@@ -108,9 +110,18 @@ async def read_user_me(
     current_user: Usuario = Depends(deps.get_current_active_user),
 ) -> Any:
     """
-    Get current user.
+    Get current user (admins get an assignment with full permissions for every salon).
+    Served pre-serialized from the profile cache while the user's auth version and the
+    salon catalog are unchanged.
     """
-    # Check if user is Admin / Superuser
+    content = profile_cache.get(current_user.id, current_user.auth_version)
+    if content is None:
+        key = (current_user.auth_version, profile_cache.catalog_version)
+        content = await _build_profile(db, current_user.id)
+        profile_cache.put(current_user.id, key, content)
+    return Response(content=content, media_type="application/json")
+
+async def _build_profile(db: AsyncSession, user_id: int) -> bytes:
     # Reload user with eager relationships to prevent MissingGreenlet errors
     from sqlalchemy.orm import selectinload
     result = await db.execute(
@@ -119,52 +130,35 @@ async def read_user_me(
             selectinload(Usuario.roles),
             selectinload(Usuario.salones_asignados).selectinload(UsuarioSalon.salon)
         )
-        .where(Usuario.id == current_user.id)
-    )
-    current_user = result.scalars().first()
-    user_roles = current_user.roles
-    
-    is_admin = (
-        current_user.username == 'admin' or 
-        any(r.nombre in ['Admin', 'Superadmin', 'Administrador'] for r in user_roles)
+        .where(Usuario.id == user_id)
     )
-    
+    user = result.scalars().first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    profile = User.model_validate(user)
+
+    # Check if user is Admin / Superuser
+    is_admin = user.username == 'admin' or any(r.nombre in ADMIN_ROLES for r in user.roles)
     if is_admin:
-        # Fetch ALL salons
+        # Virtual assignments with full permissions for every other salon
+        # (existing assignments keep their specific perms)
         from app.models.salon import Salon
+        existing_ids = {ua.salon_id for ua in user.salones_asignados}
         result = await db.execute(select(Salon))
-        all_salons = result.scalars().all()
-        
-        # Create virtual assignments for all salons
-        # We start with existing assignments to keep specific perms if any
-        existing_ids = {ua.salon_id for ua in current_user.salones_asignados}
-        
-        virtual_assignments = list(current_user.salones_asignados)
-        
-        for salon in all_salons:
+        for salon in result.scalars().all():
             if salon.id not in existing_ids:
-                # Add synthetic assignment with full permissions
-                virtual_assignments.append({
-                    "salon_id": salon.id,
-                    "usuario_id": current_user.id,
-                    "puede_ver": True,
-                    "puede_editar": True,
-                    "ver_dashboard": True,
-                    "ver_recaudaciones": True,
-                    "editar_recaudaciones": True,
-                    "ver_historico": True,
-                    "salon": salon
-                })
-        
-        user_dict = jsonable_encoder(current_user)
-        user_dict['salones_asignados'] = virtual_assignments
-        # Manually attach roles for Admin
-        user_dict['roles'] = [jsonable_encoder(r) for r in user_roles]
-        return user_dict
+                profile.salones_asignados.append(UsuarioSalonSchema(
+                    salon_id=salon.id,
+                    puede_ver=True,
+                    puede_editar=True,
+                    ver_dashboard=True,
+                    ver_recaudaciones=True,
+                    editar_recaudaciones=True,
+                    ver_historico=True,
+                    salon=SalonSchema.model_validate(salon)
+                ))
 
-    # For non-admin, ensure roles are attached
-    current_user.roles = user_roles
-    return current_user
+    return profile.model_dump_json().encode("utf-8")
 
 @router.get("/", response_model=List[User])
 async def read_users(
@@ -252,7 +246,7 @@ async def update_user(
     
     update_data = user_in.dict(exclude_unset=True)
     if update_data.get("password"):
-        hashed_password = security.get_password_hash(update_data["password"])
+        hashed_password = await security.get_password_hash_async(update_data["password"])
         del update_data["password"]
         update_data["hash_password"] = hashed_password
         
@@ -287,8 +281,12 @@ async def update_user(
             )
             db.add(us)
         
+    # Cached principals / issued tokens of this user are now stale
+    user.auth_version = Usuario.auth_version + 1
     db.add(user)
     await db.commit()
+    principal_cache.invalidate(user_id)
+    profile_cache.invalidate(user_id)
     await db.refresh(user)
     # Re-fetch to ensure relationships are loaded for response
     # Or rely on expire_on_commit=False if set. 
@@ -344,4 +342,6 @@ async def delete_user(
     
     await db.delete(user)
     await db.commit()
+    principal_cache.invalidate(user_id)
+    profile_cache.invalidate(user_id)
     return user
@@ -12,13 +12,61 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str = "postgres"
     POSTGRES_DB: str = "salones_db"
     DATABASE_URL: Optional[str] = None
+    READ_DATABASE_URL: Optional[str] = None # Read replica for stats / listings / exports (deps.get_read_db)
+
+    # Database engine (app.db.session). DB_PROFILE picks the defaults: "dev" logs every
+    # statement and keeps a small pool, "prod" does not log. Unset knobs use the profile.
+    DB_PROFILE: str = "prod"
+    DB_ECHO: Optional[bool] = None
+    DB_POOL_SIZE: Optional[int] = None # Connections kept open per API worker
+    DB_MAX_OVERFLOW: Optional[int] = None # Extra connections opened under load, closed when returned
+    DB_POOL_TIMEOUT: int = 30 # Seconds waiting for a free connection before failing
+    DB_POOL_RECYCLE: int = 1800 # Reconnect connections older than this (seconds, -1 never)
+    DB_POOL_PRE_PING: bool = True # Check connections on checkout (survives Postgres restarts)
+    DB_STATEMENT_CACHE_SIZE: int = 100 # asyncpg prepared statements per connection (0 behind pgbouncer)
+    DB_STATEMENT_TIMEOUT_MS: Optional[int] = None # Postgres statement_timeout (0 disables)
+    DB_APPLICATION_NAME: str = "casinos-api" # Shown in pg_stat_activity
+
+    METRICS_ENABLED: bool = True # Request / DB / Excel metrics at /metrics (app.core.metrics)
+    QUERY_AUDIT: Optional[bool] = None # Log N+1 statement patterns per request (app.core.query_audit; default: dev profile)
+    QUERY_AUDIT_REPEAT_LIMIT: int = 5 # Same statement shape more often than this in a request gets logged
+    SLOW_QUERY_MS: int = 1000 # Statements slower than this go to the slow-query log (app.core.slow_queries; 0 disables)
+    SLOW_QUERY_EXPLAIN_SAMPLE: float = 0.1 # Fraction of slow SELECTs re-run with EXPLAIN (ANALYZE, BUFFERS)
+    SLOW_QUERY_LOG_FILE: Optional[str] = None # Default: UPLOAD_DIR/logs/slow_queries.jsonl (one file per worker: slow_queries.<pid>.jsonl)
+    SLOW_QUERY_LOG_MAX_MB: int = 10 # Rotated above this size
+    SLOW_QUERY_LOG_BACKUPS: int = 5
+    SLOW_QUERY_LOG_KEEP_DAYS: int = 7 # Files of old worker processes untouched this long are deleted
 
     # Security
     SECRET_KEY: str = "YOUR_SECRET_KEY_CHANGE_ME"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 # 60 minutes
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 30 # Authenticated user snapshots (app.core.principal_cache)
+    PRINCIPAL_CACHE_SIZE: int = 1024
+    PROFILE_CACHE_TTL_SECONDS: int = 300 # Serialized /users/me payloads (app.core.profile_cache)
+    TOKEN_PERMISSIONS: bool = False # Embed per-salon permission bitmaps in access tokens
+    PASSWORD_HASH_WORKERS: int = 2 # Threads verifying/hashing passwords (Argon2 uses 64 MB each)
+    PASSWORD_HASH_MAX_QUEUE: int = 64 # Waiting checks beyond this get 503
     
     UPLOAD_DIR: str = "/opt/CasinosSM/documents"
+    UPLOAD_MAX_MB: int = 50 # Larger uploads are rejected with 413
+
+    # Background Excel imports
+    IMPORT_JOB_WORKERS: int = 2 # Concurrent jobs consumed from the in-process queue
+    IMPORT_PARSE_PROCESSES: int = 2 # ProcessPoolExecutor size for pandas parsing
+    IMPORT_JOB_HEARTBEAT_SECONDS: int = 30 # Running jobs are marked alive this often
+    IMPORT_JOB_STALE_SECONDS: int = 120 # Running jobs without a heartbeat for this long are re-queued
+
+    # Generated Excel exports, cached under UPLOAD_DIR/export_cache
+    EXPORT_CACHE_MAX_MB: int = 512 # LRU eviction above this size
+    EXPORT_PROCESSES: int = 2 # Worker processes rendering sheets of multi-recaudacion exports
+    SNAPSHOT_BATCH_SIZE: int = 10000 # Rows per Parquet record batch / cursor fetch
+
+    # Background export jobs, artifacts under UPLOAD_DIR/exports
+    EXPORT_JOB_WORKERS: int = 1 # Concurrent export jobs
+    EXPORT_JOB_TTL_HOURS: int = 24 # Artifacts are deleted after this
+    EXPORT_JOB_HEARTBEAT_SECONDS: int = 30 # Running jobs are marked alive this often
+    EXPORT_JOB_STALE_SECONDS: int = 120 # Running jobs without a heartbeat for this long are re-queued
     
     BACKEND_CORS_ORIGINS: list[str] = [
         "http://localhost",
@@ -0,0 +1,415 @@
+from copy import copy
+from io import BytesIO
+from typing import Any, Dict, List
+from zipfile import ZipFile
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.formatting.rule import CellIsRule
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Protection as CellProtection, Side
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter
+
+# Export engine for the protected v1.0 recaudacion layout (read back by excel_import).
+# Workbooks are built in openpyxl write_only mode: rows are streamed in order and every
+# cell is written once with a pre-registered NamedStyle, so no per-cell style objects
+# are created. Input is plain dicts, so it can also run inside a ProcessPoolExecutor.
+
+START_ROW = 13  # First data row (matches excel_import.NORMALIZED_FIRST_ROW + 1)
+N_COLS = 8  # A-H
+
+MONEY_FMT = '#,##0.00'
+DATE_FMT = 'dd/mm/yyyy'
+
+MONTHS_ES = {
+    1: "ene", 2: "feb", 3: "mar", 4: "abr", 5: "may", 6: "jun",
+    7: "jul", 8: "ago", 9: "sep", 10: "oct", 11: "nov", 12: "dic"
+}
+
+TABLE_HEADERS = ["MÁQUINA", "RETIRADA EFECTIVO", "CAJÓN", "PAGO MANUAL", "AJUSTE", "TOTAL BRUTO", "TASA ESTIMADA", "TOTAL NETO"]
+
+# Colors: Editable -> White (FFFFFF), Locked -> Gray (D3D3D3)
+GRAY_FILL = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
+WHITE_FILL = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
+
+# Tenuous Border Style (Hair Gray) inside machine blocks, double line between machines
+TENUOUS_SIDE = Side(style='hair', color='888888')
+THICK_SIDE = Side(style='double', color='000000')
+
+
+def _named_style(name, font=DEFAULT_FONT, editable=False, **kwargs) -> NamedStyle:
+    return NamedStyle(
+        name=name,
+        font=font,
+        fill=WHITE_FILL if editable else GRAY_FILL,
+        protection=CellProtection(locked=not editable),
+        **kwargs
+    )
+
+
+def _data_border(is_top: bool, is_bottom: bool) -> Border:
+    return Border(
+        top=THICK_SIDE if is_top else TENUOUS_SIDE,
+        bottom=THICK_SIDE if is_bottom else TENUOUS_SIDE,
+        left=TENUOUS_SIDE,
+        right=TENUOUS_SIDE
+    )
+
+
+def _build_styles() -> List[NamedStyle]:
+    bold_font = Font(bold=True)
+    red_static_font = Font(color="FF0000", bold=True)
+    styles = [
+        _named_style("rec_gray"),
+        _named_style("rec_bold", font=bold_font),
+        _named_style("rec_bold_12", font=Font(bold=True, size=12)),
+        _named_style("rec_bold_16", font=Font(bold=True, size=16)),
+        _named_style("rec_money_16", font=Font(bold=True, size=16), number_format=MONEY_FMT),
+        _named_style("rec_date_16", font=Font(bold=True, size=16), number_format=DATE_FMT, editable=True),
+        _named_style("rec_date", font=bold_font, number_format=DATE_FMT, editable=True),
+        _named_style("rec_version", font=bold_font, alignment=Alignment(horizontal='center')),
+        _named_style(
+            "rec_table_header", font=bold_font,
+            border=Border(bottom=Side(style='thin')), alignment=Alignment(horizontal='center')
+        ),
+    ]
+
+    # Summary block: label + value per (size, color, editable)
+    for size in (11, 14, 16):
+        styles.append(_named_style(f"rec_label_{size}", font=Font(bold=True, size=size)))
+        for color in ("000000", "009900", "FF0000"):
+            for editable in (False, True):
+                styles.append(_named_style(
+                    f"rec_summary_{size}_{color}_{'w' if editable else 'g'}",
+                    font=Font(bold=True, size=size, color=color),
+                    number_format=MONEY_FMT,
+                    editable=editable
+                ))
+
+    # Data rows: one style per column kind and block boundary
+    data_kinds = {
+        "name": dict(font=bold_font),
+        "input": dict(number_format=MONEY_FMT, editable=True),
+        "input_red": dict(font=red_static_font, number_format=MONEY_FMT, editable=True),
+        "formula": dict(number_format=MONEY_FMT),
+        "static_red": dict(font=red_static_font, number_format=MONEY_FMT),
+    }
+    for kind, kwargs in data_kinds.items():
+        for is_top in (False, True):
+            for is_bottom in (False, True):
+                styles.append(_named_style(
+                    _data_style(kind, is_top, is_bottom),
+                    border=_data_border(is_top, is_bottom),
+                    **kwargs
+                ))
+
+    # Totals row
+    totals_border = Border(top=Side(style='thin', color="000000"))
+    styles.append(_named_style("rec_total", font=Font(bold=True, size=11), number_format=MONEY_FMT, border=totals_border))
+    styles.append(_named_style("rec_total_red", font=Font(bold=True, size=11, color="FF0000"), number_format=MONEY_FMT, border=totals_border))
+    return styles
+
+
+def _data_style(kind: str, is_top: bool, is_bottom: bool) -> str:
+    return f"rec_data_{kind}_{int(is_top)}{int(is_bottom)}"
+
+
+# Data columns B-H: (key or formula, style kind)
+DATA_COLUMNS = [
+    ("retirada_efectivo", "input"),
+    ("cajon", "input"),
+    ("pago_manual", "input_red"), # D (Pago Manual) -> Static Red Text
+    ("ajuste", "input"),
+    ("=B{r}+C{r}-D{r}+E{r}", "formula"), # F (Total Bruto)
+    ("tasa_estimada", "static_red"), # G (Tasa Est): Static Red Value
+    ("=F{r}-G{r}", "formula"), # H (Total Neto)
+]
+
+
+def _conditional_rules() -> List[CellIsRule]:
+    # Standard Rule (Green > 0, Red < 0)
+    return [
+        CellIsRule(operator='greaterThan', formula=['0'], stopIfTrue=False, font=Font(color="009900", bold=True)),
+        CellIsRule(operator='lessThan', formula=['0'], stopIfTrue=False, font=Font(color="FF0000", bold=True)),
+    ]
+
+
+def register_styles(wb: openpyxl.Workbook):
+    # The index pinning below uses openpyxl internals (pinned to 3.1.* in
+    # requirements.txt): fail rather than write workbooks with mismatched style indices
+    if not all(hasattr(getattr(wb, name, None), "add") for name in ("_cell_styles", "_differential_styles")):
+        raise RuntimeError(
+            f"openpyxl {openpyxl.__version__} has no Workbook._cell_styles / _differential_styles; "
+            "excel_export.register_styles needs openpyxl 3.1"
+        )
+    styles = _build_styles()
+    for style in styles:
+        wb.add_named_style(style)
+
+    # Pin cell format (xf) and conditional format (dxf) indices in registration order,
+    # instead of order of first use. Every export workbook then shares the same style
+    # table, so a sheet rendered in another process (sheet_xml) can be copied verbatim.
+    for style in styles:
+        wb._cell_styles.add(copy(style.as_tuple()))
+    for rule in _conditional_rules():
+        wb._differential_styles.add(rule.dxf)
+
+
+def sheet_title(fecha_fin) -> str:
+    # Sheet Name: DD - MMM - AAAA (Spanish)
+    return f"{fecha_fin.strftime('%d')} - {MONTHS_ES[fecha_fin.month]} - {fecha_fin.strftime('%Y')}"
+
+
+def write_recaudacion_sheet(wb: openpyxl.Workbook, sheet: Dict[str, Any], title: str = None):
+    """
+    Append one recaudacion sheet to a write_only workbook (styles already registered).
+    sheet: salon_nombre, fecha_inicio, fecha_fin, total_tasas, depositos, otros_conceptos
+    and rows [{maquina, raw_name, retirada_efectivo, cajon, pago_manual, ajuste, tasa_estimada}],
+    already in export order.
+    """
+    ws = wb.create_sheet(title or sheet_title(sheet["fecha_fin"]))
+    rows = sheet["rows"]
+
+    start_row = START_ROW
+    end_row = start_row + len(rows) - 1 if len(rows) > 0 else start_row
+    t_row = end_row + 1 # Row for Totals
+
+    # Sheet settings go before the first row in write_only mode
+    ws.protection.sheet = True
+    ws.freeze_panes = "A13"
+    ws.column_dimensions['A'].width = 31
+    for col in range(2, N_COLS + 1):
+        ws.column_dimensions[get_column_letter(col)].width = 18
+
+    def cell(value, style="rec_gray"):
+        c = WriteOnlyCell(ws, value=value)
+        c.style = style
+        return c
+
+    def gray_row(cells):
+        # Pad to A-H: the whole active area is Gray (structure)
+        return cells + [cell(None) for _ in range(N_COLS - len(cells))]
+
+    def summary(label, value, size=11, color="000000", editable=False):
+        return [
+            cell(label, f"rec_label_{size}"),
+            cell(value, f"rec_summary_{size}_{color}_{'w' if editable else 'g'}"),
+        ]
+
+    # --- Header (Rows 1-3) ---
+    ws.append(gray_row([
+        cell("SALON", "rec_bold_16"),
+        cell(sheet["salon_nombre"] or "", "rec_bold_16"),
+        cell(None),
+        cell("RECAUDACION", "rec_bold_16"),
+        cell(sheet["fecha_fin"], "rec_date_16"), # Current Date, Editable
+    ]))
+    ws.append(gray_row([
+        cell(None), cell(None), cell(None),
+        cell("ULTIMA RECAUDACION", "rec_bold_12"),
+        cell(sheet["fecha_inicio"], "rec_date"), # Start Date, Editable
+        cell("DIAS", "rec_bold_12"),
+        cell("=E1-E2", "rec_bold_12"),
+    ]))
+
+    # --- Summary Section (Rows 3-10) ---
+    # B3: Total Recaudado = Retirada + Cajon, B4: Pagos Manuales, B5: Ajustes
+    ws.append(gray_row(
+        summary("TOTAL RECAUDADO", f"=SUM(B{start_row}:B{end_row})+SUM(C{start_row}:C{end_row})", 14, "009900")
+        + [cell(None), cell("VERSION", "rec_bold_12"), cell("1.0", "rec_version")] # Version is locked
+    ))
+    ws.append(gray_row(summary("PAGOS MANUALES", f"=SUM(D{start_row}:D{end_row})", 14, "FF0000")))
+    ws.append(gray_row(summary("AJUSTES", f"=SUM(E{start_row}:E{end_row})")))
+    ws.append(gray_row(summary("TOTAL TASAS", sheet["total_tasas"] or 0, color="FF0000", editable=True)))
+    ws.append(gray_row(summary("SUBTOTAL", "=B3-B4+B5-B6")))
+    ws.append(gray_row(summary("DEPÓSITOS", sheet["depositos"] or 0, editable=True)))
+    ws.append(gray_row(summary("OTROS CONCEPTOS", sheet["otros_conceptos"] or 0, editable=True)))
+    ws.append(gray_row(summary("TOTAL:", "=B7+B8+B9", 16) + [
+        cell("LOCAL (50%)", "rec_bold_16"),
+        cell("=B10*0.5", "rec_money_16"),
+        cell("UORSA (50%)", "rec_bold_16"),
+        cell("=B10*0.5", "rec_money_16"),
+    ]))
+    ws.append(gray_row([]))
+
+    # --- Table Header (Row 12) ---
+    ws.append([cell(h, "rec_table_header") for h in TABLE_HEADERS])
+
+    # --- Data (Row 13+) ---
+    count = len(rows)
+    for idx, d in enumerate(rows):
+        r_idx = start_row + idx
+        # Block Boundaries: double line between machines
+        current_name = d["raw_name"]
+        is_top = idx == 0 or rows[idx - 1]["raw_name"] != current_name
+        is_bottom = idx == count - 1 or rows[idx + 1]["raw_name"] != current_name
+
+        out = [cell(d["maquina"], _data_style("name", is_top, is_bottom))]
+        for key, kind in DATA_COLUMNS:
+            value = key.format(r=r_idx) if key.startswith("=") else (d[key] or 0)
+            out.append(cell(value, _data_style(kind, is_top, is_bottom)))
+        ws.append(out)
+
+    if not rows:
+        ws.append(gray_row([]))
+
+    # --- Totals Row ---
+    totals = [cell("TOTAL", "rec_label_11")]
+    for i in range(2, N_COLS + 1):
+        col = get_column_letter(i)
+        # Red static for D and G
+        totals.append(cell(f"=SUM({col}{start_row}:{col}{end_row})", "rec_total_red" if i in (4, 7) else "rec_total"))
+    ws.append(totals)
+
+    # --- Conditional Formatting ---
+    # Green > 0, Red < 0, excluding D and G.
+    # Summary Cells: B5, B7, B8, B9, B10, D10, F10
+    standard_ranges = f"B{start_row}:C{t_row} E{start_row}:F{t_row} H{start_row}:H{t_row} B5 B7 B8 B9 B10 D10 F10"
+    for rule in _conditional_rules():
+        ws.conditional_formatting.add(standard_ranges, rule)
+    return ws
+
+
+def new_export_workbook() -> openpyxl.Workbook:
+    wb = openpyxl.Workbook(write_only=True)
+    register_styles(wb)
+    return wb
+
+
+def build_recaudacion_workbook(sheet: Dict[str, Any]) -> bytes:
+    wb = new_export_workbook()
+    write_recaudacion_sheet(wb, sheet)
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+# --- Multi-recaudacion workbooks ---
+# One summary sheet plus one v1.0 sheet per recaudacion. The skeleton (summary +
+# empty placeholder sheets) is built once; each recaudacion sheet is rendered on its
+# own by sheet_xml (in worker processes) and swapped into the skeleton's zip entry.
+
+SUMMARY_TITLE = "RESUMEN"
+
+SUMMARY_HEADERS = [
+    "SALON", "ULTIMA RECAUDACION", "RECAUDACION", "HOJA", "TOTAL RECAUDADO", "PAGOS MANUALES",
+    "AJUSTES", "TOTAL TASAS", "SUBTOTAL", "DEPÓSITOS", "OTROS CONCEPTOS", "TOTAL", "LOCAL (50%)", "UORSA (50%)"
+]
+
+
+def _summary_styles() -> List[NamedStyle]:
+    # Registered after the v1.0 styles so their indices stay pinned
+    return [
+        NamedStyle(name="sum_header", font=Font(bold=True), border=Border(bottom=Side(style='thin')), alignment=Alignment(horizontal='center')),
+        NamedStyle(name="sum_text"),
+        NamedStyle(name="sum_date", number_format=DATE_FMT),
+        NamedStyle(name="sum_money", number_format=MONEY_FMT),
+        NamedStyle(name="sum_total_label", font=Font(bold=True), border=Border(top=Side(style='thin', color="000000"))),
+        NamedStyle(name="sum_total", font=Font(bold=True), number_format=MONEY_FMT, border=Border(top=Side(style='thin', color="000000"))),
+    ]
+
+
+def summary_row(sheet: Dict[str, Any], title: str) -> Dict[str, Any]:
+    """
+    Figures of the v1.0 summary block (rows 3-10) for one recaudacion, computed from the data.
+    """
+    rows = sheet["rows"]
+    total_recaudado = sum(float(r["retirada_efectivo"] or 0) + float(r["cajon"] or 0) for r in rows)
+    pagos = sum(float(r["pago_manual"] or 0) for r in rows)
+    ajustes = sum(float(r["ajuste"] or 0) for r in rows)
+    tasas = float(sheet["total_tasas"] or 0)
+    subtotal = total_recaudado - pagos + ajustes - tasas
+    depositos = float(sheet["depositos"] or 0)
+    otros = float(sheet["otros_conceptos"] or 0)
+    total = subtotal + depositos + otros
+    return {
+        "salon_nombre": sheet["salon_nombre"],
+        "fecha_inicio": sheet["fecha_inicio"],
+        "fecha_fin": sheet["fecha_fin"],
+        "title": title,
+        "values": [total_recaudado, pagos, ajustes, tasas, subtotal, depositos, otros, total, total * 0.5, total * 0.5],
+    }
+
+
+def _write_summary_sheet(wb: openpyxl.Workbook, summary: List[Dict[str, Any]]):
+    ws = wb.create_sheet(SUMMARY_TITLE)
+    ws.freeze_panes = "A2"
+    ws.column_dimensions['A'].width = 24
+    for col in range(2, len(SUMMARY_HEADERS) + 1):
+        ws.column_dimensions[get_column_letter(col)].width = 18
+
+    def cell(value, style):
+        c = WriteOnlyCell(ws, value=value)
+        c.style = style
+        return c
+
+    ws.append([cell(h, "sum_header") for h in SUMMARY_HEADERS])
+    for s in summary:
+        ws.append(
+            [cell(s["salon_nombre"], "sum_text"), cell(s["fecha_inicio"], "sum_date"), cell(s["fecha_fin"], "sum_date"), cell(s["title"], "sum_text")]
+            + [cell(v, "sum_money") for v in s["values"]]
+        )
+
+    last_row = len(summary) + 1
+    totals = [cell("TOTAL", "sum_total_label")] + [cell(None, "sum_total_label") for _ in range(3)]
+    for col in range(5, len(SUMMARY_HEADERS) + 1):
+        letter = get_column_letter(col)
+        totals.append(cell(f"=SUM({letter}2:{letter}{last_row})", "sum_total"))
+    ws.append(totals)
+
+    standard_ranges = f"E2:G{last_row + 1} I2:N{last_row + 1}"
+    for rule in _conditional_rules():
+        ws.conditional_formatting.add(standard_ranges, rule)
+
+
+def sheet_part(index: int) -> str:
+    # Zip entry of the index-th sheet (0-based) as written by openpyxl
+    return f"xl/worksheets/sheet{index + 1}.xml"
+
+
+def build_combined_skeleton(summary: List[Dict[str, Any]]) -> bytes:
+    """
+    Workbook with the summary sheet followed by one empty sheet per summary entry
+    (titled s["title"]); the placeholders are replaced with sheet_xml output.
+    """
+    wb = new_export_workbook()
+    for style in _summary_styles():
+        wb.add_named_style(style)
+    _write_summary_sheet(wb, summary)
+    for s in summary:
+        wb.create_sheet(s["title"])
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
+def sheet_xml(sheet: Dict[str, Any]) -> bytes:
+    """
+    Render one recaudacion sheet and return its worksheet XML (see register_styles).
+    """
+    wb = new_export_workbook()
+    ws = write_recaudacion_sheet(wb, sheet, title="Sheet")
+    ws.sheet_view.tabSelected = False # Only the summary is selected in the combined workbook
+    output = BytesIO()
+    wb.save(output)
+    with ZipFile(output) as z:
+        return z.read(sheet_part(0))
+
+
+def unique_sheet_titles(sheets: List[Dict[str, Any]], with_salon: bool) -> List[str]:
+    # Excel: max 31 chars, unique (case-insensitive), no []:*?/\
+    titles = []
+    seen = {SUMMARY_TITLE.lower()}
+    for sheet in sheets:
+        title = sheet_title(sheet["fecha_fin"])
+        if with_salon:
+            salon = "".join(ch for ch in (sheet["salon_nombre"] or "") if ch not in '[]:*?/\\')
+            title = f"{salon[:31 - len(title) - 1]} {title}".strip()
+        base, n = title, 2
+        while title.lower() in seen:
+            suffix = f" ({n})"
+            title = f"{base[:31 - len(suffix)]}{suffix}"
+            n += 1
+        seen.add(title.lower())
+        titles.append(title)
+    return titles
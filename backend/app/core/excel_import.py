@@ -0,0 +1,283 @@
+from datetime import datetime
+from io import BytesIO
+from typing import Any, Dict, Optional, Set
+
+import openpyxl
+import pandas as pd
+
+# Pure parsing helpers for collection workbooks.
+# Everything here works on raw bytes and returns plain dicts/lists so it can be
+# executed inside a ProcessPoolExecutor (no DB access, picklable results).
+
+NORMALIZED_FIRST_ROW = 12  # Data starts at Excel row 13 in v1.0 exports
+NORMALIZED_FOOTER = "TOTAL"  # Label of the totals row closing the v1.0 machine table
+
+
+def _num(v) -> float:
+    return float(v) if pd.notna(v) and isinstance(v, (int, float)) else 0
+
+
+def detect_normalized(df: pd.DataFrame) -> bool:
+    # Check D3 (Row 2, Col 3) for "VERSION"
+    try:
+        if df.shape[0] > 3 and df.shape[1] > 4:
+            val = df.iloc[2, 3]
+            if pd.notna(val) and isinstance(val, str) and "VERSION" in val.upper():
+                return True
+    except Exception:
+        pass
+    return False
+
+
+def read_workbook(contents: bytes) -> pd.DataFrame:
+    try:
+        return pd.read_excel(BytesIO(contents), header=None)
+    except Exception as e:
+        raise ValueError(f"Error parsing excel: {e}")
+
+
+def _parse_date(val) -> Optional[datetime]:
+    if val is None or (not isinstance(val, str) and pd.isna(val)):
+        return None
+    if isinstance(val, pd.Timestamp):
+        return val.to_pydatetime()
+    if isinstance(val, datetime):
+        return val
+    if isinstance(val, str):
+        val = val.strip()
+        try:
+            return datetime.fromisoformat(val)
+        except ValueError:
+            pass
+        try:
+            return datetime.strptime(val, "%d/%m/%Y")
+        except ValueError:
+            pass
+    return None
+
+
+def _metadata_from_cells(cell) -> Dict[str, Any]:
+    """
+    Header metadata of a normalized (v1.0) workbook, `cell(row, col)` is 0-based:
+    A1: "SALON" label + name in B1, or "SALON: {Name}" in A1
+    E1: End Date (this recaudacion), E2: Start Date (previous recaudacion)
+    """
+    salon_name = None
+    cell_val = cell(0, 0) # A1
+    if isinstance(cell_val, str):
+        clean_a1 = cell_val.strip().upper()
+        if clean_a1 == "SALON" or clean_a1 == "SALON:":
+            val_b1 = cell(0, 1)
+            if isinstance(val_b1, str):
+                salon_name = val_b1.strip()
+        elif "SALON:" in clean_a1:
+            salon_name = cell_val.replace("SALON:", "").replace("Salon:", "").strip()
+
+    if not salon_name:
+        # Fallback: Try B1 directly if A1 failed to provide a name
+        val_b1 = cell(0, 1)
+        if isinstance(val_b1, str):
+            salon_name = val_b1.strip()
+
+    return {
+        "salon_name": salon_name or None,
+        "fecha_fin": _parse_date(cell(0, 4)),    # E1
+        "fecha_inicio": _parse_date(cell(1, 4)), # E2
+    }
+
+
+def extract_metadata(df: pd.DataFrame) -> Dict[str, Any]:
+    res: Dict[str, Any] = {"is_normalized": detect_normalized(df), "salon_name": None, "fecha_inicio": None, "fecha_fin": None}
+    if res["is_normalized"]:
+        res.update(_metadata_from_cells(
+            lambda r, c: df.iloc[r, c] if r < df.shape[0] and c < df.shape[1] else None
+        ))
+    return res
+
+
+def _candidate_name(val) -> Optional[str]:
+    if isinstance(val, str) and len(val) > 2:
+        return val.strip().upper()
+    return None
+
+
+def _normalized_names(values) -> Set[str]:
+    # Name column of a v1.0 table, up to the TOTAL footer
+    names = set()
+    for val in values:
+        name = _candidate_name(val)
+        if name == NORMALIZED_FOOTER:
+            break
+        if name:
+            names.add(name)
+    return names
+
+
+def sniff_workbook(contents: bytes, with_names: bool = False) -> Dict[str, Any]:
+    """
+    Classify an upload as normalized v1.0 or legacy reading only the first sheet's
+    header rows (openpyxl read-only mode) and return its metadata.
+    With with_names, candidate machine names are collected from the name column only
+    (A from row 13 for v1.0, B for legacy), without materializing the rest of the sheet.
+    """
+    try:
+        wb = openpyxl.load_workbook(BytesIO(contents), read_only=True, data_only=True)
+    except Exception:
+        # Not an xlsx (e.g. legacy .xls): fall back to a full pandas read
+        return _sniff_dataframe(read_workbook(contents), with_names)
+
+    try:
+        ws = wb.worksheets[0]
+        header = [list(r) for r in ws.iter_rows(min_row=1, max_row=3, max_col=5, values_only=True)]
+
+        def cell(r, c):
+            return header[r][c] if r < len(header) and c < len(header[r]) else None
+
+        d3 = cell(2, 3)
+        res: Dict[str, Any] = {
+            "is_normalized": isinstance(d3, str) and "VERSION" in d3.upper(),
+            "salon_name": None, "fecha_inicio": None, "fecha_fin": None
+        }
+        if res["is_normalized"]:
+            res.update(_metadata_from_cells(cell))
+
+        if with_names:
+            if res["is_normalized"]:
+                col_rows = ws.iter_rows(min_row=NORMALIZED_FIRST_ROW + 1, min_col=1, max_col=1, values_only=True)
+                names = _normalized_names(r[0] for r in col_rows if r)
+            else:
+                col_rows = ws.iter_rows(min_row=1, min_col=2, max_col=2, values_only=True)
+                names = {_candidate_name(r[0]) for r in col_rows if r}
+                names.discard(None)
+            res["names"] = sorted(names)
+        return res
+    finally:
+        wb.close()
+
+
+def _sniff_dataframe(df: pd.DataFrame, with_names: bool) -> Dict[str, Any]:
+    res = extract_metadata(df)
+    if with_names:
+        if res["is_normalized"]:
+            names = _normalized_names(df.iloc[NORMALIZED_FIRST_ROW:, 0] if df.shape[1] > 0 else [])
+        else:
+            col = df.iloc[:, 1] if df.shape[1] > 1 else []
+            names = {_candidate_name(v) for v in col}
+            names.discard(None)
+        res["names"] = sorted(names)
+    return res
+
+
+def parse_import_workbook(contents: bytes) -> Dict[str, Any]:
+    """
+    Parse a collection workbook (normalized v1.0 or legacy) into plain rows and totals.
+    Raises ValueError if the workbook cannot be read.
+    """
+    return _parse_import_df(read_workbook(contents))
+
+
+def parse_batch_workbook(contents: bytes) -> Dict[str, Any]:
+    """
+    Metadata and import rows from a single read of the workbook (batch imports).
+    """
+    df = read_workbook(contents)
+    parsed = _parse_import_df(df)
+    parsed["metadata"] = extract_metadata(df)
+    return parsed
+
+
+def _parse_import_df(df: pd.DataFrame) -> Dict[str, Any]:
+    is_normalized = detect_normalized(df)
+    rows = []
+    totals: Dict[str, Optional[float]] = {}
+
+    if is_normalized:
+        # Col 0: Name, Col 1: Retirada, Col 2: Cajon, Col 3: Manual, Col 4: Ajuste
+        if df.shape[1] >= 5:
+            for r_idx, row in enumerate(df.itertuples(index=False, name=None)):
+                if r_idx < NORMALIZED_FIRST_ROW:
+                    continue
+                raw_name = row[0]
+                if pd.isna(raw_name) or not isinstance(raw_name, str):
+                    continue
+                name = raw_name.strip().upper()
+                if name == NORMALIZED_FOOTER:
+                    break  # Totals row (excel_export), nothing after it is a machine
+                rows.append({
+                    "row": r_idx,
+                    "name": name,
+                    "retirada_efectivo": _num(row[1]),
+                    "cajon": _num(row[2]),
+                    "pago_manual": _num(row[3]),
+                    "ajuste": _num(row[4]),
+                })
+
+        # Summary block: Row 6 TOTAL TASAS, Row 8 DEPOSITOS, Row 9 OTROS CONCEPTOS (Col B)
+        def get_val_at(r, c):
+            if r < df.shape[0] and c < df.shape[1]:
+                return float(_num(df.iloc[r, c]))
+            return 0.0
+
+        totals["total_tasas"] = get_val_at(5, 1)
+        totals["depositos"] = get_val_at(7, 1)
+        totals["otros_conceptos"] = get_val_at(8, 1)
+    else:
+        # Legacy: Name in Col 1, Retirada/Cajon/Pago Manual in Cols 5/6/7.
+        # Totals: label in Col 3 (IMPUESTOS / DPS), value in Col 5.
+        n_cols = df.shape[1]
+        for r_idx, row in enumerate(df.itertuples(index=False, name=None)):
+            if n_cols >= 2:
+                raw_name = row[1]
+                if pd.notna(raw_name) and isinstance(raw_name, str):
+                    rows.append({
+                        "row": r_idx,
+                        "name": raw_name.strip().upper(),
+                        "retirada_efectivo": _num(row[5]) if n_cols > 5 else 0,
+                        "cajon": _num(row[6]) if n_cols > 6 else 0,
+                        "pago_manual": _num(row[7]) if n_cols > 7 else 0,
+                        "ajuste": None,  # Legacy sheets carry no adjustment column
+                    })
+
+            if n_cols >= 6:
+                label = row[3]
+                if pd.isna(label) or not isinstance(label, str):
+                    continue
+                label = label.upper()
+                val = row[5]
+                if pd.notna(val) and isinstance(val, (int, float)):
+                    if "IMPUESTOS" in label:
+                        totals["total_tasas"] = float(val)
+                    if "DPS" in label:
+                        totals["depositos"] = float(val)
+
+    return {"is_normalized": is_normalized, "rows": rows, "totals": totals}
+
+
+IMPORT_FIELDS = ("retirada_efectivo", "cajon", "pago_manual", "ajuste")
+
+
+def rows_by_name(parsed: Dict[str, Any]) -> Dict[str, Dict[str, Optional[float]]]:
+    # Later rows win, same as when the import is applied
+    return {row["name"]: {f: row.get(f) for f in IMPORT_FIELDS} for row in parsed["rows"]}
+
+
+def diff_import_rows(old: Dict[str, dict], new: Dict[str, dict]) -> Dict[str, Any]:
+    """
+    Row-level diff between two imports of the same recaudacion (see rows_by_name).
+    """
+    changed = []
+    for name in sorted(old.keys() & new.keys()):
+        changes = {
+            f: {"old": old[name].get(f), "new": new[name].get(f)}
+            for f in IMPORT_FIELDS
+            if old[name].get(f) != new[name].get(f)
+        }
+        if changes:
+            changed.append({"name": name, "changes": changes})
+
+    return {
+        "added": sorted(new.keys() - old.keys()),
+        "removed": sorted(old.keys() - new.keys()),
+        "changed": changed,
+        "unchanged": len(old.keys() & new.keys()) - len(changed),
+    }
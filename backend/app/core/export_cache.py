@@ -0,0 +1,116 @@
+import os
+import re
+import tempfile
+import threading
+from typing import Optional
+
+from app.core.config import settings
+
+# Bump when the workbook layout (app.core.excel_export) changes, so old files are not served
+EXPORT_FORMAT = "1"
+
+_CACHED_FILE = re.compile(r"^(\d+)_v(\d+)_f(\w+)\.xlsx$") # {recaudacion id}_v{version}_f{format}.xlsx
+
+
+class ExportCache:
+    """
+    On-disk cache of generated workbooks, keyed by recaudacion id and content version.
+    Recaudacion.version is bumped on every header/detail write and on renames of the
+    salon, machines and puestos it shows, so entries never need invalidation: a new
+    version is simply a different file. Recency is the file mtime
+    (touched on every hit), and the least recently used files are removed once the
+    directory grows above max_bytes (files still being written, *.tmp, are left alone).
+    Blocking: call through asyncio.to_thread.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _filename(self, recaudacion_id: int, version: int) -> str:
+        return f"{recaudacion_id}_v{version}_f{EXPORT_FORMAT}.xlsx"
+
+    def path_for(self, recaudacion_id: int, version: int) -> str:
+        return os.path.join(self.root, self._filename(recaudacion_id, version))
+
+    def etag(self, recaudacion_id: int, version: int) -> str:
+        return f'"recaudacion-{recaudacion_id}-v{version}-f{EXPORT_FORMAT}"'
+
+    def get(self, recaudacion_id: int, version: int) -> Optional[str]:
+        path = self.path_for(recaudacion_id, version)
+        try:
+            os.utime(path) # Mark as recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, recaudacion_id: int, version: int, content: bytes) -> str:
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path_for(recaudacion_id, version)
+
+        # Write to a temp file and rename: concurrent readers never see a partial workbook
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        # Older versions can never be served again. Newer ones stay: a concurrent request
+        # may have built one before this (slower) build finished
+        self.discard(recaudacion_id, below=version)
+        self.evict()
+        return path
+
+    def discard(self, recaudacion_id: int, below: Optional[int] = None):
+        # Files of this recaudacion with a version lower than below (all without it), and
+        # any written with another EXPORT_FORMAT
+        if not os.path.isdir(self.root):
+            return
+        with os.scandir(self.root) as it:
+            for entry in it:
+                m = _CACHED_FILE.match(entry.name)
+                if not m or int(m.group(1)) != recaudacion_id:
+                    continue
+                if below is None or int(m.group(2)) < below or m.group(3) != EXPORT_FORMAT:
+                    _remove(entry.path)
+
+    def evict(self):
+        if not os.path.isdir(self.root):
+            return
+        with self._lock:
+            entries = []
+            total = 0
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    if not entry.is_file() or entry.name.endswith(".tmp"):
+                        continue # In-flight put(): about to be renamed
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            if total <= self.max_bytes:
+                return
+
+            entries.sort() # Oldest first
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if _remove(path):
+                    total -= size
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+export_cache = ExportCache(
+    root=os.path.join(settings.UPLOAD_DIR, "export_cache"),
+    max_bytes=settings.EXPORT_CACHE_MAX_MB * 1024 * 1024
+)
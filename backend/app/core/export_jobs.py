@@ -0,0 +1,261 @@
+import asyncio
+import os
+import socket
+import tempfile
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.core.export_stream import range_workbook_data, stream_combined_workbook, stream_facts
+from app.crud.crud_recaudacion import recaudacion_facts_query
+from app.db.session import AsyncSessionLocal, ReadSessionLocal
+from app.models.recaudacion import RecaudacionExportJob
+
+EXPORT_DIR = os.path.join(settings.UPLOAD_DIR, "exports")
+
+# How often expired artifacts are looked for
+PURGE_INTERVAL_SECONDS = 15 * 60
+
+CONTENT_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class ExportJobQueue:
+    """
+    In-process queue for bulk exports that are too large to wait for in a request.
+    Jobs reuse the streaming producers of app.core.export_stream (sheet rendering in the
+    export process pool, file writes in threads), so the event loop only moves chunks.
+    The artifact is written under EXPORT_DIR and can be downloaded until expires_at;
+    expired files are removed periodically. Job state lives in `recaudacion_export_job`.
+    Running jobs carry the worker_id of their process, which refreshes their heartbeat_at;
+    jobs whose heartbeat goes stale (the process died) are re-queued by any other process.
+    """
+
+    def __init__(self, workers: int, ttl: timedelta):
+        self.workers = workers
+        self.ttl = ttl
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.worker_id: Optional[str] = None
+
+    async def start(self):
+        # Workers are forked after import: identify the process actually running
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+        # Re-queue jobs interrupted by a restart (not those other workers are running);
+        # their partial file is overwritten
+        async with AsyncSessionLocal() as db:
+            await self._reclaim_stale(db)
+            stmt = select(RecaudacionExportJob.id).where(RecaudacionExportJob.status == "pending").order_by(RecaudacionExportJob.id)
+            for job_id in (await db.execute(stmt)).scalars().all():
+                self._queue.put_nowait(job_id)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _reclaim_stale(self, db) -> List[int]:
+        # Running jobs whose process stopped heartbeating go back to pending
+        cutoff = datetime.now() - timedelta(seconds=settings.EXPORT_JOB_STALE_SECONDS)
+        result = await db.execute(
+            update(RecaudacionExportJob)
+            .where(
+                RecaudacionExportJob.status == "running",
+                func.coalesce(RecaudacionExportJob.heartbeat_at, RecaudacionExportJob.started_at) < cutoff
+            )
+            .values(status="pending", progress=0, worker_id=None, heartbeat_at=None)
+            .returning(RecaudacionExportJob.id)
+        )
+        job_ids = result.scalars().all()
+        await db.commit()
+        return job_ids
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.EXPORT_JOB_HEARTBEAT_SECONDS)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(RecaudacionExportJob)
+                        .where(RecaudacionExportJob.worker_id == self.worker_id, RecaudacionExportJob.status == "running")
+                        .values(heartbeat_at=datetime.now())
+                    )
+                    await db.commit()
+                    # Take over jobs of processes that died meanwhile
+                    for job_id in await self._reclaim_stale(db):
+                        self._queue.put_nowait(job_id)
+            except Exception:
+                traceback.print_exc()
+
+    def enqueue(self, job_id: int):
+        if self._queue is None:
+            raise RuntimeError("Export queue not started")
+        self._queue.put_nowait(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    async def _set_status(self, db, job: RecaudacionExportJob, **fields):
+        for field, value in fields.items():
+            setattr(job, field, value)
+        db.add(job)
+        await db.commit()
+
+    async def _run(self, job_id: int):
+        async with AsyncSessionLocal() as db:
+            # Claim the job atomically (several API workers may share the table)
+            claimed = await db.execute(
+                update(RecaudacionExportJob)
+                .where(RecaudacionExportJob.id == job_id, RecaudacionExportJob.status == "pending")
+                .values(
+                    status="running", progress=0, started_at=datetime.now(),
+                    worker_id=self.worker_id, heartbeat_at=datetime.now()
+                )
+            )
+            await db.commit()
+            if claimed.rowcount == 0:
+                return
+
+            job = await db.get(RecaudacionExportJob, job_id)
+            tmp_path = None
+            try:
+                params = job.params or {}
+                desde = _parse_date(params.get("fecha_desde"))
+                hasta = _parse_date(params.get("fecha_hasta"))
+                salon_ids = params.get("salon_ids") or None
+
+                # 1. Producer and expected size (for progress)
+                state = {"done": 0, "total": 0}
+                def progress(done: int):
+                    state["done"] = done
+
+                if job.kind == "xlsx":
+                    async with ReadSessionLocal() as read_db: # Data from the replica, job state on the primary
+                        sheets, summary = await range_workbook_data(read_db, salon_ids, desde, hasta)
+                    if not sheets:
+                        raise ValueError("No recaudaciones found for these salons and dates")
+                    state["total"] = len(sheets)
+                    chunks = stream_combined_workbook(sheets, summary, progress=progress)
+                else:
+                    stmt = recaudacion_facts_query(fecha_desde=desde, fecha_hasta=hasta, salon_ids=salon_ids)
+                    count_stmt = select(func.count()).select_from(stmt.order_by(None).subquery())
+                    async with ReadSessionLocal() as read_db:
+                        state["total"] = (await read_db.execute(count_stmt)).scalar() or 0
+                    chunks = stream_facts(stmt, job.kind, progress=progress)
+
+                # 2. Write chunks to a temp file, committing progress every ~5%
+                os.makedirs(EXPORT_DIR, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=EXPORT_DIR, suffix=".tmp")
+                f = os.fdopen(fd, "wb")
+                reported = 0
+                try:
+                    async for chunk in chunks:
+                        if isinstance(chunk, str):
+                            chunk = chunk.encode("utf-8")
+                        if chunk:
+                            await asyncio.to_thread(f.write, chunk)
+                        pct = min(99, state["done"] * 100 // state["total"]) if state["total"] else 0
+                        if pct - reported >= 5:
+                            reported = pct
+                            await self._set_status(db, job, progress=pct)
+                finally:
+                    f.close()
+
+                # 3. Move into place and publish
+                filename = _artifact_name(job.kind, params)
+                path = os.path.join(EXPORT_DIR, f"{job.id}_{filename}")
+                os.replace(tmp_path, path)
+                tmp_path = None
+
+                now = datetime.now()
+                await self._set_status(
+                    db, job,
+                    status="done",
+                    progress=100,
+                    file_path=path,
+                    filename=filename,
+                    content_type=CONTENT_TYPES[job.kind],
+                    file_size=os.path.getsize(path),
+                    finished_at=now,
+                    expires_at=now + self.ttl
+                )
+            except Exception as e:
+                await db.rollback()
+                job = await db.get(RecaudacionExportJob, job_id)
+                await self._set_status(db, job, status="error", error=str(e), finished_at=datetime.now())
+            finally:
+                if tmp_path:
+                    _remove(tmp_path)
+
+    async def purge_expired(self) -> int:
+        """
+        Delete the artifacts of jobs past expires_at and mark them as expired.
+        """
+        async with AsyncSessionLocal() as db:
+            stmt = select(RecaudacionExportJob).where(
+                RecaudacionExportJob.status == "done",
+                RecaudacionExportJob.expires_at <= datetime.now()
+            )
+            jobs = (await db.execute(stmt)).scalars().all()
+            for job in jobs:
+                if job.file_path:
+                    await asyncio.to_thread(_remove, job.file_path)
+                job.status = "expired"
+                job.file_path = None
+                db.add(job)
+            await db.commit()
+            return len(jobs)
+
+    async def _purge_loop(self):
+        while True:
+            try:
+                await self.purge_expired()
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+
+
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+
+def _artifact_name(kind: str, params: dict) -> str:
+    if kind == "xlsx":
+        desde = params["fecha_desde"].replace("-", "")
+        hasta = params["fecha_hasta"].replace("-", "")
+        return f"Recaudaciones_{desde}_{hasta}.xlsx"
+    return f"recaudacion_maquina.{kind}"
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+export_queue = ExportJobQueue(
+    workers=settings.EXPORT_JOB_WORKERS,
+    ttl=timedelta(hours=settings.EXPORT_JOB_TTL_HOURS)
+)
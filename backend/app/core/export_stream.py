@@ -0,0 +1,219 @@
+import asyncio
+import csv
+import io
+import json
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from io import BytesIO
+from typing import Callable, List, Optional, Tuple
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from sqlalchemy import func
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.excel_export import build_combined_skeleton, sheet_part, sheet_xml, summary_row, unique_sheet_titles
+from app.core.process_pool import export_pool
+from app.core.salon_scope import SalonScope
+from app.db.session import ReadSessionLocal
+from app.models.machine import Maquina, Puesto
+from app.models.recaudacion import Recaudacion, RecaudacionMaquina
+
+# Async producers shared by the export endpoints and background export jobs:
+# DB reads on the event loop, rendering in the export process pool / threads.
+# `progress` callbacks receive the number of sheets / rows produced so far.
+
+
+async def export_sheets_data(db: AsyncSession, recs: List[Recaudacion]) -> List[dict]:
+    """
+    Plain data for app.core.excel_export, one dict per recaudacion ('salon' must be loaded).
+    Details of all recaudaciones come from a single query.
+    Rows sorted Multipuesto first, then Name, then Puesto.
+    """
+    stmt_data = select(
+        RecaudacionMaquina, 
+        Maquina.nombre, 
+        Puesto.numero_puesto, 
+        Puesto.descripcion
+    ).outerjoin(Maquina, RecaudacionMaquina.maquina_id == Maquina.id)\
+     .outerjoin(Puesto, RecaudacionMaquina.puesto_id == Puesto.id)\
+     .where(RecaudacionMaquina.recaudacion_id.in_([r.id for r in recs]))\
+     .order_by(Maquina.nombre, Puesto.numero_puesto)
+     
+    results_by_rec = defaultdict(list)
+    for row in (await db.execute(stmt_data)).all():
+        results_by_rec[row[0].recaudacion_id].append(row)
+    
+    sheets = []
+    for rec in recs:
+        results = results_by_rec[rec.id]
+        # Count occurrences by machine name: 0 if Multi, 1 if Mono
+        name_counts = Counter(r[1] for r in results)
+        results.sort(key=lambda row: (0 if name_counts[row[1]] > 1 else 1, row[1], row[2] or 0))
+        
+        rows = []
+        for det, m_nombre, p_numero, p_desc in results:
+            puesto_str = f" - {p_desc}" if p_desc else (f" - PUESTO {p_numero}" if p_numero else "")
+            rows.append({
+                "maquina": f"{m_nombre}{puesto_str}",
+                "raw_name": m_nombre, # For grouping
+                "retirada_efectivo": det.retirada_efectivo or 0,
+                "cajon": det.cajon or 0,
+                "pago_manual": det.pago_manual or 0,
+                "ajuste": det.ajuste or 0,
+                "tasa_estimada": det.tasa_estimada or 0,
+            })
+            
+        sheets.append({
+            "salon_nombre": rec.salon.nombre if rec.salon else "",
+            "fecha_inicio": rec.fecha_inicio,
+            "fecha_fin": rec.fecha_fin,
+            "total_tasas": rec.total_tasas,
+            "depositos": rec.depositos,
+            "otros_conceptos": rec.otros_conceptos,
+            "rows": rows,
+        })
+    return sheets
+
+
+class _ZipStream:
+    # Unseekable sink for zipfile: keeps written chunks until drained
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def stream_combined_workbook(
+    sheets: List[dict], summary: List[dict], progress: Optional[Callable[[int], None]] = None
+):
+    """
+    Yield the combined workbook as it is assembled: the skeleton's zip entries are copied
+    in order and each placeholder sheet is replaced by sheet_xml output from the export
+    pool. Only a small window of rendered sheets is in flight at any time.
+    """
+    start = time.perf_counter()
+    skeleton = await asyncio.to_thread(build_combined_skeleton, summary)
+    parts = {sheet_part(i + 1): i for i in range(len(sheets))} # Sheet 0 is the summary
+    window = settings.EXPORT_PROCESSES * 2
+    futures = {}
+    next_i = 0
+
+    def fill():
+        nonlocal next_i
+        while next_i < len(sheets) and len(futures) < window:
+            futures[next_i] = export_pool.submit(sheet_xml, sheets[next_i])
+            next_i += 1
+
+    sink = _ZipStream()
+    try:
+        fill()
+        with ZipFile(BytesIO(skeleton)) as zin, ZipFile(sink, "w", ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                if info.filename in parts:
+                    # Sheets are stored in order, so this one is always in the window
+                    data = await futures.pop(parts[info.filename])
+                    fill()
+                    if progress:
+                        progress(parts[info.filename] + 1)
+                else:
+                    data = zin.read(info.filename)
+                await asyncio.to_thread(zout.writestr, info.filename, data)
+                yield sink.drain()
+        yield sink.drain()
+        metrics.excel_export_duration.observe(time.perf_counter() - start, "range")
+        metrics.excel_export_rows.inc("range", amount=sum(len(sheet["rows"]) for sheet in sheets))
+    finally:
+        # Client went away: drop sheets not rendered yet
+        for future in futures.values():
+            future.cancel()
+
+
+async def range_workbook_data(
+    db: AsyncSession, salon_ids: List[int], fecha_desde: date, fecha_hasta: date,
+    scope: Optional[SalonScope] = None
+) -> Tuple[List[dict], List[dict]]:
+    """
+    Sheets and summary rows for the recaudaciones of the salons closed (fecha_fin) within the range.
+    Salons outside scope are dropped.
+    """
+    if scope is not None:
+        salon_ids = sorted(scope.restrict(salon_ids).salon_ids)
+    stmt = select(Recaudacion).options(selectinload(Recaudacion.salon)).where(
+        Recaudacion.salon_id.in_(salon_ids),
+        func.date(Recaudacion.fecha_fin) >= fecha_desde,
+        func.date(Recaudacion.fecha_fin) <= fecha_hasta
+    ).order_by(Recaudacion.salon_id, Recaudacion.fecha_fin)
+    recs = (await db.execute(stmt)).scalars().all()
+    if not recs:
+        return [], []
+
+    sheets = await export_sheets_data(db, recs)
+    titles = unique_sheet_titles(sheets, with_salon=len(set(salon_ids)) > 1)
+    summary = [summary_row(sheet, title) for sheet, title in zip(sheets, titles)]
+    return sheets, summary
+
+
+# Rows fetched per round trip from the server-side cursor (and per chunk sent)
+STREAM_BATCH_SIZE = 5000
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Not serializable: {type(value)}")
+
+
+def _format_facts(columns: List[str], rows, fmt: str) -> str:
+    if fmt == "csv":
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        return buf.getvalue()
+    return "".join(
+        json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False) + "\n"
+        for row in rows
+    )
+
+
+async def stream_facts(
+    stmt, fmt: str, progress: Optional[Callable[[int], None]] = None, session_factory=ReadSessionLocal
+):
+    # Own session: the request's one may be closed before the body is fully sent
+    start = time.perf_counter()
+    async with session_factory() as db:
+        result = await db.stream(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+        columns = list(result.keys())
+        total = 0
+
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(columns)
+            yield buf.getvalue()
+
+        async for rows in result.partitions():
+            # Formatting a batch is CPU work: off the event loop, which only moves chunks
+            yield await asyncio.to_thread(_format_facts, columns, rows, fmt)
+            total += len(rows)
+            if progress:
+                progress(total)
+
+    metrics.excel_export_duration.observe(time.perf_counter() - start, fmt)
+    metrics.excel_export_rows.inc(fmt, amount=total)
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import uuid
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.recaudacion import FicheroBlob
+
+# Streaming writes of uploaded files. Chunks are read from the UploadFile (async),
+# hashed, and written to a temp file in a worker thread; the file is renamed into place
+# only once it is complete, so readers never see partial uploads.
+# Stored files go to the content-addressed BlobStore below.
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        super().__init__(f"File exceeds the maximum upload size ({max_bytes // (1024 * 1024)} MB)")
+
+
+def max_upload_bytes() -> int:
+    return settings.UPLOAD_MAX_MB * 1024 * 1024
+
+
+async def save_upload(upload, dest_path: str, max_bytes: Optional[int] = None) -> Tuple[int, str]:
+    """
+    Stream an UploadFile to dest_path. Returns (size, sha256 hex).
+    Raises UploadTooLarge (nothing is left on disk) when max_bytes is exceeded.
+    """
+    max_bytes = max_bytes or max_upload_bytes()
+    dest_dir = os.path.dirname(dest_path)
+    await asyncio.to_thread(os.makedirs, dest_dir, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, suffix=".part")
+    f = os.fdopen(fd, "wb")
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            sha.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
+        await asyncio.to_thread(_close_and_sync, f)
+        await asyncio.to_thread(os.replace, tmp_path, dest_path)
+    except BaseException:
+        f.close()
+        await asyncio.to_thread(_remove, tmp_path)
+        raise
+    return size, sha.hexdigest()
+
+
+async def read_upload(upload, max_bytes: Optional[int] = None) -> bytes:
+    """
+    Read an UploadFile into memory (for files that are parsed), enforcing max_bytes.
+    """
+    max_bytes = max_bytes or max_upload_bytes()
+    chunks = []
+    size = 0
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def write_bytes(dest_path: str, contents: bytes):
+    # Atomic write of content already in memory. Blocking: call through asyncio.to_thread
+    dest_dir = os.path.dirname(dest_path)
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(contents)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        _remove(tmp_path)
+        raise
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def hash_file(path: str) -> str:
+    # SHA-256 of a stored file, read in chunks. Blocking: call through asyncio.to_thread
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class BlobStore:
+    """
+    Content-addressed storage for RecaudacionFichero: one file per SHA-256 at
+    {root}/ab/cd/abcd..., however many ficheros (or recaudaciones) share it.
+    References live in `fichero_blob.ref_count` (kept by session events on insert/delete
+    of RecaudacionFichero); collect() deletes blobs nobody references any more.
+
+    Adding a fichero: flush the row first (takes the reference and locks the blob row),
+    then place() the file, then commit. collect() deletes the row and the file under the
+    same row lock, so a concurrent upload of the same content always ends with the file
+    present.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path_for(self, content_hash: str) -> str:
+        return os.path.join(self.root, content_hash[:2], content_hash[2:4], content_hash)
+
+    def staging_path(self) -> str:
+        # Uploads are streamed here before their hash is known (same filesystem: rename is atomic)
+        return os.path.join(self.root, "tmp", f"{uuid.uuid4().hex}.part")
+
+    def place(self, staging_path: str, content_hash: str) -> str:
+        # Blocking: call through asyncio.to_thread
+        path = self.path_for(content_hash)
+        if os.path.exists(path):
+            _remove(staging_path) # Same content already stored
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(staging_path, path)
+        return path
+
+    def place_bytes(self, contents: bytes, content_hash: str) -> str:
+        # Blocking: call through asyncio.to_thread
+        path = self.path_for(content_hash)
+        if not os.path.exists(path):
+            write_bytes(path, contents)
+        return path
+
+    async def collect(self, db: AsyncSession, content_hashes: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Delete unreferenced blobs (only among content_hashes if given). Returns their hashes.
+        """
+        stmt = delete(FicheroBlob).where(FicheroBlob.ref_count <= 0)
+        if content_hashes is not None:
+            content_hashes = list(set(content_hashes))
+            if not content_hashes:
+                return []
+            stmt = stmt.where(FicheroBlob.content_hash.in_(content_hashes))
+        removed = (await db.execute(stmt.returning(FicheroBlob.content_hash))).scalars().all()
+        for content_hash in removed:
+            await asyncio.to_thread(_remove, self.path_for(content_hash))
+        await db.commit()
+        return removed
+
+
+def _close_and_sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+blob_store = BlobStore(root=os.path.join(settings.UPLOAD_DIR, "blobs"))
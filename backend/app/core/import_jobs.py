@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import os
+import socket
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.core import metrics
+from app.core.excel_import import parse_import_workbook, parse_batch_workbook
+from app.core.file_storage import read_bytes
+from app.core.process_pool import ProcessPool
+from app.crud.crud_recaudacion import recaudacion
+from app.db.session import AsyncSessionLocal
+from app.models.recaudacion import Recaudacion, RecaudacionFichero, RecaudacionImportJob
+
+
+class ImportJobQueue:
+    """
+    In-process queue for Excel imports.
+    Parsing runs in a ProcessPoolExecutor (pandas is CPU-bound), DB changes are applied
+    on the event loop in one transaction. Job state lives in `recaudacion_import_job`,
+    so status survives restarts. Running jobs carry the worker_id of their process, which
+    refreshes their heartbeat_at; jobs whose heartbeat goes stale (the process died) are
+    re-queued by any other process.
+    """
+
+    def __init__(self, workers: int, processes: int):
+        self.workers = workers
+        self.pool = ProcessPool(processes)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.worker_id: Optional[str] = None
+
+    async def run_in_pool(self, fn, *args):
+        return await self.pool.run(fn, *args)
+
+    async def parse(self, contents: bytes) -> Dict[str, Any]:
+        return await self._timed_parse("import", parse_import_workbook, contents)
+
+    async def parse_batch(self, contents: bytes) -> Dict[str, Any]:
+        return await self._timed_parse("batch", parse_batch_workbook, contents)
+
+    async def _timed_parse(self, kind: str, fn, contents: bytes) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            parsed = await self.run_in_pool(fn, contents)
+        except Exception:
+            metrics.excel_parse_errors.inc(kind)
+            raise
+        metrics.excel_parse_duration.observe(time.perf_counter() - start, kind)
+        metrics.excel_parse_rows.inc(kind, amount=len(parsed["rows"]))
+        return parsed
+
+    async def start(self):
+        # Workers are forked after import: identify the process actually running
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+        # Re-queue jobs interrupted by a restart (not those other workers are running)
+        async with AsyncSessionLocal() as db:
+            await self._reclaim_stale(db)
+            stmt = select(RecaudacionImportJob.id).where(RecaudacionImportJob.status == "pending").order_by(RecaudacionImportJob.id)
+            for job_id in (await db.execute(stmt)).scalars().all():
+                self._queue.put_nowait(job_id)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.pool.shutdown()
+
+    async def _reclaim_stale(self, db) -> List[int]:
+        # Running jobs whose process stopped heartbeating go back to pending
+        cutoff = datetime.now() - timedelta(seconds=settings.IMPORT_JOB_STALE_SECONDS)
+        result = await db.execute(
+            update(RecaudacionImportJob)
+            .where(
+                RecaudacionImportJob.status == "running",
+                func.coalesce(RecaudacionImportJob.heartbeat_at, RecaudacionImportJob.started_at) < cutoff
+            )
+            .values(status="pending", progress=0, worker_id=None, heartbeat_at=None)
+            .returning(RecaudacionImportJob.id)
+        )
+        job_ids = result.scalars().all()
+        await db.commit()
+        return job_ids
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.IMPORT_JOB_HEARTBEAT_SECONDS)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(RecaudacionImportJob)
+                        .where(RecaudacionImportJob.worker_id == self.worker_id, RecaudacionImportJob.status == "running")
+                        .values(heartbeat_at=datetime.now())
+                    )
+                    await db.commit()
+                    # Take over jobs of processes that died meanwhile
+                    for job_id in await self._reclaim_stale(db):
+                        self._queue.put_nowait(job_id)
+            except Exception:
+                traceback.print_exc()
+
+    def enqueue(self, job_id: int):
+        if self._queue is None:
+            raise RuntimeError("Import queue not started")
+        self._queue.put_nowait(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    async def _set_status(self, db, job: RecaudacionImportJob, **fields):
+        for field, value in fields.items():
+            setattr(job, field, value)
+        db.add(job)
+        await db.commit()
+
+    async def _run(self, job_id: int):
+        async with AsyncSessionLocal() as db:
+            # Claim the job atomically (several API workers may share the table)
+            claimed = await db.execute(
+                update(RecaudacionImportJob)
+                .where(RecaudacionImportJob.id == job_id, RecaudacionImportJob.status == "pending")
+                .values(
+                    status="running", progress=5, started_at=datetime.now(),
+                    worker_id=self.worker_id, heartbeat_at=datetime.now()
+                )
+            )
+            await db.commit()
+            if claimed.rowcount == 0:
+                return
+
+            job = await db.get(RecaudacionImportJob, job_id)
+            try:
+                db_file = await db.get(RecaudacionFichero, job.fichero_id) if job.fichero_id else None
+                if not db_file:
+                    raise ValueError("File not found")
+
+                contents = await asyncio.to_thread(read_bytes, db_file.file_path)
+                await self._set_status(db, job, progress=10)
+
+                parsed = await self.parse(contents)
+                await self._set_status(db, job, progress=60, total_rows=len(parsed["rows"]))
+
+                rec = await db.get(Recaudacion, job.recaudacion_id)
+                if not rec:
+                    raise ValueError("Recaudacion not found")
+
+                result = await recaudacion.apply_import(db, rec=rec, parsed=parsed)
+                result["is_normalized"] = parsed["is_normalized"]
+                try:
+                    await recaudacion.record_import(
+                        db,
+                        recaudacion_id=rec.id,
+                        fichero_id=db_file.id,
+                        content_hash=db_file.content_hash or hashlib.sha256(contents).hexdigest(),
+                        parsed=parsed,
+                        result=result
+                    )
+                except Exception as e:
+                    # The data is already applied (committed): the job is done, only the
+                    # import record (diff base, duplicate check) is missing
+                    await db.rollback()
+                    traceback.print_exc()
+                    result["warning"] = f"Import applied but not recorded: {e}"
+
+                await self._set_status(
+                    db, job,
+                    status="done",
+                    progress=100,
+                    updated_rows=result["updated"],
+                    result=result,
+                    finished_at=datetime.now()
+                )
+            except Exception as e:
+                await db.rollback()
+                job = await db.get(RecaudacionImportJob, job_id)
+                await self._set_status(db, job, status="error", error=str(e), finished_at=datetime.now())
+
+
+import_queue = ImportJobQueue(
+    workers=settings.IMPORT_JOB_WORKERS,
+    processes=settings.IMPORT_PARSE_PROCESSES
+)
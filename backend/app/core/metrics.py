@@ -0,0 +1,318 @@
+import bisect
+import re
+import time
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from app.core.principal_cache import principal_cache
+from app.core.profile_cache import profile_cache
+from app.core.security import password_hash_stats
+from app.db.session import engine, read_engine, pool_stats
+
+# Request / DB / Excel metrics in Prometheus text format (exposition 0.0.4), served at
+# /metrics. Values live in this process: each API worker exposes its own series.
+# Updated from the event loop only (no locking); recording is a dict lookup and a
+# bisect, so it stays far below a millisecond per request.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+EXCEL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Labels = Tuple[str, ...]
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def samples(self) -> Iterable[Tuple[str, List[Tuple[str, str]], float]]:
+        # (sample name, label pairs, value)
+        raise NotImplementedError
+
+    def _pairs(self, labels: Labels) -> List[Tuple[str, str]]:
+        return list(zip(self.labels, labels))
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, self._pairs(labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (not cumulative), ..., sum, count]
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self):
+        for labels, series in self._series.items():
+            pairs = self._pairs(labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield self.name + "_bucket", pairs + [("le", _format_value(bound))], cumulative
+            yield self.name + "_bucket", pairs + [("le", "+Inf")], series[-1]
+            yield self.name + "_sum", pairs, series[-2]
+            yield self.name + "_count", pairs, series[-1]
+
+
+# Collectors: called at scrape time, return (name, kind, help, [(labels dict, value)])
+Collected = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], Iterable[Collected]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], Iterable[Collected]]):
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, pairs, value in metric.samples():
+                lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+        for fn in self._collectors:
+            for name, kind, help, values in fn():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    lines.append(f"{name}{_format_labels(labels.items())} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(pairs) -> str:
+    pairs = list(pairs)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status code", ("method", "route", "status")))
+http_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency (until the last body chunk is sent)", ("method", "route")))
+http_in_progress = registry.register(Gauge(
+    "http_requests_in_progress", "HTTP requests being served", ("method",)))
+http_db_queries = registry.register(Histogram(
+    "http_request_db_queries", "SQL statements executed per HTTP request", ("route",), QUERY_COUNT_BUCKETS))
+http_db_duration = registry.register(Histogram(
+    "http_request_db_duration_seconds", "Time spent executing SQL per HTTP request", ("route",)))
+db_queries = registry.register(Counter(
+    "db_queries_total", "SQL statements executed (requests and background jobs)", ("engine",)))
+db_duration = registry.register(Counter(
+    "db_query_duration_seconds_total", "Time spent executing SQL statements", ("engine",)))
+excel_parse_duration = registry.register(Histogram(
+    "excel_parse_duration_seconds", "Excel workbook parsing time (process pool, including queueing)", ("kind",), EXCEL_BUCKETS))
+excel_parse_rows = registry.register(Counter(
+    "excel_parse_rows_total", "Machine rows read from parsed workbooks", ("kind",)))
+excel_parse_errors = registry.register(Counter(
+    "excel_parse_errors_total", "Workbooks that could not be parsed", ("kind",)))
+excel_export_duration = registry.register(Histogram(
+    "excel_export_duration_seconds", "Export generation time (streamed exports: until the last chunk)", ("kind",), EXCEL_BUCKETS))
+excel_export_rows = registry.register(Counter(
+    "excel_export_rows_total", "Rows written to exports", ("kind",)))
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# Set by MetricsMiddleware for the duration of a request (tasks spawned by it share it)
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def instrument_engine(async_engine, name: str):
+    """
+    Count SQL statements and their execution time, globally and for the current request.
+    """
+    @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_start
+        db_queries.inc(name)
+        db_duration.inc(name, amount=elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+
+class RouteTemplates:
+    """
+    Path -> route template (/api/v1/recaudaciones/{id}) for metric labels, from the
+    application's OpenAPI paths (the router does not leave the template in the scope
+    once included routers are resolved). Indexed by segment count; recent paths cached.
+    """
+
+    def __init__(self, max_cached: int = 4096):
+        self.max_cached = max_cached
+        self._index = None
+        self._cache: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+
+    def _build(self, app):
+        index = defaultdict(list)
+        for template, operations in app.openapi().get("paths", {}).items():
+            regex = re.compile("^" + re.sub(r"\{[^/]+\}", "[^/]+", template) + "$")
+            methods = {m.upper() for m in operations}
+            index[template.count("/")].append((regex, methods, template))
+        return index
+
+    def resolve(self, app, method: str, path: str) -> str:
+        key = (method, path)
+        template = self._cache.get(key)
+        if template is not None:
+            return template
+        if self._index is None:
+            self._index = self._build(app)
+
+        template = "unmatched"
+        for regex, methods, candidate in self._index.get(path.count("/"), ()):
+            if regex.match(path):
+                template = candidate
+                if method in methods:
+                    break
+        self._cache[key] = template
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return template
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request. Routes are labelled with their path
+    template, paths of no route as "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.routes = RouteTemplates()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        stats = RequestStats()
+        token = current_request.set(stats)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_progress.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_in_progress.dec(method)
+            current_request.reset(token)
+            route = self.routes.resolve(scope["app"], method, scope["path"])
+            http_requests.inc(method, route, str(status))
+            http_duration.observe(elapsed, method, route)
+            http_db_queries.observe(stats.queries, route)
+            http_db_duration.observe(stats.db_seconds, route)
+
+
+@registry.collector
+def _runtime_stats() -> Iterable[Collected]:
+    # Counters kept by other modules
+    hashing = password_hash_stats.snapshot()
+    yield "password_hash_total", "counter", "Password hashes / verifications run", [({}, hashing["count"])]
+    yield "password_hash_seconds_total", "counter", "Time spent hashing passwords", [({}, hashing["seconds_total"])]
+    yield "password_hash_seconds_max", "gauge", "Slowest password hash so far", [({}, hashing["seconds_max"])]
+    yield "password_hash_queued", "gauge", "Password checks waiting for a hashing thread", [({}, hashing["queued"])]
+    yield "password_hash_running", "gauge", "Password checks running", [({}, hashing["running"])]
+    yield "password_hash_rejected_total", "counter", "Password checks rejected (queue full)", [({}, hashing["rejected"])]
+
+    caches = {"principal": principal_cache.stats(), "profile": profile_cache.stats()}
+    yield "cache_entries", "gauge", "Entries in in-process caches", [({"cache": k}, v["entries"]) for k, v in caches.items()]
+    yield "cache_hits_total", "counter", "In-process cache hits", [({"cache": k}, v["hits"]) for k, v in caches.items()]
+    yield "cache_misses_total", "counter", "In-process cache misses", [({"cache": k}, v["misses"]) for k, v in caches.items()]
+
+    pools = {"primary": pool_stats(engine)}
+    if read_engine is not engine:
+        pools["read"] = pool_stats(read_engine)
+    for name, key, kind, help in (
+        ("db_pool_size", "pool_size", "gauge", "Connections kept by the pool"),
+        ("db_pool_checked_out", "checked_out", "gauge", "Connections in use"),
+        ("db_pool_overflow", "overflow", "gauge", "Overflow connections open"),
+        ("db_pool_checkouts_total", "checkouts", "counter", "Connection checkouts"),
+        ("db_pool_timeouts_total", "timeouts", "counter", "Checkouts that timed out"),
+        ("db_pool_wait_seconds_total", "wait_seconds_total", "counter", "Time spent waiting for a connection"),
+    ):
+        yield name, kind, help, [({"engine": k}, v[key]) for k, v in pools.items() if key in v]
@@ -0,0 +1,201 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from app.core.config import settings
+
+# Authenticated principal cache for deps.get_current_user.
+# Entries are immutable snapshots of the user row and its UsuarioSalon permissions,
+# keyed by (user id, auth version from the token). update_user / delete_user bump
+# Usuario.auth_version and invalidate the user here; other API workers pick the change
+# up when their entry expires (short TTL).
+# With TOKEN_PERMISSIONS the same snapshot travels in the token (per-salon bitmaps) and
+# only the current auth version per user is looked up (cached with the same TTL).
+
+# Bit per UsuarioSalon flag in token bitmaps. Append only: issued tokens depend on it
+PERMISSION_BITS = {
+    "puede_ver": 1,
+    "puede_editar": 2,
+    "ver_dashboard": 4,
+    "ver_recaudaciones": 8,
+    "editar_recaudaciones": 16,
+    "ver_historico": 32,
+}
+
+ADMIN_ROLES = ("Admin", "Superadmin", "Administrador")
+
+
+@dataclass(frozen=True, slots=True)
+class SalonPermissions:
+    salon_id: int
+    puede_ver: bool
+    puede_editar: bool
+    ver_dashboard: bool
+    ver_recaudaciones: bool
+    editar_recaudaciones: bool
+    ver_historico: bool
+
+    @classmethod
+    def from_assignment(cls, us) -> "SalonPermissions":
+        return cls(
+            salon_id=us.salon_id,
+            puede_ver=bool(us.puede_ver),
+            puede_editar=bool(us.puede_editar),
+            ver_dashboard=bool(us.ver_dashboard),
+            ver_recaudaciones=bool(us.ver_recaudaciones),
+            editar_recaudaciones=bool(us.editar_recaudaciones),
+            ver_historico=bool(us.ver_historico),
+        )
+
+    @classmethod
+    def from_bitmap(cls, salon_id: int, bits: int) -> "SalonPermissions":
+        return cls(salon_id, **{name: bool(bits & bit) for name, bit in PERMISSION_BITS.items()})
+
+    def bitmap(self) -> int:
+        return sum(bit for name, bit in PERMISSION_BITS.items() if getattr(self, name))
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """
+    What get_current_user returns: enough of Usuario for authorization (id, flags and
+    per-salon permissions) without an ORM object tied to a session.
+    """
+    id: int
+    username: Optional[str] # Not carried by permission tokens
+    nombre: Optional[str]
+    email: Optional[str]
+    activo: bool
+    is_admin: bool # Admin / Superadmin / Administrador role (or 'admin'): every salon
+    auth_version: int
+    salones: Tuple[SalonPermissions, ...]
+    # Salon ids granted per permission, compiled once per principal (cached with it)
+    _allowed: Dict[str, FrozenSet[int]] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        allowed = {
+            name: frozenset(s.salon_id for s in self.salones if getattr(s, name))
+            for name in PERMISSION_BITS
+        }
+        object.__setattr__(self, "_allowed", allowed)
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            nombre=user.nombre,
+            email=user.email,
+            activo=bool(user.activo),
+            is_admin=user.username == "admin" or any(r.nombre in ADMIN_ROLES for r in user.roles),
+            auth_version=user.auth_version or 1,
+            salones=tuple(SalonPermissions.from_assignment(us) for us in user.salones_asignados),
+        )
+
+    @classmethod
+    def from_token(cls, payload) -> "Principal":
+        # payload: TokenPayload issued with token_claims()
+        return cls(
+            id=int(payload.sub),
+            username=None,
+            nombre=None,
+            email=None,
+            activo=True, # Deactivation bumps auth_version, rejecting the token
+            is_admin=bool(payload.adm),
+            auth_version=payload.av,
+            salones=tuple(SalonPermissions.from_bitmap(int(k), v) for k, v in payload.perms.items()),
+        )
+
+    def token_claims(self) -> Dict[str, object]:
+        return {
+            "perms": {str(s.salon_id): s.bitmap() for s in self.salones},
+            "adm": self.is_admin,
+        }
+
+    def has_permission(self, salon_id: int, permission: str) -> bool:
+        if self.is_admin:
+            return True
+        return salon_id in self._allowed[permission]
+
+    def allowed_salons(self, permission: str) -> Optional[FrozenSet[int]]:
+        # None for admins: every salon, no filter needed
+        if self.is_admin:
+            return None
+        return self._allowed[permission]
+
+    @property
+    def salon_ids(self) -> Tuple[int, ...]:
+        return tuple(s.salon_id for s in self.salones)
+
+    def salon(self, salon_id: int) -> Optional[SalonPermissions]:
+        for s in self.salones:
+            if s.salon_id == salon_id:
+                return s
+        return None
+
+CacheKey = Tuple[int, Optional[int]] # (user id, auth version claimed by the token)
+
+
+class PrincipalCache:
+    """
+    TTL + LRU bounded map of principals. Used from the event loop only (no locking).
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Principal]]" = OrderedDict()
+        self._versions: "OrderedDict[int, Tuple[float, int]]" = OrderedDict() # user id -> current auth_version
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, auth_version: Optional[int]) -> Optional[Principal]:
+        key = (user_id, auth_version)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, auth_version: Optional[int], principal: Principal):
+        key = (principal.id, auth_version)
+        self._entries[key] = (time.monotonic() + self.ttl, principal)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self.put_version(principal.id, principal.auth_version)
+
+    def get_version(self, user_id: int) -> Optional[int]:
+        entry = self._versions.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def put_version(self, user_id: int, auth_version: int):
+        self._versions[user_id] = (time.monotonic() + self.ttl, auth_version)
+        self._versions.move_to_end(user_id)
+        while len(self._versions) > self.max_entries:
+            self._versions.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        for key in [k for k in self._entries if k[0] == user_id]:
+            del self._entries[key]
+        self._versions.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._versions.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+principal_cache = PrincipalCache(
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+    max_entries=settings.PRINCIPAL_CACHE_SIZE
+)
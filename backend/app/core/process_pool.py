@@ -0,0 +1,66 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from app.core.config import settings
+
+
+class ProcessPool:
+    """
+    Lazily created ProcessPoolExecutor for CPU-bound work (pandas parsing, workbook
+    generation). Uses the spawn context: functions and arguments must be picklable and
+    defined at module level.
+    If a worker process dies (OOM on a huge workbook, segfault) the executor breaks: the
+    calls running on it fail with BrokenProcessPool and it is replaced for later ones.
+    """
+
+    def __init__(self, processes: int):
+        self.processes = processes
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # Created lazily so scripts importing the app don't spawn processes
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def submit(self, fn, *args) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            future = loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # Broken by a call whose result nobody has seen yet: this one never ran
+            self._replace(executor)
+            executor = self.executor
+            future = loop.run_in_executor(executor, fn, *args)
+        future.add_done_callback(lambda f: self._check_broken(f, executor))
+        return future
+
+    async def run(self, fn, *args):
+        return await self.submit(fn, *args)
+
+    def _check_broken(self, future: asyncio.Future, executor: ProcessPoolExecutor):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._replace(executor)
+
+    def _replace(self, executor: ProcessPoolExecutor):
+        # Only once per broken executor (its other calls fail the same way)
+        if self._executor is executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Workbook generation for multi-recaudacion exports
+export_pool = ProcessPool(processes=settings.EXPORT_PROCESSES)
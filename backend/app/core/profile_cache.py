@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings
+
+# Serialized /users/me payloads (JSON bytes), one per user. An entry is only valid for
+# the user's auth_version (bumped by update_user on any change of profile, roles or
+# salon permissions) and the salon catalog version (bumped on salon create / update /
+# delete, since admins get every salon and assignments embed the salon). Other API
+# workers see salon changes once their entries expire (TTL).
+
+ProfileKey = Tuple[int, int] # (auth_version, catalog version)
+
+
+class ProfileCache:
+    """
+    TTL + LRU bounded map of pre-serialized profiles. Used from the event loop only.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.catalog_version = 0
+        self._entries: "OrderedDict[int, Tuple[ProfileKey, float, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, auth_version: int) -> Optional[bytes]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] != (auth_version, self.catalog_version) or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, user_id: int, key: ProfileKey, content: bytes):
+        # key: versions read *before* building the payload, so a salon change that
+        # happened meanwhile leaves an entry that never matches
+        self._entries[user_id] = (key, time.monotonic() + self.ttl, content)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def bump_catalog(self):
+        self.catalog_version += 1
+        self._entries.clear()
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+profile_cache = ProfileCache(
+    ttl=settings.PROFILE_CACHE_TTL_SECONDS,
+    max_entries=settings.PRINCIPAL_CACHE_SIZE
+)
@@ -0,0 +1,171 @@
+import logging
+import re
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+from app.db.session import ENGINE_PROFILES
+
+# Statement fingerprinting to catch N+1 patterns: every SQL statement run is reduced to
+# its shape (literals and bind parameters as ?, IN lists folded) and counted per request.
+# With the audit on (dev profile by default) requests running the same shape more than
+# QUERY_AUDIT_REPEAT_LIMIT times are logged.
+# query_budget(n) counts statements the same way for tests, e.g.
+#
+#     with query_budget(3):
+#         client.get("/api/v1/recaudaciones/")
+
+logger = logging.getLogger(__name__)
+
+_PARAM = re.compile(r"\$\d+|%\(\w+\)s|%s|(?<!:):[A-Za-z_]\w*|\?")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+# asyncpg casts its parameters: IN ($1::INTEGER, $2::INTEGER), ($1::NUMERIC(10, 2), ...)
+_CAST = r"(?:::[^,()]+(?:\([^()]*\))?)?"
+_LIST = re.compile(r"\(\s*\?" + _CAST + r"(?:\s*,\s*\?" + _CAST + r")+\s*\)")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?" + _CAST + r"\s*\)", re.IGNORECASE) # One element
+_SPACES = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    shape = _STRING.sub("?", statement)
+    shape = _PARAM.sub("?", shape)
+    shape = _NUMBER.sub("?", shape)
+    shape = _LIST.sub("(?...)", shape)
+    shape = _IN_LIST.sub("IN (?...)", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+class _FingerprintCache:
+    # Compiled statements repeat (SQLAlchemy caches them), so the regexes run once per text
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, statement: str) -> str:
+        shape = self._entries.get(statement)
+        if shape is None:
+            shape = self._entries[statement] = fingerprint(statement)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return shape
+
+
+_fingerprints = _FingerprintCache()
+
+
+class QueryLog:
+    """
+    Statements seen in a request (or query_budget block): total and count per shape.
+    """
+    __slots__ = ("total", "shapes")
+
+    def __init__(self):
+        self.total = 0
+        self.shapes: Dict[str, int] = {}
+
+    def add(self, statement: str, executemany: bool):
+        shape = _fingerprints.get(statement)
+        if executemany:
+            shape = "[executemany] " + shape
+        self.total += 1
+        self.shapes[shape] = self.shapes.get(shape, 0) + 1
+
+    def repeated(self, limit: int) -> List[Tuple[str, int]]:
+        # Shapes run more than limit times, most frequent first
+        return sorted(((s, n) for s, n in self.shapes.items() if n > limit), key=lambda x: -x[1])
+
+    def summary(self, top: int = 5) -> str:
+        lines = [f"{n}x {_truncate(s)}" for s, n in sorted(self.shapes.items(), key=lambda x: -x[1])[:top]]
+        return "\n".join(lines)
+
+
+class QueryBudgetExceeded(AssertionError):
+    def __init__(self, budget: int, log: QueryLog):
+        self.budget = budget
+        self.log = log
+        super().__init__(f"{log.total} SQL statements run, budget was {budget}. Most frequent:\n{log.summary()}")
+
+
+# Request being audited (set by QueryAuditMiddleware)
+current_log: ContextVar[Optional[QueryLog]] = ContextVar("current_query_log", default=None)
+# Open query_budget blocks. Not a context variable: TestClient runs the app in its own
+# thread and event loop, so the block has to see statements from any context.
+_budgets: List[QueryLog] = []
+
+
+def audit_enabled() -> bool:
+    if settings.QUERY_AUDIT is not None:
+        return settings.QUERY_AUDIT
+    return ENGINE_PROFILES[settings.DB_PROFILE]["query_audit"]
+
+
+def install():
+    """
+    Feed statements run on any engine (the API ones, test engines) to the current request
+    log and query budgets. Idempotent.
+    """
+    if event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    log = current_log.get()
+    if log is not None:
+        log.add(statement, executemany)
+    for budget in _budgets:
+        budget.add(statement, executemany)
+
+
+@contextmanager
+def query_budget(n: int) -> Iterator[QueryLog]:
+    """
+    Fail (QueryBudgetExceeded, an AssertionError) if the block runs more than n SQL
+    statements. Yields the QueryLog, for finer assertions.
+    """
+    install()
+    log = QueryLog()
+    _budgets.append(log)
+    try:
+        yield log
+    finally:
+        _budgets.remove(log)
+    if log.total > n:
+        raise QueryBudgetExceeded(n, log)
+
+
+class QueryAuditMiddleware:
+    """
+    ASGI middleware logging requests that repeat a statement shape (N+1 candidates).
+    """
+
+    def __init__(self, app, repeat_limit: Optional[int] = None):
+        self.app = app
+        self.repeat_limit = repeat_limit or settings.QUERY_AUDIT_REPEAT_LIMIT
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        log = QueryLog()
+        token = current_log.set(log)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_log.reset(token)
+            for shape, count in log.repeated(self.repeat_limit):
+                logger.warning(
+                    "Possible N+1: %s %s ran %d times (%d statements in the request): %s",
+                    scope["method"], scope["path"], count, log.total, _truncate(shape)
+                )
+
+
+def _truncate(shape: str, length: int = 300) -> str:
+    return shape if len(shape) <= length else shape[:length] + "..."
@@ -0,0 +1,44 @@
+from typing import FrozenSet, Iterable, Optional
+
+from sqlalchemy import ARRAY, Integer, any_, literal, true
+
+# Query-level salon scoping. A SalonScope holds the salon ids a principal may read for a
+# permission (Principal.allowed_salons) and turns them into a `salon_id = ANY(:ids)`
+# predicate, so rows of other salons are never read nor serialized. One array parameter
+# whatever the number of salons: the statement text stays the same for every user.
+
+
+class SalonScope:
+    __slots__ = ("salon_ids",)
+
+    def __init__(self, salon_ids: Optional[FrozenSet[int]]):
+        self.salon_ids = salon_ids # None: unrestricted (admins)
+
+    @property
+    def unrestricted(self) -> bool:
+        return self.salon_ids is None
+
+    def allows(self, salon_id: int) -> bool:
+        return self.salon_ids is None or salon_id in self.salon_ids
+
+    def restrict(self, requested: Optional[Iterable[int]]) -> "SalonScope":
+        """
+        Narrow the scope to the salons asked for by the client (salon_id / salon_ids
+        filters). Salons outside the scope are dropped, not reported.
+        """
+        if not requested:
+            return self
+        requested = frozenset(requested)
+        if self.salon_ids is None:
+            return SalonScope(requested)
+        return SalonScope(self.salon_ids & requested)
+
+    def clause(self, column):
+        if self.salon_ids is None:
+            return true()
+        return column == any_(literal(sorted(self.salon_ids), ARRAY(Integer)))
+
+    def apply(self, query, column):
+        if self.salon_ids is None:
+            return query
+        return query.where(self.clause(column))
@@ -1,18 +1,31 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Union, Optional
+from typing import Any, Dict, Union, Optional, Tuple
+
+import bcrypt
 from jose import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
 
 pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
 
-def create_access_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None) -> str:
+def create_access_token(
+    subject: Union[str, Any], expires_delta: Optional[timedelta] = None, auth_version: Optional[int] = None,
+    claims: Optional[Dict[str, Any]] = None
+) -> str:
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
     to_encode = {"exp": expire, "sub": str(subject)}
+    if auth_version is not None:
+        to_encode["av"] = auth_version
+    if claims:
+        to_encode.update(claims)
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
@@ -21,3 +34,87 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify and, when the hash uses a deprecated scheme (bcrypt), return a new Argon2 hash to store.
+    """
+    if pwd_context.identify(hashed_password) == "bcrypt":
+        # Checked with bcrypt directly: passlib's bcrypt backend fails to load with bcrypt>=4.1
+        valid = bcrypt.checkpw(plain_password.encode("utf-8")[:72], hashed_password.encode("utf-8"))
+        return valid, (pwd_context.hash(plain_password) if valid else None)
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+# --- Off-loop hashing ---
+# Argon2 is CPU (and memory) heavy on purpose. The async variants below run it in a
+# dedicated bounded thread pool (argon2-cffi / bcrypt release the GIL), so a login
+# burst queues here instead of blocking the event loop. Beyond PASSWORD_HASH_MAX_QUEUE
+# waiting requests, PasswordHashBusy is raised (the login endpoint answers 503).
+
+class PasswordHashBusy(Exception):
+    pass
+
+class PasswordHashStats:
+    # Counters read by the metrics endpoint. Updated from the pool threads
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.seconds_total = 0.0
+        self.seconds_max = 0.0
+        self.queued = 0 # Submitted, not started
+        self.running = 0
+        self.rejected = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "count": self.count,
+                "seconds_total": self.seconds_total,
+                "seconds_max": self.seconds_max,
+                "queued": self.queued,
+                "running": self.running,
+                "rejected": self.rejected,
+            }
+
+password_hash_stats = PasswordHashStats()
+
+_hash_executor = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+def _timed(fn, *args):
+    stats = password_hash_stats
+    with stats._lock:
+        stats.queued -= 1
+        stats.running += 1
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        elapsed = time.perf_counter() - started
+        with stats._lock:
+            stats.running -= 1
+            stats.count += 1
+            stats.seconds_total += elapsed
+            stats.seconds_max = max(stats.seconds_max, elapsed)
+
+async def _run_hashing(fn, *args):
+    stats = password_hash_stats
+    with stats._lock:
+        if stats.queued >= settings.PASSWORD_HASH_MAX_QUEUE:
+            stats.rejected += 1
+            raise PasswordHashBusy("Too many concurrent password checks, retry shortly")
+        stats.queued += 1
+    future = _hash_executor.submit(_timed, fn, *args)
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        if future.cancel(): # Client went away before it started: never ran _timed
+            with stats._lock:
+                stats.queued -= 1
+        raise
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await _run_hashing(verify_and_update_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hashing(get_password_hash, password)
@@ -0,0 +1,319 @@
+import asyncio
+import glob
+import heapq
+import json
+import logging
+import os
+import queue
+import random
+import re
+import time
+from contextvars import Context, ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.core.config import settings
+from app.core.metrics import RouteTemplates
+from app.db.session import engine_options
+
+# Slow-query log: statements taking SLOW_QUERY_MS or more (or failing after it, e.g. on
+# statement_timeout) are written as JSON lines to a rotating file with their duration,
+# bound parameter shapes (types and sizes, never values), route and user.
+# A sample of slow SELECTs is re-run in the background with EXPLAIN (ANALYZE, BUFFERS),
+# in a read-only transaction against the same database, and the plan goes into the record.
+# EXPLAINs use their own one-connection engine, so they never take a connection from the
+# API pool (which may be what is slow).
+# Each worker process writes its own file (slow_queries.<pid>.jsonl, rotated on its own:
+# logging cannot rotate a file shared by processes), from a QueueListener thread so the
+# event loop never touches it. GET /system/slow-queries merges them back.
+
+STATEMENT_MAX_CHARS = 4000
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+
+class RequestInfo:
+    __slots__ = ("method", "path", "app", "user_id")
+
+    def __init__(self, method: str, path: str, app):
+        self.method = method
+        self.path = path
+        self.app = app
+        self.user_id = None
+
+
+# Set by SlowQueryMiddleware for the duration of a request
+current_request: ContextVar[Optional[RequestInfo]] = ContextVar("slow_query_request", default=None)
+
+
+def note_user(user_id):
+    # Called once the request's token is decoded
+    info = current_request.get()
+    if info is not None and user_id is not None:
+        info.user_id = int(user_id)
+
+
+def _shape(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, (list, tuple, set)):
+        return f"{type(value).__name__}[{len(value)}]"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+
+def parameter_shapes(parameters, executemany: bool = False):
+    if executemany:
+        first = parameter_shapes(parameters[0]) if parameters else []
+        return {"executemany": len(parameters), "row": first}
+    if isinstance(parameters, dict):
+        return {k: _shape(v) for k, v in parameters.items()}
+    return [_shape(v) for v in parameters or ()]
+
+
+class SlowQueryLog:
+    """
+    Per-process slow-query recorder. install() hooks an engine; start() / stop() run the
+    writer thread (records produced before start() are queued).
+    path is the base name: the worker writes {stem}.{pid}{ext}.
+    """
+
+    def __init__(
+        self, path: str, threshold_ms: int, explain_sample: float, max_bytes: int, backups: int,
+        keep_days: int = 7
+    ):
+        self.base_path = path
+        self.path = self._worker_path(os.getpid())
+        self.threshold = threshold_ms / 1000
+        self.explain_sample = explain_sample
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.keep_days = keep_days
+        self._queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+        self._logger = logging.getLogger("app.slow_queries")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(QueueHandler(self._queue))
+        self._listener: Optional[QueueListener] = None
+        self._routes = RouteTemplates()
+        self._explain_task: Optional[asyncio.Task] = None
+        self._explain_engines = {} # engine name -> one-connection engine for EXPLAIN
+        self.recorded = 0
+        self.explained = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def _worker_path(self, pid: int) -> str:
+        stem, ext = os.path.splitext(self.base_path)
+        return f"{stem}.{pid}{ext}"
+
+    def _files(self) -> List[str]:
+        # Every worker's current file and backups (including workers gone since)
+        stem, ext = os.path.splitext(self.base_path)
+        return glob.glob(f"{glob.escape(stem)}.*{glob.escape(ext)}*")
+
+    def start(self):
+        if self._listener is not None:
+            return
+        # Workers are forked after import: the file is named after the process running
+        self.path = self._worker_path(os.getpid())
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._prune()
+        handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._listener = QueueListener(self._queue, handler)
+        self._listener.start()
+
+    async def stop(self):
+        # Flushes queued records
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+        for explain_engine in self._explain_engines.values():
+            await explain_engine.dispose()
+        self._explain_engines.clear()
+
+    def _prune(self):
+        # Files of old worker processes nobody writes to any more
+        cutoff = time.time() - self.keep_days * 86400
+        for path in self._files():
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def install(self, async_engine, name: str):
+        sync_engine = async_engine.sync_engine
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            context._slow_query_start = time.perf_counter()
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - context._slow_query_start
+            if elapsed >= self.threshold:
+                self._record(async_engine, name, elapsed, statement, parameters, executemany)
+
+        @event.listens_for(sync_engine, "handle_error")
+        def _handle_error(exception_context):
+            context = exception_context.execution_context
+            start = getattr(context, "_slow_query_start", None)
+            if start is None:
+                return
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold:
+                self._record(
+                    async_engine, name, elapsed, exception_context.statement, exception_context.parameters,
+                    context.executemany, error=str(exception_context.original_exception)[:500]
+                )
+
+    def _record(self, async_engine, name, elapsed, statement, parameters, executemany, error=None):
+        info = current_request.get()
+        record = {
+            "at": datetime.now().isoformat(timespec="milliseconds"),
+            "duration_ms": round(elapsed * 1000, 1),
+            "engine": name,
+            "method": info.method if info else None,
+            "route": self._routes.resolve(info.app, info.method, info.path) if info else None,
+            "path": info.path if info else None,
+            "user_id": info.user_id if info else None,
+            "statement": statement[:STATEMENT_MAX_CHARS],
+            "parameters": parameter_shapes(parameters, executemany),
+        }
+        if error:
+            record["error"] = error
+        self.recorded += 1
+
+        # At most one EXPLAIN running per process; never for writes (nor executemany)
+        if (
+            error is None and not executemany
+            and async_engine.dialect.name == "postgresql"
+            and _EXPLAINABLE.match(statement)
+            and (self._explain_task is None or self._explain_task.done())
+            and random.random() < self.explain_sample
+        ):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None:
+                # Fresh context: not part of the request's metrics / query audit
+                self._explain_task = loop.create_task(
+                    self._explain(async_engine, name, statement, parameters, record), context=Context()
+                )
+                return
+        self._write(record)
+
+    def _explain_engine(self, async_engine, name: str):
+        explain_engine = self._explain_engines.get(name)
+        if explain_engine is None:
+            url = async_engine.url.render_as_string(hide_password=False)
+            options = engine_options(url, read_only=True)
+            options.update(echo=False, pool_size=1, max_overflow=0)
+            explain_engine = self._explain_engines[name] = create_async_engine(url, **options)
+        return explain_engine
+
+    async def _explain(self, async_engine, name, statement, parameters, record):
+        try:
+            async with self._explain_engine(async_engine, name).connect() as conn:
+                await conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+                result = await conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+                record["explain"] = "\n".join(row[0] for row in result)
+                await conn.rollback()
+            self.explained += 1
+        except Exception as e:
+            record["explain_error"] = str(e)[:500]
+        finally:
+            self._write(record)
+
+    def _write(self, record: Dict[str, Any]):
+        self._logger.info(json.dumps(record, default=str))
+
+    def read(
+        self, limit: int = 100, min_ms: Optional[float] = None, route: Optional[str] = None,
+        user_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Most recent records first, merged across the workers' files. Blocking: call
+        through asyncio.to_thread.
+        """
+        def matches(record) -> bool:
+            return (
+                (min_ms is None or record["duration_ms"] >= min_ms)
+                and (route is None or record.get("route") == route)
+                and (user_id is None or record.get("user_id") == user_id)
+            )
+
+        # Per worker file set: current file, then .1, .2, ... each newest line first
+        workers = {}
+        for path in self._files():
+            current, _, backup = path.rpartition(os.path.splitext(self.base_path)[1])
+            workers.setdefault(current, []).append((int(backup.lstrip(".") or 0), path))
+        streams = [
+            (r for _, path in sorted(paths) for r in _records_newest_first(path) if matches(r))
+            for paths in workers.values()
+        ]
+        merged = heapq.merge(*streams, key=lambda r: r["at"], reverse=True)
+        return [record for _, record in zip(range(limit), merged)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "explain_sample": self.explain_sample,
+            "recorded": self.recorded,
+            "explained": self.explained,
+            "file": self.path,
+            "files": len(self._files()),
+        }
+
+
+def _records_newest_first(path: str) -> Iterator[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return # Rotated meanwhile
+    for line in reversed(lines):
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue # Line being written
+
+
+class SlowQueryMiddleware:
+    """
+    ASGI middleware giving slow-query records the request's route (and user, see note_user).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_request.set(RequestInfo(scope["method"], scope["path"], scope["app"]))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_request.reset(token)
+
+
+slow_query_log = SlowQueryLog(
+    path=settings.SLOW_QUERY_LOG_FILE or os.path.join(settings.UPLOAD_DIR, "logs", "slow_queries.jsonl"),
+    threshold_ms=settings.SLOW_QUERY_MS,
+    explain_sample=settings.SLOW_QUERY_EXPLAIN_SAMPLE,
+    max_bytes=settings.SLOW_QUERY_LOG_MAX_MB * 1024 * 1024,
+    backups=settings.SLOW_QUERY_LOG_BACKUPS,
+    keep_days=settings.SLOW_QUERY_LOG_KEEP_DAYS
+)
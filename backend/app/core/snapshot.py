@@ -0,0 +1,258 @@
+import asyncio
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.crud.crud_recaudacion import recaudacion_facts_query
+from app.models.recaudacion import Recaudacion, RecaudacionMaquina
+
+# Columnar snapshot of the revenue fact table (recaudacion_facts_query) for offline analysis.
+# Hive-style layout, one Parquet file per partition:
+#   {SNAPSHOT_DIR}/year=2025/salon_id=3/part-0.parquet
+# plus _manifest.json with the (version, partition) of every recaudacion included, which
+# lets incremental runs rewrite only the partitions whose recaudaciones changed.
+# pyarrow (requirements.txt) is imported on first use: it adds ~50 MB to every API
+# worker otherwise, and only snapshot runs need it.
+
+SNAPSHOT_DIR = os.path.join(settings.UPLOAD_DIR, "snapshots", "recaudacion_maquina")
+MANIFEST_FILE = "_manifest.json"
+PART_FILE = "part-0.parquet"
+
+Partition = Tuple[int, int] # (year, salon_id)
+
+
+def _import_pyarrow():
+    import pyarrow
+    import pyarrow.parquet
+    return pyarrow, pyarrow.parquet
+
+
+def _arrow_schema(pa):
+    # salon_id is not stored in the files: it is part of the partition path
+    money = pa.decimal128(12, 2)
+    tax = pa.decimal128(12, 4)
+    return pa.schema([
+        ("recaudacion_id", pa.int32()),
+        ("salon_nombre", pa.string()),
+        ("fecha_inicio", pa.timestamp("us")),
+        ("fecha_fin", pa.timestamp("us")),
+        ("fecha_cierre", pa.date32()),
+        ("detalle_id", pa.int32()),
+        ("maquina_id", pa.int32()),
+        ("maquina_nombre", pa.string()),
+        ("numero_serie", pa.string()),
+        ("puesto_id", pa.int32()),
+        ("numero_puesto", pa.int32()),
+        ("puesto_descripcion", pa.string()),
+        ("retirada_efectivo", money),
+        ("cajon", money),
+        ("pago_manual", money),
+        ("ajuste", tax),
+        ("tasa_estimada", tax),
+        ("tasa_diferencia", tax),
+        ("tasa_final", tax),
+    ])
+
+
+def _partition_dir(root: str, partition: Partition) -> str:
+    year, salon_id = partition
+    return os.path.join(root, f"year={year}", f"salon_id={salon_id}")
+
+
+def _partitions_on_disk(root: str) -> Set[Partition]:
+    found = set()
+    if not os.path.isdir(root):
+        return found
+    with os.scandir(root) as years:
+        for y in years:
+            if not (y.is_dir() and y.name.startswith("year=")):
+                continue
+            with os.scandir(y.path) as salons:
+                for s in salons:
+                    if s.is_dir() and s.name.startswith("salon_id="):
+                        found.add((int(y.name[5:]), int(s.name[9:])))
+    return found
+
+
+def _remove_partition(root: str, partition: Partition):
+    shutil.rmtree(_partition_dir(root, partition), ignore_errors=True)
+    year_dir = os.path.dirname(_partition_dir(root, partition))
+    if os.path.isdir(year_dir) and not os.listdir(year_dir):
+        os.rmdir(year_dir)
+
+
+def load_manifest(root: str = SNAPSHOT_DIR) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(root, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(root: str, manifest: Dict[str, Any]):
+    path = os.path.join(root, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+class _PartitionWriter:
+    """
+    Writes streamed fact rows (ordered by partition) into one Parquet file per partition.
+    Rows are buffered into record batches of batch_size; only one file is open at a time
+    and it is renamed into place when its partition is complete.
+    """
+
+    def __init__(self, root: str, columns, batch_size: int):
+        self.pa, self.pq = _import_pyarrow()
+        self.root = root
+        self.schema = _arrow_schema(self.pa)
+        self.batch_size = batch_size
+
+        idx = {name: i for i, name in enumerate(columns)}
+        self._salon_idx = idx["salon_id"]
+        self._fecha_idx = idx["fecha_fin"]
+        self._field_idx = [idx[name] for name in self.schema.names]
+
+        self._partition: Optional[Partition] = None
+        self._writer = None
+        self._tmp_path = None
+        self._buffer = []
+        self.written: Set[Partition] = set()
+        self.rows = 0
+
+    def consume(self, rows):
+        for row in rows:
+            partition = (row[self._fecha_idx].year, row[self._salon_idx])
+            if partition != self._partition:
+                self.close()
+                self._open(partition)
+            self._buffer.append(row)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def _open(self, partition: Partition):
+        part_dir = _partition_dir(self.root, partition)
+        os.makedirs(part_dir, exist_ok=True)
+        self._partition = partition
+        self._tmp_path = os.path.join(part_dir, PART_FILE + ".tmp")
+        self._writer = self.pq.ParquetWriter(self._tmp_path, self.schema, compression="zstd")
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        arrays = [
+            self.pa.array([row[i] for row in self._buffer], type=field.type)
+            for i, field in zip(self._field_idx, self.schema)
+        ]
+        self._writer.write_batch(self.pa.record_batch(arrays, schema=self.schema))
+        self.rows += len(self._buffer)
+        self._buffer = []
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._flush()
+        self._writer.close()
+        os.replace(self._tmp_path, os.path.join(_partition_dir(self.root, self._partition), PART_FILE))
+        self.written.add(self._partition)
+        self._writer = None
+        self._partition = None
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            os.remove(self._tmp_path)
+            self._writer = None
+
+
+async def write_snapshot(
+    db: AsyncSession,
+    incremental: bool = False,
+    root: str = SNAPSHOT_DIR,
+    batch_size: int = settings.SNAPSHOT_BATCH_SIZE
+) -> Dict[str, Any]:
+    """
+    Write (or refresh) the snapshot under root.
+    Full mode rewrites every partition. Incremental mode compares recaudacion versions
+    with the previous manifest and only rewrites partitions with new, changed, moved or
+    deleted recaudaciones (renamed salons, machines and puestos bump the version of the
+    recaudaciones showing them, see models.recaudacion).
+    """
+    started = datetime.now()
+
+    # 1. Current state (read before the facts: a concurrent write is picked up next run)
+    stmt = select(Recaudacion.id, Recaudacion.version, Recaudacion.salon_id, Recaudacion.fecha_fin)
+    current = {
+        rec_id: {"version": version, "partition": [fecha_fin.year, salon_id]}
+        for rec_id, version, salon_id, fecha_fin in (await db.execute(stmt)).all()
+    }
+
+    # 2. Partitions to rewrite
+    previous = load_manifest(root) if incremental else None
+    if previous is None:
+        dirty = {tuple(c["partition"]) for c in current.values()} | _partitions_on_disk(root)
+        rec_ids = None # Everything
+    else:
+        prev_recs = {int(k): v for k, v in previous["recaudaciones"].items()}
+        dirty = set()
+        for rec_id, cur in current.items():
+            prev = prev_recs.get(rec_id)
+            if prev != cur:
+                dirty.add(tuple(cur["partition"]))
+                if prev:
+                    dirty.add(tuple(prev["partition"])) # Moved or changed
+        for rec_id, prev in prev_recs.items():
+            if rec_id not in current:
+                dirty.add(tuple(prev["partition"])) # Deleted
+        rec_ids = [rec_id for rec_id, cur in current.items() if tuple(cur["partition"]) in dirty]
+
+    # 3. Stream the facts of those partitions, in partition order
+    os.makedirs(root, exist_ok=True)
+    writer = None
+    if rec_ids is None or rec_ids:
+        facts = recaudacion_facts_query().order_by(None).order_by(
+            Recaudacion.salon_id, func.extract('year', Recaudacion.fecha_fin),
+            Recaudacion.fecha_fin, Recaudacion.id, RecaudacionMaquina.id
+        )
+        if rec_ids is not None:
+            facts = facts.where(Recaudacion.id.in_(rec_ids))
+
+        result = await db.stream(facts.execution_options(yield_per=batch_size))
+        writer = _PartitionWriter(root, list(result.keys()), batch_size)
+        try:
+            async for rows in result.partitions():
+                await asyncio.to_thread(writer.consume, rows)
+            await asyncio.to_thread(writer.close)
+        except BaseException:
+            writer.abort()
+            raise
+
+    # 4. Partitions left without rows (deleted / moved recaudaciones)
+    written = writer.written if writer else set()
+    removed = dirty - written
+    for partition in removed:
+        _remove_partition(root, partition)
+
+    manifest = {
+        "created_at": datetime.now().isoformat(),
+        "mode": "incremental" if previous is not None else "full",
+        "recaudaciones": {str(k): v for k, v in current.items()},
+    }
+    _write_manifest(root, manifest)
+
+    return {
+        "mode": manifest["mode"],
+        "path": root,
+        "partitions_written": len(written),
+        "partitions_removed": len(removed),
+        "rows": writer.rows if writer else 0,
+        "seconds": round((datetime.now() - started).total_seconds(), 2),
+    }
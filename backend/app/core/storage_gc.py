@@ -0,0 +1,209 @@
+import asyncio
+import os
+import shutil
+import time
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterator, List, Tuple
+
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.file_storage import blob_store
+from app.models.recaudacion import Recaudacion, RecaudacionFichero, FicheroBlob
+from app.models.salon import Salon
+
+# Storage maintenance for UPLOAD_DIR: finds files no recaudacion_fichero / fichero_blob
+# row points to (orphans), ficheros whose file is gone (missing), and reports usage.
+# The tree is walked with os.scandir and reconciled against the DB in batches, so
+# neither side is ever loaded whole. Used by storage_maintenance.py.
+
+LEGACY_DIR = os.path.join(settings.UPLOAD_DIR, "recaudaciones") # Files stored before the blob store
+QUARANTINE_DIR = os.path.join(settings.UPLOAD_DIR, "quarantine")
+BATCH_SIZE = 1000
+MIN_AGE = 3600 # Younger files are never orphans: upload in progress or row not committed yet
+
+FileEntry = Tuple[str, int, float] # (path, size, mtime)
+
+
+def legacy_dir(recaudacion_id: int) -> str:
+    return os.path.join(LEGACY_DIR, str(recaudacion_id))
+
+
+def scan_files(root: str) -> Iterator[FileEntry]:
+    # Iterative walk (no recursion limit, one directory handle open at a time)
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    yield entry.path, st.st_size, st.st_mtime
+
+
+async def _scan_batches(root: str) -> AsyncIterator[List[FileEntry]]:
+    # The walk itself runs in a thread, one batch at a time; recent files are skipped
+    files = scan_files(root)
+    cutoff = time.time() - MIN_AGE
+    while True:
+        batch = await asyncio.to_thread(lambda: list(islice(files, BATCH_SIZE)))
+        if not batch:
+            return
+        yield [entry for entry in batch if entry[2] < cutoff]
+
+
+async def _legacy_orphans(db: AsyncSession, batch: List[FileEntry]) -> List[FileEntry]:
+    if not batch:
+        return []
+    stmt = select(RecaudacionFichero.file_path).where(RecaudacionFichero.file_path.in_([p for p, _, _ in batch]))
+    known = set((await db.execute(stmt)).scalars().all())
+    return [e for e in batch if e[0] not in known]
+
+
+async def _blob_orphans(db: AsyncSession, batch: List[FileEntry]) -> List[FileEntry]:
+    # Leftover staging files are always orphans. Stored blobs only when they have no row
+    # at all: rows at ref_count 0 are removed by blob_store.collect() under the row lock.
+    staging_dir = os.path.dirname(blob_store.staging_path())
+    orphans = [e for e in batch if os.path.dirname(e[0]) == staging_dir]
+    stored = [e for e in batch if os.path.dirname(e[0]) != staging_dir]
+    if not stored:
+        return orphans
+
+    hashes = [os.path.basename(p) for p, _, _ in stored]
+    stmt = select(FicheroBlob.content_hash).where(FicheroBlob.content_hash.in_(hashes))
+    known = set((await db.execute(stmt)).scalars().all())
+    orphans.extend(e for e in stored if os.path.basename(e[0]) not in known)
+    return orphans
+
+
+def _dispose(entries: List[FileEntry], mode: str, quarantine_dir: str):
+    # Blocking: delete or move orphans (keeping their path relative to UPLOAD_DIR)
+    for path, _, _ in entries:
+        try:
+            if mode == "delete":
+                os.remove(path)
+            else:
+                dest = os.path.join(quarantine_dir, os.path.relpath(path, settings.UPLOAD_DIR))
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.move(path, dest)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_empty_dirs(root: str):
+    # Bottom-up: per-recaudacion / blob fan-out directories left empty
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        if dirpath != root and not dirnames and not filenames:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+
+
+def _stat_sizes(paths: List[str]) -> List[Any]:
+    sizes = []
+    for path in paths:
+        try:
+            sizes.append(os.stat(path).st_size)
+        except FileNotFoundError:
+            sizes.append(None)
+    return sizes
+
+
+def _disk_usage(root: str) -> Dict[str, int]:
+    # Bytes per top-level area of UPLOAD_DIR (blobs, recaudaciones, export_cache, ...)
+    usage = {}
+    if not os.path.isdir(root):
+        return usage
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                usage[entry.name] = sum(size for _, size, _ in scan_files(entry.path))
+            elif entry.is_file(follow_symlinks=False):
+                usage["."] = usage.get(".", 0) + entry.stat().st_size
+    return usage
+
+
+async def storage_report(db: AsyncSession) -> Dict[str, Any]:
+    """
+    Bytes referenced by ficheros per salon and per year (of the recaudacion's fecha_fin),
+    ficheros whose file is missing, and bytes on disk per area of UPLOAD_DIR.
+    Shared blobs count once per fichero in the per-salon/year figures.
+    """
+    stmt = select(
+        RecaudacionFichero.file_path, Recaudacion.salon_id, Salon.nombre, Recaudacion.fecha_fin
+    ).join(Recaudacion, RecaudacionFichero.recaudacion_id == Recaudacion.id)\
+     .outerjoin(Salon, Recaudacion.salon_id == Salon.id)
+
+    by_salon = defaultdict(lambda: {"salon": None, "files": 0, "bytes": 0})
+    by_year = defaultdict(lambda: {"files": 0, "bytes": 0})
+    missing = 0
+    missing_sample = []
+
+    result = await db.stream(stmt.execution_options(yield_per=BATCH_SIZE))
+    async for rows in result.partitions():
+        sizes = await asyncio.to_thread(_stat_sizes, [row.file_path for row in rows])
+        for row, size in zip(rows, sizes):
+            if size is None:
+                missing += 1
+                if len(missing_sample) < 20:
+                    missing_sample.append(row.file_path)
+                continue
+            salon = by_salon[row.salon_id]
+            salon["salon"] = row.nombre
+            year = by_year[row.fecha_fin.year]
+            for acc in (salon, year):
+                acc["files"] += 1
+                acc["bytes"] += size
+
+    return {
+        "by_salon": [{"salon_id": k, **v} for k, v in sorted(by_salon.items())],
+        "by_year": [{"year": k, **v} for k, v in sorted(by_year.items())],
+        "missing_files": missing,
+        "missing_sample": missing_sample,
+        "disk_bytes": await asyncio.to_thread(_disk_usage, settings.UPLOAD_DIR),
+    }
+
+
+async def collect_orphans(db: AsyncSession, mode: str = "report") -> Dict[str, Any]:
+    """
+    Reconcile the blob store and the legacy per-recaudacion tree with the DB.
+    mode: "report" (dry run), "quarantine" (move under QUARANTINE_DIR/<timestamp>) or "delete".
+    Unreferenced fichero_blob rows are collected as well unless in report mode.
+    """
+    if mode not in ("report", "quarantine", "delete"):
+        raise ValueError(f"Unknown mode: {mode}")
+    quarantine_dir = os.path.join(QUARANTINE_DIR, datetime.now().strftime("%Y%m%d_%H%M%S"))
+
+    summary = {"mode": mode, "scanned_files": 0, "orphan_files": 0, "orphan_bytes": 0, "orphan_sample": [], "collected_blobs": 0}
+
+    # 1. Blob rows nobody references (their files go with them)
+    if mode != "report":
+        summary["collected_blobs"] = len(await blob_store.collect(db))
+
+    # 2. Files on disk without a row
+    for root, find_orphans in ((blob_store.root, _blob_orphans), (LEGACY_DIR, _legacy_orphans)):
+        async for batch in _scan_batches(root):
+            summary["scanned_files"] += len(batch)
+            orphans = await find_orphans(db, batch)
+            if not orphans:
+                continue
+            summary["orphan_files"] += len(orphans)
+            summary["orphan_bytes"] += sum(size for _, size, _ in orphans)
+            summary["orphan_sample"].extend(p for p, _, _ in orphans[:20 - len(summary["orphan_sample"])])
+            if mode != "report":
+                await asyncio.to_thread(_dispose, orphans, mode, quarantine_dir)
+        if mode != "report":
+            await asyncio.to_thread(_remove_empty_dirs, root)
+
+    if mode == "quarantine" and summary["orphan_files"]:
+        summary["quarantine_dir"] = quarantine_dir
+    return summary
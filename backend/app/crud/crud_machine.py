@@ -2,6 +2,7 @@ from typing import List, Optional, Union, Dict, Any
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.salon_scope import SalonScope
 from app.models.machine import Maquina, Puesto, TipoMaquina, GrupoMaquina
 from app.schemas.machine import (
     MaquinaCreate, MaquinaUpdate,
@@ -118,11 +119,14 @@ class CRUDMaquina:
         return result.scalars().first()
 
     async def get_multi(
-        self, db: AsyncSession, skip: int = 0, limit: int = 100, salon_id: Optional[int] = None
+        self, db: AsyncSession, skip: int = 0, limit: int = 100, salon_id: Optional[int] = None,
+        scope: Optional[SalonScope] = None
     ) -> List[Maquina]:
         query = select(Maquina).options(selectinload(Maquina.puestos)).where(Maquina.eliminada == False)
         if salon_id:
             query = query.where(Maquina.salon_id == salon_id)
+        if scope is not None:
+            query = scope.apply(query, Maquina.salon_id)
         
         result = await db.execute(query.offset(skip).limit(limit))
         return result.scalars().all()
@@ -1,9 +1,14 @@
 from typing import List, Optional
+from datetime import date, datetime
+from sqlalchemy import func
 from sqlalchemy.future import select
 from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models.recaudacion import Recaudacion, RecaudacionMaquina
-from app.models.machine import Maquina, Puesto
+from app.models.recaudacion import Recaudacion, RecaudacionMaquina, RecaudacionImportacion
+from app.core.salon_scope import SalonScope
+from app.core.excel_import import IMPORT_FIELDS, rows_by_name, diff_import_rows
+from app.models.machine import Maquina, Puesto, MaquinaExcelMap
+from app.models.salon import Salon
 from app.schemas.recaudacion import (
     RecaudacionCreate, RecaudacionUpdate,
     RecaudacionMaquinaCreate, RecaudacionMaquinaUpdate
@@ -32,7 +37,8 @@ class CRUDRecaudacion:
         return result.scalars().first()
 
     async def get_multi(
-        self, db: AsyncSession, skip: int = 0, limit: int = 100, salon_id: Optional[int] = None
+        self, db: AsyncSession, skip: int = 0, limit: int = 100, salon_id: Optional[int] = None,
+        scope: Optional[SalonScope] = None
     ) -> List[Recaudacion]:
         query = select(Recaudacion).options(
             joinedload(Recaudacion.detalles),
@@ -40,6 +46,8 @@ class CRUDRecaudacion:
         )
         if salon_id:
             query = query.where(Recaudacion.salon_id == salon_id)
+        if scope is not None:
+            query = scope.apply(query, Recaudacion.salon_id)
         # Order by start date descending usually
         query = query.order_by(Recaudacion.fecha_fin.desc()).offset(skip).limit(limit)
         result = await db.execute(query)
@@ -166,6 +174,234 @@ class CRUDRecaudacion:
             await db.commit()
         return obj
 
+    async def _match_import_rows(
+        self, db: AsyncSession, *, rec: Recaudacion, parsed: dict, mapping_overrides: Optional[dict] = None
+    ):
+        """
+        Load one snapshot of mappings + details and match the parsed rows against it.
+        mapping_overrides: {excel_name: (puesto_id, is_ignored)} applied in memory only.
+        Returns (details, [(detail, row)], unmatched_names).
+        """
+        # Fetch Mappings
+        stmt_map = select(MaquinaExcelMap).where(MaquinaExcelMap.salon_id == rec.salon_id)
+        name_map = {m.excel_nombre.upper(): (m.puesto_id, m.maquina_id, m.is_ignored) for m in (await db.execute(stmt_map)).scalars().all()}
+        for name, (puesto_id, is_ignored) in (mapping_overrides or {}).items():
+            name_map[name] = (puesto_id, None, is_ignored)
+
+        # Fetch Details for this Recaudacion to update them
+        stmt_details = select(RecaudacionMaquina).options(
+            joinedload(RecaudacionMaquina.maquina),
+            joinedload(RecaudacionMaquina.puesto)
+        ).where(RecaudacionMaquina.recaudacion_id == rec.id)
+        current_details = (await db.execute(stmt_details)).scalars().all()
+
+        details_by_puesto = {d.puesto_id: d for d in current_details if d.puesto_id}
+        details_by_maquina = {d.maquina_id: d for d in current_details if d.maquina_id}
+        # Fallback map for normalized imports (Direct Name Match), compatible with Export Logic
+        details_by_name = {}
+        for d in current_details:
+            if d.maquina and d.maquina.nombre:
+                key_name = d.maquina.nombre.strip()
+                if d.puesto:
+                    p_desc = d.puesto.descripcion
+                    p_numero = d.puesto.numero_puesto
+                    puesto_str = f" - {p_desc}" if p_desc else (f" - PUESTO {p_numero}" if p_numero else "")
+                    key_name = f"{key_name}{puesto_str}"
+                details_by_name[key_name.upper()] = d
+
+        is_normalized = parsed["is_normalized"]
+        matches = []
+        unmatched = []
+
+        for row in parsed["rows"]:
+            clean_name = row["name"]
+            detail = None
+
+            if clean_name in name_map:
+                puesto_id, maquina_id, is_ignored = name_map[clean_name]
+                if puesto_id:
+                    detail = details_by_puesto.get(puesto_id)
+                elif maquina_id:
+                    detail = details_by_maquina.get(maquina_id)
+                if is_ignored:
+                    continue
+            elif is_normalized:
+                # Normalized files use system names, even if not yet mapped in MaquinaExcelMap
+                detail = details_by_name.get(clean_name)
+                if not detail:
+                    # Normalized export might include Puesto suffix "Name - P1"
+                    for k, d in details_by_name.items():
+                        if k in clean_name or clean_name in k:
+                            detail = d
+                            break
+
+            if detail:
+                matches.append((detail, row))
+            elif is_normalized or row["retirada_efectivo"] or row["cajon"] or row["pago_manual"]:
+                # Legacy sheets have labels in the name column too; only rows with amounts count
+                unmatched.append(clean_name)
+
+        return current_details, matches, unmatched
+
+    async def apply_import(self, db: AsyncSession, *, rec: Recaudacion, parsed: dict) -> dict:
+        """
+        Apply a parsed workbook (see app.core.excel_import) to the recaudacion details.
+        All changes plus the tasa_diferencia recalculation are committed in one transaction.
+        """
+        _, matches, unmatched = await self._match_import_rows(db, rec=rec, parsed=parsed)
+
+        for detail, row in matches:
+            detail.retirada_efectivo = row["retirada_efectivo"]
+            detail.cajon = row["cajon"]
+            detail.pago_manual = row["pago_manual"]
+            if row.get("ajuste") is not None:
+                detail.ajuste = row["ajuste"]
+            db.add(detail)
+
+        for field, value in parsed["totals"].items():
+            setattr(rec, field, value)
+        db.add(rec)
+
+        # Recalculate Tasa Diferencia (commits the whole import)
+        await recalculate_tasa_diferencia(db, rec.id)
+        await db.commit()
+
+        return {"updated": len(matches), "unmatched": unmatched}
+
+    async def preview_import(
+        self, db: AsyncSession, *, rec: Recaudacion, parsed: dict, mapping_overrides: Optional[dict] = None
+    ) -> dict:
+        """
+        Dry run of apply_import: proposed detail changes, unmatched names, totals and the
+        resulting tasa_diferencia distribution, computed in memory. Nothing is written.
+        """
+        details, matches, unmatched = await self._match_import_rows(
+            db, rec=rec, parsed=parsed, mapping_overrides=mapping_overrides
+        )
+
+        old = {d.id: {f: float(getattr(d, f) or 0) for f in IMPORT_FIELDS} for d in details}
+        new = {d_id: dict(values) for d_id, values in old.items()}
+        excel_names = {}
+        for detail, row in matches:
+            for f in IMPORT_FIELDS:
+                if row.get(f) is not None:
+                    new[detail.id][f] = float(row[f])
+            excel_names[detail.id] = row["name"]
+
+        totals_old = {
+            "total_tasas": float(rec.total_tasas or 0),
+            "depositos": float(rec.depositos or 0),
+            "otros_conceptos": float(rec.otros_conceptos or 0),
+        }
+        totals_new = {**totals_old, **{k: float(v or 0) for k, v in parsed["totals"].items()}}
+
+        estimadas = [float(d.tasa_estimada or 0) for d in details]
+        diferencias = distribute_tasa_diferencia(totals_new["total_tasas"], estimadas)
+
+        def bruto(v):
+            return v["retirada_efectivo"] + v["cajon"] - v["pago_manual"] + v["ajuste"]
+
+        details_result = []
+        for d, tasa_estimada, tasa_diferencia in zip(details, estimadas, diferencias):
+            maquina = d.maquina.nombre if d.maquina else None
+            if d.puesto:
+                maquina = f"{maquina} - {d.puesto.descripcion or f'PUESTO {d.puesto.numero_puesto}'}"
+            details_result.append({
+                "detail_id": d.id,
+                "maquina": maquina,
+                "excel_name": excel_names.get(d.id),
+                "old": old[d.id],
+                "new": new[d.id],
+                "changed": old[d.id] != new[d.id],
+                "tasa_estimada": tasa_estimada,
+                "tasa_diferencia_old": float(d.tasa_diferencia or 0),
+                "tasa_diferencia_new": tasa_diferencia,
+                "tasa_final_new": tasa_estimada + tasa_diferencia + new[d.id]["ajuste"],
+            })
+
+        def total_global(t, total_bruto):
+            # Same as Recaudacion.total_global
+            return total_bruto - t["total_tasas"] + t["depositos"] + t["otros_conceptos"]
+
+        total_bruto_old = sum(bruto(v) for v in old.values())
+        total_bruto_new = sum(bruto(v) for v in new.values())
+        return {
+            "is_normalized": parsed["is_normalized"],
+            "matched": len(matches),
+            "changed": sum(1 for r in details_result if r["changed"]),
+            "unmatched": unmatched,
+            "details": details_result,
+            "totals": {
+                "old": {**totals_old, "total_bruto": total_bruto_old, "total_global": total_global(totals_old, total_bruto_old)},
+                "new": {**totals_new, "total_bruto": total_bruto_new, "total_global": total_global(totals_new, total_bruto_new)},
+            },
+            "tasa_diferencia_total": totals_new["total_tasas"] - sum(estimadas),
+        }
+
+    async def get_current_import(
+        self, db: AsyncSession, *, recaudacion_id: int, content_hash: str
+    ) -> Optional[RecaudacionImportacion]:
+        """
+        The latest import of the recaudacion, if it has this content hash and the recaudacion
+        has not changed since it was applied (manual edits, other imports bump its version).
+        """
+        result = await db.execute(
+            select(RecaudacionImportacion, Recaudacion.version)
+            .join(Recaudacion, Recaudacion.id == RecaudacionImportacion.recaudacion_id)
+            .where(RecaudacionImportacion.recaudacion_id == recaudacion_id)
+            .order_by(RecaudacionImportacion.id.desc())
+            .limit(1)
+        )
+        row = result.first()
+        if not row:
+            return None
+        latest, version = row
+        if latest.content_hash != content_hash or latest.recaudacion_version != version:
+            return None
+        return latest
+
+    async def record_import(
+        self,
+        db: AsyncSession,
+        *,
+        recaudacion_id: int,
+        fichero_id: Optional[int],
+        content_hash: str,
+        parsed: dict,
+        result: dict
+    ) -> RecaudacionImportacion:
+        """
+        Store an applied import. result gets a row-level "diff" against the previous import.
+        """
+        prev = (await db.execute(
+            select(RecaudacionImportacion)
+            .where(RecaudacionImportacion.recaudacion_id == recaudacion_id)
+            .order_by(RecaudacionImportacion.id.desc())
+            .limit(1)
+        )).scalars().first()
+
+        rows = rows_by_name(parsed)
+        result["diff"] = diff_import_rows(prev.rows or {}, rows) if prev else None
+
+        # Version after apply_import's commit (bumped on flush, the loaded attribute is stale)
+        version = (await db.execute(
+            select(Recaudacion.version).where(Recaudacion.id == recaudacion_id)
+        )).scalar_one()
+
+        db_obj = RecaudacionImportacion(
+            recaudacion_id=recaudacion_id,
+            fichero_id=fichero_id,
+            content_hash=content_hash,
+            recaudacion_version=version,
+            is_normalized=parsed["is_normalized"],
+            rows=rows,
+            result=result,
+            created_at=datetime.now()
+        )
+        db.add(db_obj)
+        await db.commit()
+        return db_obj
+
 class CRUDRecaudacionMaquina:
     async def get(self, db: AsyncSession, id: int) -> Optional[RecaudacionMaquina]:
         result = await db.execute(select(RecaudacionMaquina).where(RecaudacionMaquina.id == id))
@@ -213,5 +449,131 @@ class CRUDRecaudacionMaquina:
             await db.commit()
         return obj
 
+async def recalculate_estimated_taxes(db: AsyncSession, recaudacion_id: int):
+    # Fetch Recaudacion with details and machine info
+    stmt = select(Recaudacion).options(
+        selectinload(Recaudacion.detalles).options(
+            selectinload(RecaudacionMaquina.maquina).selectinload(Maquina.tipo_maquina),
+            selectinload(RecaudacionMaquina.puesto)
+        )
+    ).where(Recaudacion.id == recaudacion_id)
+    rec = (await db.execute(stmt)).scalars().first()
+    
+    if not rec or not rec.detalles:
+        return
+
+    # Calculate Days
+    if not rec.fecha_inicio or not rec.fecha_fin:
+        return
+        
+    days_diff = (rec.fecha_fin - rec.fecha_inicio).days
+    if days_diff < 0: days_diff = 0
+    
+    for d in rec.detalles:
+        # Re-evaluate weekly rate logic (Duplicate from CRUD, ideally refactor to helper)
+        tasa_base = 0
+        
+        # Determine Weekly Rate
+        weekly_rate = 0
+        if d.puesto and d.puesto.tasa_semanal:
+            weekly_rate = d.puesto.tasa_semanal
+        elif d.maquina:
+             if d.maquina.tasa_semanal_override:
+                 weekly_rate = d.maquina.tasa_semanal_override
+             elif d.maquina.tipo_maquina and d.maquina.tipo_maquina.tasa_semanal_orientativa:
+                 weekly_rate = d.maquina.tipo_maquina.tasa_semanal_orientativa
+        
+        # Calculate
+        if float(weekly_rate) > 0 and days_diff > 0:
+             daily_rate = float(weekly_rate) / 7.0
+             tasa_base = daily_rate * days_diff
+        
+        d.tasa_estimada = tasa_base
+        # tasa_final will be updated by recalculate_tasa_diferencia next
+        db.add(d)
+        
+    await db.commit()
+
+async def recalculate_tasa_diferencia(db: AsyncSession, recaudacion_id: int):
+    # 1. Get Recaudacion + Details
+    # Need to load details to iterate
+    stmt = select(Recaudacion).options(selectinload(Recaudacion.detalles)).where(Recaudacion.id == recaudacion_id)
+    rec = (await db.execute(stmt)).scalars().first()
+    if not rec or not rec.detalles:
+        return
+
+    # 2. Distribute the difference between real and estimated taxes
+    diferencias = distribute_tasa_diferencia(
+        float(rec.total_tasas or 0),
+        [float(d.tasa_estimada or 0) for d in rec.detalles]
+    )
+    
+    for d, tasa_diferencia in zip(rec.detalles, diferencias):
+        d.tasa_diferencia = tasa_diferencia
+        # Update Final
+        # Tasa Final = Calculada + Diferencia + Ajuste
+        d.tasa_final = float(d.tasa_estimada or 0) + float(d.tasa_diferencia or 0) + float(d.ajuste or 0)
+        
+        db.add(d)
+        
+    await db.commit()
+
+def distribute_tasa_diferencia(total_real: float, tasas_estimadas: List[float]) -> List[float]:
+    # Split (real - estimated) proportionally to each estimated tax.
+    # If total_calculada is 0 we can't weight it: difference stays 0.
+    total_calculada = sum(tasas_estimadas)
+    if total_calculada == 0:
+        return [0 for _ in tasas_estimadas]
+    diff = total_real - total_calculada
+    return [round(diff * (t_calc / total_calculada), 4) for t_calc in tasas_estimadas]
+
+def recaudacion_facts_query(
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    salon_ids: Optional[List[int]] = None,
+    scope: Optional[SalonScope] = None
+):
+    """
+    Flat RecaudacionMaquina facts joined with recaudacion dates, salon, maquina and puesto
+    (BI exports). Filters apply to the recaudacion fecha_fin date; scope limits the
+    salons on top of salon_ids.
+    """
+    stmt = select(
+        Recaudacion.id.label("recaudacion_id"),
+        Recaudacion.salon_id,
+        Salon.nombre.label("salon_nombre"),
+        Recaudacion.fecha_inicio,
+        Recaudacion.fecha_fin,
+        Recaudacion.fecha_cierre,
+        RecaudacionMaquina.id.label("detalle_id"),
+        RecaudacionMaquina.maquina_id,
+        Maquina.nombre.label("maquina_nombre"),
+        Maquina.numero_serie,
+        RecaudacionMaquina.puesto_id,
+        Puesto.numero_puesto,
+        Puesto.descripcion.label("puesto_descripcion"),
+        RecaudacionMaquina.retirada_efectivo,
+        RecaudacionMaquina.cajon,
+        RecaudacionMaquina.pago_manual,
+        RecaudacionMaquina.ajuste,
+        RecaudacionMaquina.tasa_estimada,
+        RecaudacionMaquina.tasa_diferencia,
+        RecaudacionMaquina.tasa_final,
+    ).select_from(RecaudacionMaquina)\
+     .join(Recaudacion, RecaudacionMaquina.recaudacion_id == Recaudacion.id)\
+     .join(Salon, Recaudacion.salon_id == Salon.id)\
+     .outerjoin(Maquina, RecaudacionMaquina.maquina_id == Maquina.id)\
+     .outerjoin(Puesto, RecaudacionMaquina.puesto_id == Puesto.id)
+
+    if fecha_desde:
+        stmt = stmt.where(func.date(Recaudacion.fecha_fin) >= fecha_desde)
+    if fecha_hasta:
+        stmt = stmt.where(func.date(Recaudacion.fecha_fin) <= fecha_hasta)
+    if salon_ids:
+        stmt = stmt.where(Recaudacion.salon_id.in_(salon_ids))
+    if scope is not None:
+        stmt = scope.apply(stmt, Recaudacion.salon_id)
+    return stmt.order_by(Recaudacion.fecha_fin, Recaudacion.id, RecaudacionMaquina.id)
+
 recaudacion = CRUDRecaudacion()
 recaudacion_maquina = CRUDRecaudacionMaquina()
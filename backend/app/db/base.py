@@ -2,4 +2,4 @@ from app.db.base_class import Base
 from app.models.salon import Salon
 from app.models.user import Usuario, Rol, Permiso, UsuarioSalon, UsuarioMaquina
 from app.models.machine import TipoMaquina, Maquina, Puesto, GrupoMaquina
-from app.models.recaudacion import Recaudacion, RecaudacionMaquina, TipoConceptoExtra, RecaudacionConceptoExtra
+from app.models.recaudacion import Recaudacion, RecaudacionMaquina, TipoConceptoExtra, RecaudacionConceptoExtra, RecaudacionFichero, FicheroBlob, RecaudacionImportJob, RecaudacionImportacion, RecaudacionExportJob
@@ -1,13 +1,121 @@
+import time
+from typing import Any, Dict
+
+from sqlalchemy import exc
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.core.config import settings
 
-engine = create_async_engine(settings.async_database_url, echo=True, future=True)
+# Engine defaults per DB_PROFILE (explicit DB_* settings win).
+# Per API worker: pool_size + max_overflow connections at most, so size the workers
+# against Postgres max_connections (pool_stats() shows how many are actually used).
+ENGINE_PROFILES = {
+    "dev": {"echo": True, "pool_size": 5, "max_overflow": 5, "statement_timeout_ms": 0, "query_audit": True},
+    "prod": {"echo": False, "pool_size": 10, "max_overflow": 20, "statement_timeout_ms": 60000, "query_audit": False},
+}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that measures how long checkouts take (waiting for a free connection or
+    opening an overflow one) and counts checkout timeouts.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+def engine_options(url: str, read_only: bool = False) -> Dict[str, Any]:
+    profile = ENGINE_PROFILES[settings.DB_PROFILE]
+
+    def pick(name: str, setting):
+        return profile[name] if setting is None else setting
+
+    options = {
+        "echo": pick("echo", settings.DB_ECHO),
+        "future": True,
+        "poolclass": TimedQueuePool,
+        "pool_size": pick("pool_size", settings.DB_POOL_SIZE),
+        "max_overflow": pick("max_overflow", settings.DB_MAX_OVERFLOW),
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    if url.startswith("postgresql+asyncpg"):
+        statement_timeout = pick("statement_timeout_ms", settings.DB_STATEMENT_TIMEOUT_MS)
+        options["connect_args"] = {
+            # SQLAlchemy's prepared statement LRU and asyncpg's own cache
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {
+                "application_name": settings.DB_APPLICATION_NAME,
+                "statement_timeout": str(statement_timeout),
+            },
+        }
+        if read_only:
+            # Writes through the read engine fail, even when it points at the primary
+            options["connect_args"]["server_settings"]["default_transaction_read_only"] = "on"
+    return options
+
+
+engine = create_async_engine(settings.async_database_url, **engine_options(settings.async_database_url))
 
 AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
 
+# Read-only traffic (deps.get_read_db). Without READ_DATABASE_URL it shares the primary engine;
+# it can be pointed at the primary's own DSN to try the routing locally.
+if settings.READ_DATABASE_URL:
+    read_engine = create_async_engine(settings.READ_DATABASE_URL, **engine_options(settings.READ_DATABASE_URL, read_only=True))
+else:
+    read_engine = engine
+
+ReadSessionLocal = sessionmaker(
+    read_engine, class_=AsyncSession, expire_on_commit=False
+)
+
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
+
+
+def pool_stats(engine=engine) -> Dict[str, Any]:
+    """
+    Connection pool usage of this API worker (primary engine unless given).
+    """
+    pool = engine.pool
+    stats = {
+        "profile": settings.DB_PROFILE,
+        "pool_size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            "checkouts": pool.checkouts,
+            "timeouts": pool.timeouts,
+            "wait_seconds_total": round(pool.wait_seconds, 6),
+            "wait_seconds_max": round(pool.max_wait_seconds, 6),
+        })
+    return stats
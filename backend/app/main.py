@@ -1,12 +1,34 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from starlette.middleware.cors import CORSMiddleware
 
 from app.api.v1.api import api_router
 from app.core.config import settings
+from app.core.import_jobs import import_queue
+from app.core.export_jobs import export_queue
+from app.core.process_pool import export_pool
+from app.core import metrics, query_audit
+from app.core.slow_queries import slow_query_log, SlowQueryMiddleware
+from app.db.session import engine, read_engine
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background workers (Excel import and bulk export queues)
+    await import_queue.start()
+    await export_queue.start()
+    if slow_query_log.enabled:
+        slow_query_log.start()
+    yield
+    await export_queue.stop()
+    await import_queue.stop()
+    export_pool.shutdown()
+    await slow_query_log.stop()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan
 )
 
 # Set all CORS enabled origins
@@ -17,7 +39,7 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
-        expose_headers=["Content-Disposition"],
+        expose_headers=["Content-Disposition", "X-Token-Renew"],
     )
 else:
      # Allow all for development simplicity if not configured
@@ -27,11 +49,36 @@ else:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
-        expose_headers=["Content-Disposition"],
+        expose_headers=["Content-Disposition", "X-Token-Renew"],
     )
 
+# Development: warn about requests repeating the same statement (N+1)
+if query_audit.audit_enabled():
+    query_audit.install()
+    app.add_middleware(query_audit.QueryAuditMiddleware)
+
+if slow_query_log.enabled:
+    slow_query_log.install(engine, "primary")
+    if read_engine is not engine:
+        slow_query_log.install(read_engine, "read")
+    app.add_middleware(SlowQueryMiddleware)
+
+# Added last so it is the outermost middleware: times the whole request, the audit
+# / slow-query middlewares and CORS included
+if settings.METRICS_ENABLED:
+    metrics.instrument_engine(engine, "primary")
+    if read_engine is not engine:
+        metrics.instrument_engine(read_engine, "read")
+    app.add_middleware(metrics.MetricsMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def read_metrics():
+        # Prometheus scrape endpoint (this worker's series)
+        return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def root():
     return {"message": "Welcome to Casino Management System API"}
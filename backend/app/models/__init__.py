@@ -1,4 +1,4 @@
 from .user import Usuario, Rol, Permiso, UsuarioSalon, UsuarioMaquina
 from .salon import Salon
 from .machine import Maquina, TipoMaquina
-from .recaudacion import Recaudacion, RecaudacionMaquina, RecaudacionFichero
+from .recaudacion import Recaudacion, RecaudacionMaquina, RecaudacionFichero, FicheroBlob, RecaudacionImportJob, RecaudacionImportacion, RecaudacionExportJob
@@ -1,6 +1,12 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Numeric, UniqueConstraint, DateTime, Boolean
-from sqlalchemy.orm import relationship
+from collections import Counter
+from datetime import datetime
+from itertools import chain
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, Numeric, UniqueConstraint, DateTime, Boolean, JSON, BigInteger, event, inspect, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import relationship, Session
 from app.db.base_class import Base
+from app.models.machine import Maquina, Puesto
+from app.models.salon import Salon
 
 class Recaudacion(Base):
     __tablename__ = "recaudacion"
@@ -21,9 +27,16 @@ class Recaudacion(Base):
     otros_conceptos = Column(Numeric(12, 2), default=0)
     porcentaje_salon = Column(Numeric(5, 2), default=50.00)
 
+    # Content version, bumped on any header/detail write and when a salon, machine or
+    # puesto it shows is renamed (see _bump_recaudacion_version).
+    # Keys the export cache and incremental snapshots.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
     salon = relationship("Salon", back_populates="recaudaciones")
     detalles = relationship("RecaudacionMaquina", back_populates="recaudacion", cascade="all, delete-orphan")
     ficheros = relationship("RecaudacionFichero", back_populates="recaudacion", cascade="all, delete-orphan")
+    import_jobs = relationship("RecaudacionImportJob", back_populates="recaudacion", cascade="all, delete-orphan")
+    importaciones = relationship("RecaudacionImportacion", back_populates="recaudacion", cascade="all, delete-orphan")
 
     @property
     def total_bruto(self):
@@ -98,6 +111,171 @@ class RecaudacionFichero(Base):
     file_path = Column(String, nullable=False)
     filename = Column(String, nullable=False)
     content_type = Column(String)
+    content_hash = Column(String(64), nullable=True, index=True) # SHA-256 of the file content
+    file_size = Column(BigInteger, nullable=True) # Bytes
+    # Stored in the content-addressed blob store (app.core.file_storage); NULL for files
+    # uploaded before it, which live in their own path
+    blob_hash = Column(String(64), ForeignKey("fichero_blob.content_hash"), nullable=True, index=True)
     created_at = Column(DateTime)
     
     recaudacion = relationship("Recaudacion", back_populates="ficheros")
+
+class FicheroBlob(Base):
+    # One file on disk per distinct content, shared by every RecaudacionFichero with that hash.
+    # ref_count is kept in step with the referencing rows by the session events below.
+    __tablename__ = "fichero_blob"
+    content_hash = Column(String(64), primary_key=True) # SHA-256, also the path in the store
+    file_size = Column(BigInteger, nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime)
+
+class RecaudacionImportJob(Base):
+    __tablename__ = "recaudacion_import_job"
+    id = Column(Integer, primary_key=True, index=True)
+    recaudacion_id = Column(Integer, ForeignKey("recaudacion.id"), nullable=False, index=True)
+    fichero_id = Column(Integer, ForeignKey("recaudacion_fichero.id", ondelete="SET NULL"), nullable=True)
+    usuario_id = Column(Integer, ForeignKey("usuario.id", ondelete="SET NULL"), nullable=True)
+
+    status = Column(String, nullable=False, default="pending", index=True) # pending, running, done, error
+    progress = Column(Integer, default=0) # 0-100
+    total_rows = Column(Integer, default=0)
+    updated_rows = Column(Integer, default=0)
+    result = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+
+    created_at = Column(DateTime)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    worker_id = Column(String, nullable=True) # Process running it (see app.core.import_jobs)
+    heartbeat_at = Column(DateTime, nullable=True)
+
+    recaudacion = relationship("Recaudacion", back_populates="import_jobs")
+
+class RecaudacionImportacion(Base):
+    # One row per applied Excel import. Re-importing the content of the latest one is a no-op
+    # while the recaudacion is unchanged since (same version)
+    __tablename__ = "recaudacion_importacion"
+    id = Column(Integer, primary_key=True, index=True)
+    recaudacion_id = Column(Integer, ForeignKey("recaudacion.id"), nullable=False, index=True)
+    fichero_id = Column(Integer, ForeignKey("recaudacion_fichero.id", ondelete="SET NULL"), nullable=True)
+    content_hash = Column(String(64), nullable=False, index=True)
+    recaudacion_version = Column(Integer, nullable=True) # Recaudacion.version once applied
+    is_normalized = Column(Boolean, default=False)
+    rows = Column(JSON, nullable=True) # {name: {retirada_efectivo, cajon, pago_manual, ajuste}}
+    result = Column(JSON, nullable=True)
+    created_at = Column(DateTime)
+
+    recaudacion = relationship("Recaudacion", back_populates="importaciones")
+
+
+class RecaudacionExportJob(Base):
+    # Background export (see app.core.export_jobs); the artifact is kept until expires_at
+    __tablename__ = "recaudacion_export_job"
+    id = Column(Integer, primary_key=True, index=True)
+    usuario_id = Column(Integer, ForeignKey("usuario.id", ondelete="SET NULL"), nullable=True, index=True)
+
+    kind = Column(String, nullable=False) # xlsx, csv, ndjson
+    params = Column(JSON, nullable=True) # salon_ids, fecha_desde, fecha_hasta
+    status = Column(String, nullable=False, default="pending", index=True) # pending, running, done, error, expired
+    progress = Column(Integer, default=0) # 0-100
+    error = Column(String, nullable=True)
+
+    file_path = Column(String, nullable=True)
+    filename = Column(String, nullable=True)
+    content_type = Column(String, nullable=True)
+    file_size = Column(BigInteger, nullable=True)
+
+    created_at = Column(DateTime)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
+    worker_id = Column(String, nullable=True) # Process running it
+    heartbeat_at = Column(DateTime, nullable=True)
+
+# --- Content Version ---
+# Collected before the flush (what changed), applied after it as a single atomic
+# `version = version + 1` UPDATE so concurrent writers never lose a bump.
+# The in-memory attribute is left as loaded: always read `version` from a fresh query.
+
+# Columns of related rows shown in workbooks and BI facts: renaming them changes the
+# content of every recaudacion that references the row
+DISPLAYED_COLUMNS = {
+    Salon: ("nombre",),
+    Maquina: ("nombre", "numero_serie"),
+    Puesto: ("numero_puesto", "descripcion"),
+}
+
+@event.listens_for(Session, "before_flush")
+def _collect_recaudacion_writes(session, flush_context, instances):
+    touched = session.info.setdefault("recaudacion_touched", set())
+    renamed = session.info.setdefault("recaudacion_renamed", {})
+    for obj in chain(session.dirty, session.new, session.deleted):
+        if isinstance(obj, RecaudacionMaquina):
+            if obj.recaudacion_id and (obj in session.new or obj in session.deleted or session.is_modified(obj)):
+                touched.add(obj.recaudacion_id)
+        elif isinstance(obj, Recaudacion):
+            if obj in session.dirty and session.is_modified(obj, include_collections=False):
+                touched.add(obj.id)
+        elif type(obj) in DISPLAYED_COLUMNS and obj in session.dirty:
+            attrs = inspect(obj).attrs
+            if any(attrs[name].history.has_changes() for name in DISPLAYED_COLUMNS[type(obj)]):
+                renamed.setdefault(type(obj), set()).add(obj.id)
+
+@event.listens_for(Session, "after_flush")
+def _bump_recaudacion_version(session, flush_context):
+    touched = session.info.pop("recaudacion_touched", None)
+    renamed = session.info.pop("recaudacion_renamed", None) or {}
+    recs = Recaudacion.__table__
+    details = RecaudacionMaquina.__table__
+    conditions = []
+    if touched:
+        conditions.append(recs.c.id.in_(touched))
+    if Salon in renamed:
+        conditions.append(recs.c.salon_id.in_(renamed[Salon]))
+    for model, column in ((Maquina, details.c.maquina_id), (Puesto, details.c.puesto_id)):
+        if model in renamed:
+            conditions.append(recs.c.id.in_(select(details.c.recaudacion_id).where(column.in_(renamed[model]))))
+    if conditions:
+        session.connection().execute(
+            update(recs)
+            .where(or_(*conditions))
+            .values(version=recs.c.version + 1)
+        )
+
+
+# --- Blob References ---
+# Every RecaudacionFichero row pointing to a blob holds one reference. Adjusted in
+# before_flush (the blob row must exist before the fichero insert) with atomic upserts /
+# decrements. Blobs left at 0 are removed by file_storage.blob_store.collect().
+
+@event.listens_for(Session, "before_flush")
+def _count_blob_references(session, flush_context, instances):
+    deltas = Counter()
+    sizes = {}
+    for obj in session.new:
+        if isinstance(obj, RecaudacionFichero) and obj.blob_hash:
+            deltas[obj.blob_hash] += 1
+            sizes[obj.blob_hash] = obj.file_size
+    for obj in session.deleted:
+        if isinstance(obj, RecaudacionFichero) and obj.blob_hash:
+            deltas[obj.blob_hash] -= 1
+
+    blobs = FicheroBlob.__table__
+    for content_hash, delta in sorted(deltas.items()): # Sorted: consistent row lock order
+        if delta > 0:
+            stmt = pg_insert(blobs).values(
+                content_hash=content_hash,
+                file_size=sizes[content_hash],
+                ref_count=delta,
+                created_at=datetime.now()
+            )
+            session.connection().execute(stmt.on_conflict_do_update(
+                index_elements=[blobs.c.content_hash],
+                set_={"ref_count": blobs.c.ref_count + stmt.excluded.ref_count}
+            ))
+        elif delta < 0:
+            session.connection().execute(
+                update(blobs)
+                .where(blobs.c.content_hash == content_hash)
+                .values(ref_count=blobs.c.ref_count + delta)
+            )
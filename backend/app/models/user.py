@@ -52,6 +52,7 @@ class Usuario(Base):
     direccion_postal = Column(String, nullable=True)
     notas = Column(String, nullable=True)
     ultimo_acceso = Column(String, nullable=True) # Using String for simplicity/datetime sync, or could use DateTime
+    auth_version = Column(Integer, nullable=False, default=1, server_default="1") # Bumped when the user or their salon permissions change
 
     roles = relationship("Rol", secondary=usuario_rol, backref="usuarios")
     
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import date, datetime
 from pydantic import BaseModel
 from decimal import Decimal
@@ -90,6 +90,8 @@ class RecaudacionFichero(BaseModel):
     recaudacion_id: int
     filename: str
     content_type: Optional[str]
+    content_hash: Optional[str] = None
+    file_size: Optional[int] = None
     created_at: Optional[datetime] = None
 
     class Config:
@@ -111,3 +113,43 @@ class RecaudacionMaquinaBulkUpdate(BaseModel):
     cajon: Optional[Decimal]
     pago_manual: Optional[Decimal]
     ajuste: Optional[Decimal]
+
+class RecaudacionImportJob(BaseModel):
+    id: int
+    recaudacion_id: int
+    fichero_id: Optional[int] = None
+    status: str
+    progress: int = 0
+    total_rows: int = 0
+    updated_rows: int = 0
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class RecaudacionExportJobCreate(BaseModel):
+    kind: Literal["xlsx", "csv", "ndjson"] # xlsx: combined workbook (needs salons + dates), csv/ndjson: detail facts
+    salon_ids: Optional[List[int]] = None
+    fecha_desde: Optional[date] = None
+    fecha_hasta: Optional[date] = None
+
+class RecaudacionExportJob(BaseModel):
+    id: int
+    kind: str
+    params: Optional[dict] = None
+    status: str
+    progress: int = 0
+    error: Optional[str] = None
+    filename: Optional[str] = None
+    file_size: Optional[int] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
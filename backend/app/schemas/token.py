@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Dict, Optional
 from pydantic import BaseModel
 
 class Token(BaseModel):
@@ -7,3 +7,7 @@ class Token(BaseModel):
 
 class TokenPayload(BaseModel):
     sub: Optional[str] = None
+    av: Optional[int] = None # Usuario.auth_version when the token was issued
+    # Permission tokens (TOKEN_PERMISSIONS): {salon_id: bitmap of PERMISSION_BITS}, admin flag
+    perms: Optional[Dict[str, int]] = None
+    adm: Optional[bool] = None
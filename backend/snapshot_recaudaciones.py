@@ -0,0 +1,24 @@
+import argparse
+import asyncio
+import logging
+from app.db.session import AsyncSessionLocal
+from app.core.snapshot import write_snapshot, SNAPSHOT_DIR
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Parquet snapshot of recaudacion facts for offline analysis.
+# Usage: python snapshot_recaudaciones.py [--incremental] [--output DIR]
+
+async def main(incremental: bool, output: str):
+    logger.info(f"Writing {'incremental' if incremental else 'full'} snapshot to {output}...")
+    async with AsyncSessionLocal() as db:
+        result = await write_snapshot(db, incremental=incremental, root=output)
+    logger.info(f"Done: {result}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the recaudacion Parquet snapshot")
+    parser.add_argument("--incremental", action="store_true", help="Only rewrite partitions changed since the last snapshot")
+    parser.add_argument("--output", default=SNAPSHOT_DIR, help="Snapshot directory")
+    args = parser.parse_args()
+    asyncio.run(main(args.incremental, args.output))
@@ -0,0 +1,32 @@
+import argparse
+import asyncio
+import json
+import logging
+from app.db.session import AsyncSessionLocal
+from app.core.storage_gc import collect_orphans, storage_report
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Upload storage maintenance: orphaned files (no recaudacion_fichero / fichero_blob row)
+# and usage per salon / year.
+# Usage: python storage_maintenance.py [--mode report|quarantine|delete] [--no-usage]
+
+async def main(mode: str, usage: bool):
+    async with AsyncSessionLocal() as db:
+        logger.info(f"Reconciling upload tree ({mode})...")
+        orphans = await collect_orphans(db, mode=mode)
+        logger.info(f"Orphans: {orphans['orphan_files']} files, {orphans['orphan_bytes']} bytes")
+        result = {"orphans": orphans}
+        if usage:
+            logger.info("Computing storage usage...")
+            result["usage"] = await storage_report(db)
+    print(json.dumps(result, indent=2, default=str))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find orphaned uploads and report storage usage")
+    parser.add_argument("--mode", choices=["report", "quarantine", "delete"], default="report",
+                        help="report: dry run; quarantine: move orphans under UPLOAD_DIR/quarantine; delete: remove them")
+    parser.add_argument("--no-usage", action="store_true", help="Skip the per salon / year usage report")
+    args = parser.parse_args()
+    asyncio.run(main(args.mode, not args.no_usage))
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.db.base  # noqa: F401 (registers every model)
+from app.core.excel_export import build_recaudacion_workbook
+from app.core.excel_import import parse_import_workbook, sniff_workbook
+from app.core.export_stream import export_sheets_data
+from app.crud.crud_recaudacion import recaudacion
+from app.db.base_class import Base
+from app.models.machine import Maquina, TipoMaquina
+from app.models.recaudacion import Recaudacion, RecaudacionMaquina
+from app.models.salon import Salon
+
+MACHINES = ["RULETA 1", "RULETA 2", "BINGO"]
+
+
+async def _round_trip():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        Local = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        async with Local() as db:
+            tipo = TipoMaquina(nombre="Ruleta", tasa_semanal_orientativa=10)
+            salon = Salon(nombre="Sala Centro")
+            db.add_all([tipo, salon])
+            await db.flush()
+            maquinas = [Maquina(nombre=n, salon_id=salon.id, tipo_maquina_id=tipo.id) for n in MACHINES]
+            rec = Recaudacion(
+                salon_id=salon.id, fecha_inicio=datetime(2026, 9, 1), fecha_fin=datetime(2026, 9, 8),
+                fecha_cierre=datetime(2026, 9, 8).date(), total_tasas=30
+            )
+            db.add_all(maquinas + [rec])
+            await db.flush()
+            db.add_all([
+                RecaudacionMaquina(recaudacion_id=rec.id, maquina_id=m.id, retirada_efectivo=100, cajon=5, pago_manual=0, tasa_estimada=10)
+                for m in maquinas
+            ])
+            await db.commit()
+
+            rec = await recaudacion.get(db, id=rec.id)
+            content = build_recaudacion_workbook((await export_sheets_data(db, [rec]))[0])
+            parsed = parse_import_workbook(content)
+            _, matches, unmatched = await recaudacion._match_import_rows(db, rec=rec, parsed=parsed)
+            return content, parsed, matches, unmatched
+    finally:
+        await engine.dispose()
+
+
+def test_exported_workbook_imports_without_unmatched_rows():
+    content, parsed, matches, unmatched = asyncio.run(_round_trip())
+    assert parsed["is_normalized"]
+    assert sorted(r["name"] for r in parsed["rows"]) == sorted(MACHINES)
+    assert len(matches) == len(MACHINES)
+    assert unmatched == []
+    # The TOTAL footer is not offered as a machine name either
+    assert sniff_workbook(content, with_names=True)["names"] == sorted(MACHINES)
@@ -0,0 +1,84 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.db.base  # noqa: F401 (registers every model)
+from app.core import security
+from app.db.base_class import Base
+from app.db.session import get_db
+from app.main import app
+from app.models.recaudacion import Recaudacion, RecaudacionFichero
+from app.models.salon import Salon
+from app.models.user import Usuario
+
+CONTENT = b"0123456789abcdefghij"
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "stored.bin"
+    path.write_bytes(CONTENT)
+    engine = create_async_engine("sqlite+aiosqlite://")
+    Local = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with Local() as db:
+            salon = Salon(nombre="Sala Centro")
+            user = Usuario(username="admin", hash_password="x", activo=True, auth_version=1)
+            db.add_all([salon, user])
+            await db.flush()
+            rec = Recaudacion(
+                salon_id=salon.id, fecha_inicio=datetime(2026, 9, 1), fecha_fin=datetime(2026, 9, 8),
+                fecha_cierre=datetime(2026, 9, 8).date()
+            )
+            db.add(rec)
+            await db.flush()
+            fichero = RecaudacionFichero(
+                recaudacion_id=rec.id, file_path=str(path), filename="stored.bin",
+                content_type="application/octet-stream", content_hash="abc123"
+            )
+            db.add(fichero)
+            await db.commit()
+            return user.id, fichero.id
+
+    user_id, file_id = asyncio.run(setup())
+
+    async def get_test_db():
+        async with Local() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = get_test_db
+    token = security.create_access_token(user_id, auth_version=1)
+    yield TestClient(app), f"/api/v1/recaudaciones/files/{file_id}/content?token={token}"
+    app.dependency_overrides.pop(get_db, None)
+    asyncio.run(engine.dispose())
+
+
+def test_range_request_gets_partial_content(client):
+    client, url = client
+    response = client.get(url, headers={"Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 0-9/{len(CONTENT)}"
+    assert response.content == CONTENT[:10]
+
+
+def test_if_range_with_another_etag_gets_the_whole_file(client):
+    client, url = client
+    response = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_if_none_match_answers_not_modified(client):
+    client, url = client
+    response = client.get(url, headers={"If-None-Match": '"abc123"'})
+    assert response.status_code == 304
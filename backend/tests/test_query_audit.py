@@ -0,0 +1,92 @@
+import asyncio
+import logging
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from app.core.query_audit import QueryAuditMiddleware, QueryBudgetExceeded, fingerprint, query_budget
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    yield engine
+    engine.dispose()
+
+
+def test_fingerprint_replaces_parameters_and_literals():
+    assert fingerprint("SELECT a FROM t WHERE id = $1 AND name = 'o''k' LIMIT 10") == \
+        "SELECT a FROM t WHERE id = ? AND name = ? LIMIT ?"
+    assert fingerprint("SELECT a::INTEGER[] FROM t WHERE id = :id_1") == "SELECT a::INTEGER[] FROM t WHERE id = ?"
+
+
+@pytest.mark.parametrize("statement", [
+    "SELECT a FROM t WHERE id IN ($1)",
+    "SELECT a FROM t WHERE id IN ($1, $2, $3)",
+    "SELECT a FROM t WHERE id IN ($1::INTEGER)",
+    "SELECT a FROM t WHERE id IN ($1::INTEGER, $2::INTEGER, $3::INTEGER)",
+    "SELECT a FROM t WHERE id IN (?, ?)",
+])
+def test_fingerprint_folds_in_lists(statement):
+    assert fingerprint(statement) == "SELECT a FROM t WHERE id IN (?...)"
+
+
+def test_fingerprint_folds_casts_with_arguments():
+    assert fingerprint("INSERT INTO t (a, b) VALUES ($1::NUMERIC(10, 2), $2::TIMESTAMP WITHOUT TIME ZONE)") == \
+        "INSERT INTO t (a, b) VALUES (?...)"
+
+
+def test_query_budget_within(engine):
+    with query_budget(2) as log:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+    assert log.total == 2
+    assert log.shapes == {"SELECT ?": 2}
+
+
+def test_query_budget_exceeded(engine):
+    with pytest.raises(QueryBudgetExceeded) as exc_info:
+        with query_budget(1):
+            with engine.connect() as conn:
+                for i in range(3):
+                    conn.execute(text("SELECT :i"), {"i": i})
+    assert exc_info.value.log.total == 3
+    assert "3x SELECT ?" in str(exc_info.value)
+
+
+def test_query_budget_ignores_statements_after_the_block(engine):
+    with query_budget(0) as log:
+        pass
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    assert log.total == 0
+
+
+def _run_request(middleware):
+    scope = {"type": "http", "method": "GET", "path": "/api/v1/items"}
+    asyncio.run(middleware(scope, None, None))
+
+
+def test_audit_middleware_warns_on_repeated_statements(engine, caplog):
+    async def endpoint(scope, receive, send):
+        with engine.connect() as conn:
+            for i in range(4):
+                conn.execute(text("SELECT x FROM (SELECT 1 AS x) WHERE x = :i"), {"i": i})
+
+    with caplog.at_level(logging.WARNING, logger="app.core.query_audit"):
+        _run_request(QueryAuditMiddleware(endpoint, repeat_limit=3))
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert "Possible N+1: GET /api/v1/items ran 4 times" in message
+
+
+def test_audit_middleware_quiet_below_limit(engine, caplog):
+    async def endpoint(scope, receive, send):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 1, 2"))
+
+    with caplog.at_level(logging.WARNING, logger="app.core.query_audit"):
+        _run_request(QueryAuditMiddleware(endpoint, repeat_limit=1))
+    assert not caplog.records
@@ -11,12 +11,40 @@ const api = axios.create({
     },
 });
 
+// Read-your-writes: for a few seconds after our own changes, reads go to the primary DB
+// (the API may serve stats / listings from a read replica that lags slightly behind)
+const READ_PRIMARY_WINDOW_MS = 10000;
+let readPrimaryUntil = 0;
+
+// Permission tokens: when the user's permissions change the API answers 401 with
+// X-Token-Renew. The token is renewed once (shared by concurrent requests) and the
+// request retried, instead of logging the user out.
+let renewing: Promise<string> | null = null;
+
+const renewToken = (): Promise<string> => {
+    if (!renewing) {
+        renewing = api.post('/login/renew-token')
+            .then((response) => {
+                const token = response.data.access_token;
+                localStorage.setItem('token', token);
+                return token;
+            })
+            .finally(() => {
+                renewing = null;
+            });
+    }
+    return renewing;
+};
+
 api.interceptors.request.use(
     (config) => {
         const token = localStorage.getItem('token');
         if (token) {
             config.headers['Authorization'] = `Bearer ${token}`;
         }
+        if (Date.now() < readPrimaryUntil) {
+            config.headers['X-Read-Primary'] = '1';
+        }
         return config;
     },
     (error) => {
@@ -25,10 +53,33 @@ api.interceptors.request.use(
 );
 
 api.interceptors.response.use(
-    (response) => response,
-    (error) => {
+    (response) => {
+        const method = (response.config.method || 'get').toLowerCase();
+        if (method !== 'get' && method !== 'head') {
+            readPrimaryUntil = Date.now() + READ_PRIMARY_WINDOW_MS;
+        }
+        return response;
+    },
+    async (error) => {
         const status = error.response?.status;
         const detail = error.response?.data?.detail;
+        const config = error.config;
+
+        if (
+            status === 401 &&
+            error.response?.headers?.['x-token-renew'] === 'true' &&
+            config && !config._tokenRenewed &&
+            config.url !== '/login/renew-token'
+        ) {
+            config._tokenRenewed = true;
+            try {
+                const token = await renewToken();
+                config.headers['Authorization'] = `Bearer ${token}`;
+                return api(config);
+            } catch {
+                // Falls through to the logout below
+            }
+        }
 
         // Auto-logout triggers
         const isAuthError =